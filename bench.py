@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""Headless benchmarks for the terminal server and file API.
+
+Starts ProperTerminal without Qt on free local ports and drives it with
+websocket and HTTP clients. Results go to stdout (or --output) as JSON so
+runs can be compared across commits; server logging goes to stderr.
+
+    python bench.py                  # everything
+    python bench.py --quick          # smaller sizes, for a smoke run
+    python bench.py --only pty,files --output before.json
+    python bench.py --only replay --cast session.cast   # replay a real recording
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import platform
+import subprocess
+import statistics
+import http.client
+
+import websockets
+
+from proper_terminal import ProperTerminal, OP_INPUT, OP_RESIZE, OP_ACK, LARGE_FILE_BYTES
+
+# Clients ack output in steps of this many bytes (they connect with flow=1)
+ACK_BYTES = 64 * 1024
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def percentiles(samples):
+    """Summary of latency samples in milliseconds"""
+    ordered = sorted(samples)
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 3)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': pick(0.50),
+        'p90_ms': pick(0.90),
+        'p99_ms': pick(0.99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+def start_server(workspace):
+    """A running ProperTerminal whose workspace is the given directory"""
+    server = ProperTerminal(http_port=free_port(), ws_port=free_port(), workspace=workspace)
+    server.start_servers()
+    server.wait_ready(timeout=10)
+    return server
+
+class TerminalClient:
+    """Websocket client attached to one session, acking output as it reads"""
+    def __init__(self, server, session_id, viewer=False):
+        query = 'role=viewer' if viewer else 'flow=1'
+        self.url = f'ws://localhost:{server.ws_port}/ws/{session_id}?{query}'
+        self.viewer = viewer
+        self.websocket = None
+        self.unacked = 0
+        self.received = 0
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        await self.websocket.send(OP_RESIZE + json.dumps({'rows': 24, 'cols': 80}))
+
+    async def send(self, text):
+        await self.websocket.send(OP_INPUT + text)
+
+    async def read(self):
+        """Next chunk of output; control messages are skipped"""
+        while True:
+            message = await self.websocket.recv()
+            if isinstance(message, bytes):
+                break
+        await self.account(message)
+        return message
+
+    async def read_control(self, kind, timeout=600):
+        """Read output until a control message of the given type; returns it"""
+        async def scan():
+            while True:
+                message = await self.websocket.recv()
+                if isinstance(message, bytes):
+                    await self.account(message)
+                    continue
+                control = json.loads(message)
+                if control.get('type') == kind:
+                    return control
+        return await asyncio.wait_for(scan(), timeout)
+
+    async def account(self, message):
+        """Count received output, acking it in ACK_BYTES steps"""
+        self.received += len(message)
+        if self.viewer:
+            return
+        self.unacked += len(message)
+        if self.unacked >= ACK_BYTES:
+            await self.websocket.send(OP_ACK + str(self.unacked))
+            self.unacked = 0
+
+    async def read_until(self, marker, timeout=120):
+        """Read until marker shows up in the output; returns bytes read"""
+        start = self.received
+        tail = b''
+        async def scan():
+            nonlocal tail
+            while True:
+                tail = (tail + await self.read())[-len(marker) - 4096:]
+                if marker in tail:
+                    return
+        await asyncio.wait_for(scan(), timeout)
+        return self.received - start
+
+    async def wait_idle(self, quiet=0.3):
+        """Drain output until the shell has been quiet for a while"""
+        while True:
+            try:
+                await asyncio.wait_for(self.read(), quiet)
+            except asyncio.TimeoutError:
+                return
+
+    async def close(self):
+        await self.websocket.close()
+
+async def new_session(server, clients=1):
+    """Create a session and attach clients once its prompt has settled"""
+    session = server.run_on_loop(server.sessions.create)
+    attached = []
+    for _ in range(clients):
+        client = TerminalClient(server, session.id)
+        await client.connect()
+        attached.append(client)
+    await asyncio.gather(*(client.wait_idle() for client in attached))
+    return session, attached
+
+async def run_command(clients, command, marker_id):
+    """Run a shell command; returns (seconds, output bytes at the slowest client)"""
+    # $(...) keeps the marker itself out of the echoed command line
+    marker = f'__BENCH_{marker_id}_DONE__'.encode()
+    line = f"{command}; echo __BENCH_{marker_id}_$(echo DONE)__\r"
+    start = time.perf_counter()
+    await clients[0].send(line)
+    sizes = await asyncio.gather(*(client.read_until(marker) for client in clients))
+    return time.perf_counter() - start, min(sizes)
+
+async def bench_throughput(server, workdir, size):
+    """PTY output throughput for `yes` and `cat` of a large file"""
+    path = os.path.join(workdir, 'throughput.txt')
+    with open(path, 'wb') as f:
+        line = b'the quick brown fox jumps over the lazy dog 0123456789\n'
+        f.write(line * (size // len(line)))
+
+    session, (client,) = await new_session(server)
+    results = {}
+    for name, command in (('yes', f'yes | head -c {size}'),
+                          ('cat', f'cat {path}')):
+        seconds, received = await run_command([client], command, name)
+        results[name] = {
+            'bytes': received,
+            'seconds': round(seconds, 4),
+            'mb_per_s': round(received / seconds / 1e6, 2),
+        }
+    await client.close()
+    server.run_on_loop(server.sessions.destroy, session.id)
+    return results
+
+async def bench_echo_latency(server, samples):
+    """Time from sending a keystroke to receiving its echo"""
+    session, (client,) = await new_session(server)
+    latencies = await echo_samples(client, samples)
+    await client.close()
+    server.run_on_loop(server.sessions.destroy, session.id)
+    return percentiles(latencies)
+
+async def echo_samples(client, samples):
+    """Echo round trips for single keystrokes, in seconds"""
+    latencies = []
+    for i in range(samples):
+        key = 'abcdefghijklmnopqrstuvwxyz'[i % 26]
+        start = time.perf_counter()
+        await client.send(key)
+        while key.encode() not in await client.read():
+            pass
+        latencies.append(time.perf_counter() - start)
+        if i % 50 == 49:
+            # Clear the line so readline doesn't redraw a long buffer
+            await client.send('\x15')
+            await client.wait_idle(0.1)
+    await client.send('\x15')
+    await client.wait_idle(0.1)
+    return latencies
+
+async def bench_fanout(server, size, counts):
+    """Throughput with N clients attached to one session"""
+    results = {}
+    for count in counts:
+        session, clients = await new_session(server, count)
+        seconds, received = await run_command(clients, f'yes | head -c {size}', f'fan{count}')
+        results[str(count)] = {
+            'clients': count,
+            'bytes_per_client': received,
+            'seconds': round(seconds, 4),
+            'mb_per_s_per_client': round(received / seconds / 1e6, 2),
+            'mb_per_s_total': round(received * count / seconds / 1e6, 2),
+        }
+        for client in clients:
+            await client.close()
+        server.run_on_loop(server.sessions.destroy, session.id)
+    return results
+
+async def bench_viewers(server, size, samples, counts):
+    """The interactive client's throughput and echo latency with N read-only viewers"""
+    async def drain(viewer):
+        while True:
+            await viewer.read()
+
+    results = {}
+    for count in counts:
+        session, (owner,) = await new_session(server)
+        viewers = [TerminalClient(server, session.id, viewer=True) for _ in range(count)]
+        for viewer in viewers:
+            await viewer.connect()
+        readers = [asyncio.create_task(drain(viewer)) for viewer in viewers]
+
+        seconds, received = await run_command([owner], f'yes | head -c {size}', f'view{count}')
+        await owner.wait_idle(0.1)
+        latency = percentiles(await echo_samples(owner, samples))
+        results[str(count)] = {
+            'viewers': count,
+            'mb_per_s': round(received / seconds / 1e6, 2),
+            'echo_latency': latency,
+            'viewer_bytes_min': min((v.received for v in viewers), default=0),
+        }
+        for reader in readers:
+            reader.cancel()
+        for client in [owner] + viewers:
+            await client.close()
+        server.run_on_loop(server.sessions.destroy, session.id)
+    return results
+
+def make_cast(path, size):
+    """Synthetic asciicast: a coloured listing printed in bursts between prompts"""
+    with open(path, 'w') as f:
+        f.write(json.dumps({'version': 2, 'width': 120, 'height': 40}) + '\n')
+        at = 0.0
+        written = 0
+        while written < size:
+            at += 0.5
+            f.write(json.dumps([round(at, 3), 'o', '\x1b[32muser@host\x1b[0m:~$ ']) + '\n')
+            for burst in range(20):
+                at += 0.01
+                text = ''.join(f'\x1b[34mdir{i}\x1b[0m  file{i}.txt  \x1b[1mREADME{i}\x1b[0m\r\n'
+                               for i in range(burst * 50, burst * 50 + 50))
+                f.write(json.dumps([round(at, 3), 'o', text]) + '\n')
+                written += len(text)
+
+async def bench_replay(server, path):
+    """Replay a recording at full speed through the broadcast path"""
+    session = server.run_on_loop(server.sessions.create, None, path, 0)
+    client = TerminalClient(server, session.id)
+    start = time.perf_counter()
+    await client.connect()
+    end = await client.read_control('replay_end')
+    seconds = time.perf_counter() - start
+    await client.close()
+    server.run_on_loop(server.sessions.destroy, session.id)
+    return {
+        'events': end['events'],
+        'bytes': client.received,
+        'seconds': round(seconds, 4),
+        'mb_per_s': round(client.received / seconds / 1e6, 2),
+        'events_per_s': round(end['events'] / seconds),
+    }
+
+def make_tree(root, files, per_dir=50):
+    """Synthetic source tree with the given number of small files"""
+    for i in range(files):
+        directory = os.path.join(root, *(f'd{(i // per_dir ** depth) % per_dir}'
+                                         for depth in (2, 1)))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'file{i}.py'), 'w') as f:
+            f.write(f'# file {i}\n' + 'print("hello")\n' * 20)
+
+def time_requests(server, path, repeat):
+    """Latency samples for repeated GETs on one keep-alive connection"""
+    conn = http.client.HTTPConnection('localhost', server.http_port)
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+        response = conn.getresponse()
+        body = response.read()
+        samples.append(time.perf_counter() - start)
+        if response.status not in (200, 206):
+            raise RuntimeError(f'GET {path}: HTTP {response.status}')
+        size = len(body)
+    conn.close()
+    return dict(percentiles(samples), response_bytes=size)
+
+def bench_files(tree_sizes, repeat, large_size):
+    """File tree and file read latency on synthetic trees"""
+    # The large file has to be over the limit for the editor to page it
+    large_size = max(large_size, 2 * LARGE_FILE_BYTES)
+    results = {}
+    for files in tree_sizes:
+        with tempfile.TemporaryDirectory(prefix='bench-tree-') as root:
+            make_tree(root, files)
+            with open(os.path.join(root, 'large.log'), 'wb') as f:
+                f.write(b'log line with some text in it\n' * (large_size // 30))
+            server = start_server(root)
+            try:
+                results[str(files)] = {
+                    'api_files': time_requests(server, '/api/files', repeat),
+                    'api_list_root': time_requests(server, '/api/list?path=', repeat),
+                    'api_list_dir': time_requests(server, '/api/list?path=d0/d0', repeat),
+                    'api_file_small': time_requests(server, '/api/file/d0/d0/file0.py', repeat),
+                    'api_file_large_page': time_requests(server, '/api/file/large.log', repeat),
+                    'api_raw_large': time_requests(server, '/api/raw/large.log', max(repeat // 10, 3)),
+                }
+            finally:
+                server.stop()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args, workdir):
+    suites = set(args.only.split(',')) if args.only else {'pty', 'latency', 'fanout', 'viewers', 'replay', 'files'}
+    size = 5_000_000 if args.quick else 50_000_000
+    results = {}
+
+    if suites & {'pty', 'latency', 'fanout', 'viewers', 'replay'}:
+        server = start_server(workdir)
+        if 'pty' in suites:
+            results['pty_throughput'] = await bench_throughput(server, workdir, size)
+        if 'latency' in suites:
+            results['echo_latency'] = await bench_echo_latency(server, 50 if args.quick else 500)
+        if 'fanout' in suites:
+            results['fanout'] = await bench_fanout(server, size // 5, [1, 4, 16])
+        if 'viewers' in suites:
+            results['viewers'] = await bench_viewers(
+                server, size // 5, 50 if args.quick else 200, [0, 16, 64])
+        if 'replay' in suites:
+            cast = args.cast
+            if cast is None:
+                cast = os.path.join(workdir, 'synthetic.cast')
+                make_cast(cast, size)
+            results['replay'] = await bench_replay(server, cast)
+        server.stop()
+
+    if 'files' in suites:
+        tree_sizes = [100, 1000] if args.quick else [100, 1000, 10000]
+        results['files'] = await asyncio.to_thread(
+            bench_files, tree_sizes, 10 if args.quick else 50, size // 5)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless terminal/file API benchmarks")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes and fewer samples")
+    parser.add_argument('--only', help="comma-separated suites: pty, latency, fanout, viewers, replay, files")
+    parser.add_argument('--cast', help="asciicast recording for the replay suite (default: synthetic)")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # Keep stdout for the JSON; the server logs every connection
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    started = time.time()
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        results = asyncio.run(run(args, workdir))
+    sys.stdout = stdout
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': started,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': args.quick,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Qt window for proper_terminal.py: terminal, editor and browser panes.
+
+Imported by main() only when the window is shown, so the servers (and
+the search workers that re-import the main module) run without Qt.
+"""
+
+import threading
+import time
+from PyQt6.QtWidgets import (QMainWindow, QWidget, QHBoxLayout, 
+                             QVBoxLayout, QLineEdit, QLabel, QPushButton, 
+                             QSplitter, QFrame)
+from PyQt6.QtWebEngineWidgets import QWebEngineView
+from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineProfile
+from PyQt6.QtCore import Qt, QUrl, pyqtSignal
+
+class LazyWebPane(QWidget):
+    """Splitter pane whose QWebEngineView is only created when first shown.
+    
+    While the pane is collapsed its page is hidden and frozen through the
+    page lifecycle API, so its renderer stops running script and timers.
+    """
+    def __init__(self, profile=None, url=None, parent=None):
+        super().__init__(parent)
+        self.profile = profile
+        self.url = url
+        self.view = None
+        self.on_create = []  # callbacks taking the new view
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+    
+    def load(self, url):
+        """Navigate now if the view exists, else on first reveal"""
+        self.url = url
+        if self.view:
+            self.view.setUrl(QUrl(url))
+        else:
+            self.update_state()
+    
+    def resizeEvent(self, event):
+        # Collapsing a splitter pane resizes it to zero width
+        super().resizeEvent(event)
+        self.update_state()
+    
+    def update_state(self):
+        """Reveal or freeze the view to match whether the pane is on screen"""
+        if self.url:
+            self.set_revealed(self.isVisible() and self.width() > 0)
+    
+    def set_revealed(self, revealed):
+        if not revealed:
+            if self.view and self.view.isVisible():
+                self.view.hide()
+                self.view.page().setLifecycleState(QWebEnginePage.LifecycleState.Frozen)
+            return
+        
+        if self.view is None:
+            self.view = QWebEngineView(self)
+            if self.profile:
+                self.view.setPage(QWebEnginePage(self.profile, self.view))
+            self.layout().addWidget(self.view)
+            for callback in self.on_create:
+                callback(self.view)
+            if self.url:
+                self.view.setUrl(QUrl(self.url))
+        elif not self.view.isVisible():
+            self.view.page().setLifecycleState(QWebEnginePage.LifecycleState.Active)
+            self.view.show()
+
+class MainWindow(QMainWindow):
+    # Emitted from a waiter thread; Qt delivers it on the GUI thread
+    servers_ready = pyqtSignal()
+    
+    def __init__(self, terminal_server, browser_home, web_cache_bytes):
+        super().__init__()
+        self.browser_home = browser_home
+        self.web_cache_bytes = web_cache_bytes
+        self.terminal_server = terminal_server
+        self.init_ui()
+        
+        # Point the views at the servers only once they accept connections
+        self.servers_ready.connect(self.load_views)
+        def wait_for_servers():
+            self.terminal_server.ready.wait()
+            self.servers_ready.emit()
+        threading.Thread(target=wait_for_servers, daemon=True).start()
+        
+    def init_ui(self):
+        self.setWindowTitle("Terminal + Editor + Browser IDE")
+        self.setGeometry(100, 100, 1800, 1000)
+        
+        self.setStyleSheet("""
+            QMainWindow { background-color: #1e1e1e; }
+            QWidget { background-color: #1e1e1e; color: white; }
+            QLineEdit { 
+                background-color: #333; 
+                color: white; 
+                border: 1px solid #666;
+                padding: 8px;
+                font-size: 14px;
+            }
+            QPushButton {
+                background-color: #007acc;
+                color: white;
+                border: none;
+                padding: 8px 16px;
+                border-radius: 4px;
+                font-weight: bold;
+            }
+            QPushButton:hover { background-color: #005a9e; }
+            QLabel { color: #007acc; font-weight: bold; }
+        """)
+        
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        
+        layout = QVBoxLayout(central_widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        
+        # URL bar
+        url_frame = QFrame()
+        url_frame.setFixedHeight(50)
+        url_frame.setStyleSheet("background-color: #2d2d2d; border-bottom: 2px solid #007acc;")
+        url_layout = QHBoxLayout(url_frame)
+        
+        url_layout.addWidget(QLabel("🌐 Browser URL:"))
+        self.url_input = QLineEdit(self.browser_home)
+        self.url_input.returnPressed.connect(self.load_url)
+        url_layout.addWidget(self.url_input)
+        
+        go_btn = QPushButton("Go")
+        go_btn.clicked.connect(self.load_url)
+        url_layout.addWidget(go_btn)
+        
+        layout.addWidget(url_frame)
+        
+        # Splitter for 3 panes
+        self.splitter = QSplitter(Qt.Orientation.Horizontal)
+        self.splitter.setChildrenCollapsible(True)
+        layout.addWidget(self.splitter)
+        
+        # The terminal and editor are our own pages: one profile (one
+        # cache, one renderer with --process-per-site) serves both
+        self.profile = QWebEngineProfile('proper-terminal', self)
+        self.profile.setHttpCacheType(QWebEngineProfile.HttpCacheType.DiskHttpCache)
+        self.profile.setHttpCacheMaximumSize(self.web_cache_bytes)
+        
+        # Views are created on first reveal; see LazyWebPane
+        self.terminal_pane = LazyWebPane(self.profile)   # xterm.js
+        self.editor_pane = LazyWebPane(self.profile)     # Monaco Editor
+        self.browser_pane = LazyWebPane(url=self.browser_home)
+        for pane in (self.terminal_pane, self.editor_pane, self.browser_pane):
+            self.splitter.addWidget(pane)
+        
+        # Terminal and editor split the window; the browser opens on demand
+        self.splitter.setSizes([700, 1100, 0])
+    
+    def load_views(self):
+        """First load of the terminal and editor, once the servers are up"""
+        if self.terminal_server.startup_error:
+            self.terminal_pane.set_revealed(True)
+            self.terminal_pane.view.setHtml(f"<pre style='color: #f44'>Server failed to start: "
+                                            f"{self.terminal_server.startup_error}</pre>")
+            return
+        
+        launched = self.terminal_server.launched
+        def loaded(name):
+            def log(ok):
+                print(f"{name} view {'loaded' if ok else 'failed to load'} after "
+                      f"{(time.monotonic() - launched) * 1000:.0f} ms")
+            return lambda view: view.loadFinished.connect(log)
+        self.terminal_pane.on_create.append(loaded("Terminal"))
+        self.editor_pane.on_create.append(loaded("Editor"))
+        
+        base_url = f"http://localhost:{self.terminal_server.http_port}"
+        self.terminal_pane.load(base_url)
+        self.editor_pane.load(base_url + "/editor")
+        
+    def load_url(self):
+        url = self.url_input.text().strip()
+        if not url.startswith(('http://', 'https://')):
+            if '.' in url and ' ' not in url:
+                url = 'https://' + url
+            else:
+                url = f"https://www.google.com/search?q={url.replace(' ', '+')}"
+        
+        self.browser_pane.load(url)
+        self.url_input.setText(url)
+        
+        # Open the browser pane if it's collapsed; it loads once resized
+        sizes = self.splitter.sizes()
+        if sizes[2] == 0:
+            third = sum(sizes) // 3
+            self.splitter.setSizes([third, sum(sizes) - 2 * third, third])
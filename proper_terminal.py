@@ -3,38 +3,3675 @@
 import sys
 import os
 import pty
-import select
+import time
+import signal
+import secrets
 import subprocess
+import tempfile
 import threading
 import json
+import io
+import gzip
+import errno
+import struct
+import fcntl
+import termios
+import ctypes
+import ctypes.util
+import hashlib
+import mimetypes
+import re
+import codecs
+import collections
+import functools
+import itertools
+import pickle
+import multiprocessing
+import bisect
+import heapq
+import unicodedata
 import asyncio
+import argparse
+import concurrent.futures
 import websockets
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, 
-                             QVBoxLayout, QLineEdit, QLabel, QPushButton, 
-                             QSplitter, QFrame)
-from PyQt6.QtWebEngineWidgets import QWebEngineView
-from PyQt6.QtCore import Qt, QUrl
+from websockets.frames import CTRL_OPCODES, OP_CONT
+from websockets.extensions.permessage_deflate import (PerMessageDeflate,
+                                                      ServerPerMessageDeflateFactory)
+from urllib.parse import urlparse, parse_qs, unquote
 from bottle import Bottle
 
-class ProperTerminal:
+# Per-client limit on queued output chunks before a slow client is dropped
+SEND_QUEUE_SIZE = 256
+
+# PTY output is batched for up to COALESCE_DELAY seconds or COALESCE_BYTES
+COALESCE_DELAY = 0.005
+COALESCE_BYTES = 64 * 1024
+
+# Reading the PTY pauses when a client has HIGH_WATERMARK bytes written but
+# not yet acked by xterm.js, and resumes once every client is below LOW_WATERMARK
+HIGH_WATERMARK = 256 * 1024
+LOW_WATERMARK = 32 * 1024
+
+# Client resizes are applied once the requested size has been steady for
+# RESIZE_DEBOUNCE seconds, so dragging a divider sends the shell one
+# SIGWINCH instead of dozens. With several clients attached the PTY takes
+# the smallest rows and columns any of them asked for ('smallest'), or the
+# size of the longest-attached client ('owner')
+RESIZE_DEBOUNCE = 0.1
+RESIZE_POLICY = 'smallest'
+RESIZE_POLICIES = ('smallest', 'owner')
+MAX_TERMINAL_SIZE = 4096  # rows or columns
+
+# Read-only viewers (?role=viewer) get each output chunk through one shared
+# broadcast instead of a queue each. A viewer with more than VIEWER_LAG_BYTES
+# unsent is skipped until it drains below VIEWER_RESYNC_BYTES and is then
+# redrawn; one still behind after VIEWER_DROP_AFTER seconds is disconnected
+VIEWER_LAG_BYTES = 1024 * 1024
+VIEWER_RESYNC_BYTES = 64 * 1024
+VIEWER_DROP_AFTER = 30.0
+VIEWER_CHECK_INTERVAL = 0.25
+
+# Bytes of PTY output each session keeps for replay to reconnecting clients
+SCROLLBACK_BYTES = 1024 * 1024
+
+# Optional server-side screen model: new clients get a redraw of the
+# screen plus this many lines of history instead of the raw byte replay
+SCREEN_MODEL = False
+SCREEN_SCROLLBACK_LINES = 1000
+
+# Session recording (--record DIR) writes asciicast v2 files in batches
+# every RECORD_FLUSH_INTERVAL seconds, off the loop, starting a new file
+# once one passes RECORD_MAX_BYTES. Replays read REPLAY_BATCH events at a
+# time; a speed of 0 replays as fast as clients keep up
+RECORD_FLUSH_INTERVAL = 0.5
+RECORD_MAX_BYTES = 64 * 1024 * 1024
+REPLAY_BATCH = 1000
+REPLAY_SPEED = 1.0
+
+# Client-to-server frames start with a one-character opcode. Input goes to
+# the PTY as-is; only the rare control frames carry a parsed payload.
+#   0<data>               terminal input (text, or raw bytes in binary frames)
+#   1{"rows":R,"cols":C}  resize
+#   2<token>              latency probe, answered with {"type":"pong","token":...}
+#   3<count>              ack of rendered output bytes (flow control)
+OP_INPUT = '0'
+OP_RESIZE = '1'
+OP_PING = '2'
+OP_ACK = '3'
+
+# Input is written to the non-blocking PTY in chunks of at most INPUT_CHUNK
+# bytes; while MAX_PENDING_INPUT bytes are queued, further input frames are
+# held back (acks, resizes and pings are still read) until half has drained
+INPUT_CHUNK = 4096
+MAX_PENDING_INPUT = 1024 * 1024
+
+# Where the servers listen, remote mode included: the shell isn't
+# authenticated, so exposing it takes an explicit --host
+HOST = 'localhost'
+HTTP_PORT = 8080
+WS_PORT = 8081
+
+# HTTP serving: requests run on a pool of HTTP_WORKERS threads; idle
+# keep-alive connections are dropped after KEEPALIVE_TIMEOUT seconds.
+# Responses of GZIP_TYPES over GZIP_MIN_SIZE bytes are gzipped
+HTTP_WORKERS = 8
+KEEPALIVE_TIMEOUT = 15.0
+MAX_REQUEST_HEAD = 64 * 1024
+MAX_REQUEST_BODY = 64 * 1024 * 1024
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+GZIP_TYPES = {'application/json', 'text/html', 'text/plain', 'text/css',
+              'application/javascript', 'text/javascript'}
+
+# Qt window: the terminal and editor share one WebEngine profile whose
+# HTTP cache is capped at WEB_CACHE_BYTES; the browser pane starts
+# collapsed and loads BROWSER_HOME when first opened
+WEB_CACHE_BYTES = 64 * 1024 * 1024
+BROWSER_HOME = 'https://www.google.com'
+
+# Metrics: the event loop's wake-up lag is sampled every LAG_INTERVAL
+# seconds; HTTP latency and loop lag histograms use these bucket bounds
+LAG_INTERVAL = 0.5
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Front-end assets: the bundle vendor_assets.py writes to STATIC_DIR, or
+# the CDN when there is none. Bundle URLs are content-hashed and immutable
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_CDN = 'https://cdn.jsdelivr.net/npm'
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# permessage-deflate tuning for PTY output; frames smaller than
+# COMPRESS_MIN_SIZE (keystroke echo) are sent uncompressed
+COMPRESS_LEVEL = 6
+COMPRESS_WINDOW_BITS = 12
+COMPRESS_MEM_LEVEL = 5
+COMPRESS_CONTEXT_TAKEOVER = True
+COMPRESS_MIN_SIZE = 128
+
+# Workspace listings: entries per page, cached directories, and dotfiles
+# that stay visible; .gitignore'd entries are pruned from listings
+LIST_PAGE_SIZE = 500
+DIR_CACHE_SIZE = 2048
+VISIBLE_DOTFILES = {'.gitignore', '.env'}
+ALWAYS_IGNORED = {'.git'}
+
+# File contents: files over LARGE_FILE_BYTES open read-only in the editor,
+# FILE_PAGE_SIZE bytes at a time; the first SNIFF_BYTES decide whether a
+# file is binary. Files up to CONTENT_CACHE_MAX_FILE are kept in an LRU
+# capped at CONTENT_CACHE_BYTES; raw downloads stream in STREAM_CHUNKs
+LARGE_FILE_BYTES = 2 * 1024 * 1024
+FILE_PAGE_SIZE = 256 * 1024
+SNIFF_BYTES = 8192
+CONTENT_CACHE_BYTES = 64 * 1024 * 1024
+CONTENT_CACHE_MAX_FILE = 4 * 1024 * 1024
+STREAM_CHUNK = 64 * 1024
+
+def default_file_mode():
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return 0o666 & ~mask
+
+# Permission bits for files created from the editor (mkstemp uses 0600)
+NEW_FILE_MODE = default_file_mode()
+
+# Workspace search: files go to worker processes in batches growing from
+# SEARCH_FIRST_BATCH to SEARCH_BATCH; larger files than SEARCH_MAX_FILE
+# are skipped. The optional trigram index lives in INDEX_DIR; its filters
+# are halved until they fit in TRIGRAM_INDEX_MAX_BYTES together
+SEARCH_FIRST_BATCH = 8
+SEARCH_BATCH = 128
+SEARCH_MAX_RESULTS = 1000
+SEARCH_MAX_PER_FILE = 100
+SEARCH_MAX_FILE = 4 * 1024 * 1024
+SEARCH_CONTEXT_CHARS = 240
+TRIGRAM_MAX_BITS = 1 << 16
+TRIGRAM_INDEX_MAX_BYTES = 32 * 1024 * 1024
+INDEX_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                         'proper_terminal')
+
+# Quick open answers with the best QUICKOPEN_RESULTS paths (at most
+# QUICKOPEN_MAX_RESULTS on request), scoring no more than QUICKOPEN_MAX_SCORED
+# candidates per query. Without a file watcher the path index is rebuilt
+# when a query finds it older than PATH_INDEX_MAX_AGE seconds
+QUICKOPEN_RESULTS = 50
+QUICKOPEN_MAX_RESULTS = 500
+QUICKOPEN_MAX_SCORED = 2000
+QUICKOPEN_MAX_QUERY = 64
+PATH_INDEX_MAX_AGE = 30.0
+
+# Workspace change events are batched for WATCH_COALESCE_DELAY seconds
+# before being pushed to the editor over the /fs WebSocket
+WATCH_COALESCE_DELAY = 0.1
+
+# Session registry limits; the terminal page at / attaches to DEFAULT_SESSION
+MAX_SESSIONS = 64
+REAP_INTERVAL = 5.0
+DEFAULT_SESSION = 'default'
+
+# Login shells kept started and waiting for new sessions, so opening a
+# terminal doesn't wait for the shell's startup files. A waiting shell
+# older than SHELL_POOL_IDLE seconds is replaced with a fresh one
+SHELL_POOL_SIZE = 1
+SHELL_POOL_IDLE = 600.0
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that leaves small messages uncompressed.
+    
+    RFC 7692 lets any message go out with RSV1 clear, so skipping the
+    compressor for short frames is invisible to the peer. Also counts
+    payload and wire bytes so callers can report the compression ratio.
+    """
+    def __init__(self, *args, min_size=COMPRESS_MIN_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.payload_bytes = 0
+        self.wire_bytes = 0
+    
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        self.payload_bytes += len(frame.data)
+        if frame.opcode is not OP_CONT and frame.fin and len(frame.data) < self.min_size:
+            self.wire_bytes += len(frame.data)
+            return frame
+        frame = super().encode(frame)
+        self.wire_bytes += len(frame.data)
+        return frame
+
+class CompressionFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate using ThresholdPerMessageDeflate"""
+    def __init__(self, min_size=COMPRESS_MIN_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+    
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
+
+def compression_extensions(level=COMPRESS_LEVEL, window_bits=COMPRESS_WINDOW_BITS,
+                           mem_level=COMPRESS_MEM_LEVEL,
+                           context_takeover=COMPRESS_CONTEXT_TAKEOVER,
+                           min_size=COMPRESS_MIN_SIZE):
+    """WebSocket server extensions for the given compression settings"""
+    if level == 0:
+        return []
+    return [CompressionFactory(
+        min_size=min_size,
+        server_no_context_takeover=not context_takeover,
+        server_max_window_bits=window_bits,
+        client_max_window_bits=window_bits,
+        compress_settings={'level': level, 'memLevel': mem_level},
+    )]
+
+# An escape sequence at the start of the string: CSI, or ESC plus one char
+ESCAPE_SEQUENCE = re.compile(rb'\x1b(?:\[[\x30-\x3f]*[\x20-\x2f]*[\x40-\x7e]|[^\[])')
+
+def input_chunk_end(data, limit):
+    """Where to cut data for one PTY write of at most limit bytes.
+    
+    Never splits an escape sequence (such as the bracketed paste markers
+    ESC[200~ and ESC[201~) or a UTF-8 character across two writes, so a
+    program never sees half a sequence followed by a pause.
+    """
+    if len(data) <= limit:
+        return len(data)
+    end = limit
+    esc = data.rfind(b'\x1b', max(0, end - 16), end)
+    if esc > 0:
+        match = ESCAPE_SEQUENCE.match(data, esc)
+        if match is None or match.end() > end:
+            end = esc
+    while end > 1 and data[end] & 0xC0 == 0x80:
+        end -= 1
+    return end
+
+def glob_to_regex(pattern):
+    """Translate a gitignore glob into a regex over '/'-separated paths"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out.append('[' + body + ']')
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+class GitIgnore:
+    """Patterns from one .gitignore, matched against paths relative to it"""
+    def __init__(self, lines):
+        self.rules = []  # (regex, negated, dir_only)
+        for line in lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated or line.startswith('\\'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            # A slash anywhere but the end anchors the pattern to this directory
+            anchored = '/' in line
+            regex = glob_to_regex(line.lstrip('/'))
+            regex = ('^' if anchored else '(?:^|/)') + regex + '$'
+            self.rules.append((re.compile(regex), negated, dir_only))
+    
+    def match(self, relpath, is_dir):
+        """True if ignored, False if re-included by a ! rule, None if no rule applies"""
+        result = None
+        for regex, negated, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.search(relpath):
+                result = not negated
+        return result
+
+class IgnoreRules:
+    """.gitignore files from the workspace root downwards, reloaded on change"""
+    def __init__(self, root):
+        self.root = root
+        self.files = {}  # directory -> (mtime_ns or None, GitIgnore or None)
+        self.lock = threading.Lock()
+    
+    def load(self, directory):
+        path = os.path.join(directory, '.gitignore')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self.lock:
+            cached = self.files.get(directory)
+        if cached and cached[0] == mtime:
+            return cached
+        
+        rules = None
+        if mtime is not None:
+            try:
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    rules = GitIgnore(f)
+            except OSError:
+                pass
+        with self.lock:
+            self.files[directory] = (mtime, rules)
+        return mtime, rules
+    
+    def chain(self, directory):
+        """(base, mtime, rules) for every .gitignore that applies in directory"""
+        dirs = [directory]
+        while dirs[-1] != self.root and len(dirs[-1]) > len(self.root):
+            dirs.append(os.path.dirname(dirs[-1]))
+        return [(base, *self.load(base)) for base in reversed(dirs)]
+    
+    def is_hidden(self, chain, directory, name, is_dir):
+        """Whether an entry is left out of the workspace tree"""
+        if name.startswith('.') and name not in VISIBLE_DOTFILES:
+            return True
+        return self.is_ignored(chain, directory, name, is_dir)
+    
+    def is_ignored(self, chain, directory, name, is_dir):
+        if name in ALWAYS_IGNORED:
+            return True
+        path = os.path.join(directory, name)
+        ignored = False
+        for base, _, rules in chain:
+            if rules:
+                relpath = path[len(base) + 1:].replace(os.sep, '/')
+                result = rules.match(relpath, is_dir)
+                if result is not None:
+                    ignored = result
+        return ignored
+
+class DirectoryListingCache:
+    """Sorted, ignore-filtered scandir results per directory.
+    
+    A listing is reused until the directory's mtime or one of the
+    applicable .gitignore files changes; the stamp doubles as the ETag.
+    """
+    def __init__(self, root, max_dirs=DIR_CACHE_SIZE):
+        self.root = root
+        self.max_dirs = max_dirs
+        self.ignore = IgnoreRules(root)
+        self.listings = collections.OrderedDict()  # directory -> (stamp, etag, entries)
+        self.lock = threading.Lock()
+    
+    def listing(self, directory):
+        """(etag, entries) for directory; raises OSError if it can't be read"""
+        chain = self.ignore.chain(directory)
+        stamp = (os.stat(directory).st_mtime_ns, tuple(mtime for _, mtime, _ in chain))
+        with self.lock:
+            cached = self.listings.get(directory)
+            if cached and cached[0] == stamp:
+                self.listings.move_to_end(directory)
+                return cached[1], cached[2]
+        
+        entries = self.scan(directory, chain)
+        etag = hashlib.sha1(repr((directory, stamp)).encode()).hexdigest()[:16]
+        with self.lock:
+            self.listings[directory] = (stamp, etag, entries)
+            self.listings.move_to_end(directory)
+            while len(self.listings) > self.max_dirs:
+                self.listings.popitem(last=False)
+        return etag, entries
+    
+    def scan(self, directory, chain):
+        dirs, files = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                name = entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if self.ignore.is_hidden(chain, directory, name, is_dir):
+                    continue
+                (dirs if is_dir else files).append(name)
+        dirs.sort(key=str.lower)
+        files.sort(key=str.lower)
+        return ([{'name': name, 'type': 'dir'} for name in dirs] +
+                [{'name': name, 'type': 'file'} for name in files])
+
+def sniff_binary(head):
+    """Guess from a file's first bytes whether it is binary.
+    
+    NUL bytes or invalid UTF-8 mean binary; a multi-byte character cut
+    off at the end of the sample doesn't count against it.
+    """
+    if b'\0' in head:
+        return True
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+def decode_page(data):
+    """(text, used) for a page of UTF-8 bytes, leaving any partial
+    character at the end for the next page"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    text = decoder.decode(data, final=False)
+    pending = decoder.getstate()[0]
+    return text, len(data) - len(pending)
+
+def file_version(st, data=None):
+    """Version stamp for a file's contents.
+    
+    Built from the stat result, plus a hash of the contents when they are
+    at hand: an in-place rewrite of the same size within one timestamp
+    tick leaves every stat field the same.
+    """
+    version = '%x-%x-%x-%x' % (st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+    if data is not None:
+        version += '-' + hashlib.sha1(data).hexdigest()[:16]
+    return version
+
+def edits_apply_cleanly(text):
+    """Whether editor offsets into text are offsets into the file.
+    
+    Monaco drops a leading BOM and normalizes lone CRs and mixed line
+    endings, so its offsets only match text without a BOM whose lines all
+    end the same way.
+    """
+    if text.startswith('\ufeff'):
+        return False
+    crlf = text.count('\r\n')
+    return crlf == text.count('\r') and crlf in (0, text.count('\n'))
+
+def utf16_length(text):
+    """Length of text in UTF-16 code units, as JavaScript counts it"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+def valid_edits(edits):
+    """Whether edits is a list of {'offset': int, 'length': int, 'text': str}"""
+    return isinstance(edits, list) and all(
+        isinstance(edit, dict) and isinstance(edit.get('offset'), int) and
+        isinstance(edit.get('length'), int) and isinstance(edit.get('text'), str)
+        for edit in edits)
+
+def apply_text_edits(text, edits):
+    """Apply editor edits to text.
+    
+    Each edit is {'offset', 'length', 'text'} with offset and length in
+    UTF-16 code units (what Monaco reports), applied in order against
+    the result of the previous one. Raises ValueError on a bad range.
+    """
+    if text.isascii():
+        # Code points and UTF-16 units line up; skip the re-encoding
+        for edit in edits:
+            start = edit['offset']
+            end = start + edit['length']
+            if not 0 <= start <= end <= len(text):
+                raise ValueError(f"edit range {start}-{end} outside the document")
+            text = text[:start] + edit['text'] + text[end:]
+        return text
+    
+    units = bytearray(text.encode('utf-16-le'))
+    for edit in edits:
+        start = edit['offset'] * 2
+        end = start + edit['length'] * 2
+        if not 0 <= start <= end <= len(units):
+            raise ValueError(f"edit range {edit['offset']}-{edit['offset'] + edit['length']} "
+                             f"outside the document")
+        units[start:end] = edit['text'].encode('utf-16-le')
+    # Strict decode: an edit that split a surrogate pair raises ValueError
+    return units.decode('utf-16-le')
+
+def cross_origin(request):
+    """Whether a request was sent by a page from another origin.
+    
+    Browsers send Origin on cross-origin POSTs, including the "simple"
+    ones that skip the CORS preflight.
+    """
+    origin = request.headers.get('Origin')
+    return origin is not None and urlparse(origin).netloc != request.headers.get('Host')
+
+def atomic_write(abs_path, data):
+    """Replace abs_path with data via a temp file and rename; returns the new stat.
+    
+    Readers see the old or the new contents, never a partial write, and an
+    existing file keeps its permission bits.
+    """
+    directory, name = os.path.split(abs_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(abs_path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, NEW_FILE_MODE)
+        os.replace(tmp_path, abs_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return os.stat(abs_path)
+
+class FileContentCache:
+    """LRU cache of small files' bytes keyed by path and stat fields.
+    
+    Files larger than max_file are never cached so one big read can't
+    evict everything else; the cache as a whole stays under max_bytes.
+    """
+    def __init__(self, max_bytes=CONTENT_CACHE_BYTES, max_file=CONTENT_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.entries = collections.OrderedDict()  # key() -> bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def key(abs_path, st):
+        # Inode and ctime catch replacements that keep the mtime and size
+        return (abs_path, st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+    
+    def get(self, abs_path, st):
+        """Contents of abs_path for this stat result, or None if not cacheable"""
+        if st.st_size > self.max_file:
+            return None
+        key = self.key(abs_path, st)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        
+        with open(abs_path, 'rb') as f:
+            data = f.read(st.st_size + 1)
+        if len(data) != st.st_size:
+            # Changed while we read it; serve it but don't keep it
+            return data
+        
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = data
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+    
+    def read(self, abs_path, st, start, end):
+        """Bytes [start, end) of abs_path, from the cache when possible"""
+        data = self.get(abs_path, st)
+        if data is not None:
+            return data[start:end]
+        with open(abs_path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+    
+    def stream(self, abs_path, st, start, end):
+        """Yield bytes [start, end) of abs_path in STREAM_CHUNK pieces"""
+        data = self.get(abs_path, st)
+        if data is not None:
+            yield data[start:end]
+            return
+        with open(abs_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+def walk_workspace(root, ignore, top=''):
+    """Yield (relpath, DirEntry) for every visible file under top, depth first.
+    
+    Applies the same dotfile and .gitignore rules as the file tree.
+    """
+    stack = [top]
+    while stack:
+        relpath = stack.pop()
+        directory = os.path.join(root, relpath) if relpath else root
+        chain = ignore.chain(directory)
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if ignore.is_hidden(chain, directory, entry.name, is_dir):
+                    continue
+                path = f'{relpath}/{entry.name}' if relpath else entry.name
+                if is_dir:
+                    subdirs.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+@functools.lru_cache(maxsize=16)
+def compile_search(pattern, literal, ignore_case):
+    return re.compile(re.escape(pattern) if literal else pattern, re.IGNORECASE if ignore_case else 0)
+
+def search_files(root, relpaths, pattern, literal, ignore_case):
+    """Search a batch of files (runs in a worker process).
+    
+    Returns (files searched, [(path, line, column, text)]).
+    """
+    regex = compile_search(pattern, literal, ignore_case)
+    needle = pattern.encode('utf-8') if literal else None
+    if needle and ignore_case:
+        # bytes.lower() only folds ASCII, so it can only prefilter ASCII needles
+        needle = needle.lower() if needle.isascii() else None
+    
+    searched = 0
+    matches = []
+    for relpath in relpaths:
+        try:
+            with open(os.path.join(root, relpath), 'rb') as f:
+                data = f.read(SEARCH_MAX_FILE + 1)
+        except OSError:
+            continue
+        if len(data) > SEARCH_MAX_FILE or sniff_binary(data[:SNIFF_BYTES]):
+            continue
+        searched += 1
+        if needle and needle not in (data.lower() if ignore_case else data):
+            continue
+        
+        found = 0
+        for number, line in enumerate(data.decode('utf-8', 'replace').splitlines(), 1):
+            match = regex.search(line)
+            if match:
+                start = max(match.start() - SEARCH_CONTEXT_CHARS // 4, 0)
+                matches.append((relpath, number, match.start() + 1, line[start:start + SEARCH_CONTEXT_CHARS]))
+                found += 1
+                if found >= SEARCH_MAX_PER_FILE:
+                    break
+    return searched, matches
+
+def trigram_hash(gram):
+    return (int.from_bytes(gram, 'big') * 2654435761) & 0xffffffff
+
+def file_trigrams(root, entries):
+    """Trigram filters for a batch of (relpath, mtime_ns, size) (runs in a worker).
+    
+    Each file gets a one-hash Bloom filter of its ASCII-lowercased byte
+    trigrams, sized at 8 bits per distinct trigram; binary and oversized
+    files get a filter of None and are never searched.
+    """
+    results = []
+    for relpath, mtime, size in entries:
+        try:
+            with open(os.path.join(root, relpath), 'rb') as f:
+                data = f.read(SEARCH_MAX_FILE + 1)
+        except OSError:
+            continue
+        if len(data) > SEARCH_MAX_FILE or sniff_binary(data[:SNIFF_BYTES]):
+            results.append((relpath, mtime, size, 0, None))
+            continue
+        data = data.lower()
+        grams = {data[i:i + 3] for i in range(len(data) - 2)}
+        bits = 64
+        while bits < len(grams) * 8 and bits < TRIGRAM_MAX_BITS:
+            bits *= 2
+        bitset = bytearray(bits // 8)
+        for gram in grams:
+            slot = trigram_hash(gram) % bits
+            bitset[slot >> 3] |= 1 << (slot & 7)
+        results.append((relpath, mtime, size, bits, int.from_bytes(bitset, 'little')))
+    return results
+
+def fold_trigrams(bits, mask, max_bits):
+    """Shrink a trigram filter to max_bits by OR-ing its halves together.
+    
+    Slots are hash % bits with bits a power of two, so this is the filter
+    file_trigrams would have built at the smaller size.
+    """
+    while bits > max_bits:
+        bits //= 2
+        mask = (mask >> bits) | (mask & ((1 << bits) - 1))
+    return bits, mask
+
+class TrigramIndex:
+    """Persistent per-file trigram filters for literal searches.
+    
+    Entries are refreshed in a background thread by comparing mtime and
+    size against a fresh walk and saved under the user's cache directory,
+    so repeated searches only open files that can contain every trigram
+    of the query. ready is set once there is an index to query.
+    """
+    def __init__(self, root, ignore, cache_dir=INDEX_DIR):
+        self.root = root
+        self.ignore = ignore
+        key = hashlib.sha1(root.encode()).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, f'trigrams-{key}.pickle')
+        self.files = {}  # relpath -> (mtime_ns, size, bits, filter int or None)
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.refreshing = False
+        try:
+            with open(self.path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.get('version') == 1 and saved.get('root') == root:
+                self.files = saved['files']
+                self.ready.set()
+        except (OSError, pickle.PickleError, EOFError, AttributeError, KeyError):
+            pass
+    
+    def start_refresh(self, pool):
+        """Refresh in a background thread, unless one is already running"""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        
+        def run():
+            try:
+                reindexed = self.refresh(pool)
+                if reindexed:
+                    print(f"Search index: re-indexed {reindexed} files")
+                self.ready.set()
+            except Exception as e:
+                # Typically the pool shutting down; the next search retries
+                print(f"Search index: refresh failed: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing = False
+        threading.Thread(target=run, daemon=True).start()
+    
+    def refresh(self, pool):
+        """Re-index files whose mtime or size changed; returns the number re-indexed"""
+        files = self.files
+        current = {}
+        stale = []
+        for relpath, dir_entry in walk_workspace(self.root, self.ignore):
+            try:
+                st = dir_entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            current[relpath] = entry = files.get(relpath)
+            if entry is None or entry[:2] != (st.st_mtime_ns, st.st_size):
+                stale.append((relpath, st.st_mtime_ns, st.st_size))
+        
+        batches = [stale[i:i + SEARCH_BATCH] for i in range(0, len(stale), SEARCH_BATCH)]
+        for results in pool.map(file_trigrams, itertools.repeat(self.root), batches):
+            for relpath, mtime, size, bits, mask in results:
+                current[relpath] = (mtime, size, bits, mask)
+        current = {path: entry for path, entry in current.items() if entry is not None}
+        
+        # Cap the filter size so all of them fit in TRIGRAM_INDEX_MAX_BYTES
+        sizes = [bits for _, _, bits, mask in current.values() if mask is not None]
+        max_bits = TRIGRAM_MAX_BITS
+        while max_bits > 64 and sum(min(bits, max_bits) for bits in sizes) // 8 > TRIGRAM_INDEX_MAX_BYTES:
+            max_bits //= 2
+        folded = 0
+        for path, (mtime, size, bits, mask) in current.items():
+            if mask is not None and bits > max_bits:
+                current[path] = (mtime, size) + fold_trigrams(bits, mask, max_bits)
+                folded += 1
+        
+        changed = bool(stale or folded) or len(current) != len(files)
+        self.files = current
+        if changed:
+            self.save()
+        return len(stale)
+    
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': 1, 'root': self.root, 'files': self.files}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+    
+    def candidates(self, needle):
+        """(files that may contain needle (bytes) in walk order, number not yet indexed)
+        
+        Files changed since the last refresh are always candidates, so the
+        result is never missing a match while the index catches up.
+        """
+        needle = needle.lower()
+        grams = {needle[i:i + 3] for i in range(len(needle) - 2)}
+        masks = {}
+        files = self.files
+        result = []
+        stale = 0
+        for relpath, dir_entry in walk_workspace(self.root, self.ignore):
+            try:
+                st = dir_entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            entry = files.get(relpath)
+            if entry is None or entry[:2] != (st.st_mtime_ns, st.st_size):
+                stale += 1
+                result.append(relpath)
+                continue
+            _, _, bits, mask = entry
+            if mask is None:
+                continue
+            want = masks.get(bits)
+            if want is None:
+                want = masks[bits] = sum({1 << (trigram_hash(gram) % bits) for gram in grams})
+            if mask & want == want:
+                result.append(relpath)
+        return result, stale
+
+class WorkspaceSearch:
+    """Full-text search over the workspace on a pool of worker processes.
+    
+    Files are handed out in small batches as the walk finds them, so the
+    first matches come back while the rest of the tree is still queued.
+    """
+    def __init__(self, root, ignore, workers=None, use_index=False):
+        self.root = root
+        self.ignore = ignore
+        self.workers = workers or os.cpu_count() or 2
+        self.use_index = use_index
+        self.index = None
+        self.pool = None
+        self.lock = threading.Lock()
+    
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # spawn, not fork: the parent is multi-threaded (and may be Qt)
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'))
+                if self.use_index:
+                    self.index = TrigramIndex(self.root, self.ignore)
+                    self.index.start_refresh(self.pool)
+            return self.pool
+    
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+    
+    def files(self, pattern, literal, ignore_case):
+        """(paths to search, whether the trigram index narrowed them)
+        
+        Until the index has been built this is a plain walk; afterwards
+        files changed since the last refresh are queued for re-indexing.
+        """
+        needle = pattern.encode('utf-8')
+        if (self.index and literal and len(needle) >= 3 and
+                (not ignore_case or needle.isascii())):
+            if self.index.ready.is_set():
+                paths, stale = self.index.candidates(needle)
+                if stale:
+                    self.index.start_refresh(self.pool)
+                return paths, True
+            self.index.start_refresh(self.pool)
+        return (relpath for relpath, _ in walk_workspace(self.root, self.ignore)), False
+    
+    def search(self, pattern, literal=True, ignore_case=True, max_results=SEARCH_MAX_RESULTS):
+        """Yield match dicts as batches finish, then a summary dict"""
+        started = time.perf_counter()
+        pool = self.get_pool()
+        pending = set()
+        searched = 0
+        sent = 0
+        batch = []
+        batch_size = SEARCH_FIRST_BATCH
+        
+        def collect(futures):
+            nonlocal searched, sent
+            for future in futures:
+                pending.discard(future)
+                count, matches = future.result()
+                searched += count
+                for path, line, column, text in matches[:max_results - sent]:
+                    sent += 1
+                    yield {'type': 'match', 'path': path, 'line': line, 'column': column, 'text': text}
+        
+        paths, indexed = self.files(pattern, literal, ignore_case)
+        try:
+            for relpath in paths:
+                batch.append(relpath)
+                if len(batch) >= batch_size:
+                    pending.add(pool.submit(search_files, self.root, batch, pattern, literal, ignore_case))
+                    batch = []
+                    batch_size = min(batch_size * 2, SEARCH_BATCH)
+                    yield from collect([f for f in pending if f.done()])
+                    if sent >= max_results:
+                        break
+            else:
+                if batch:
+                    pending.add(pool.submit(search_files, self.root, batch, pattern, literal, ignore_case))
+            
+            while pending and sent < max_results:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                yield from collect(done)
+        finally:
+            # Finished early, or the client went away
+            for future in pending:
+                future.cancel()
+        
+        yield {
+            'type': 'done',
+            'matches': sent,
+            'files_searched': searched,
+            'truncated': sent >= max_results,
+            'indexed': indexed,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+@functools.lru_cache(maxsize=64)
+def fuzzy_patterns(needle):
+    """(scan, positions) regexes for needle's characters in order.
+    
+    Each gap is possessive and stops at the first occurrence of the next
+    character, so matching never backtracks. scan is for match() rather
+    than search(): its gaps may run across lines, which lets re use its
+    fast single-character loops over the whole list, and group 1 is where
+    the chain of characters starts. In positions, gaps stay on one line
+    and group i is the gap before the i-th character, so that character
+    sits at match.end(i).
+    """
+    chars = [re.escape(ch) for ch in needle]
+    scan = f'[^{chars[0]}]*+({chars[0]}' + ''.join(f'[^{ch}]*+{ch}' for ch in chars[1:]) + ')'
+    positions = ''.join(f'([^\\n{ch}]*+){ch}' for ch in chars)
+    return re.compile(scan), re.compile(positions)
+
+def fuzzy_score(text, positions):
+    """Rank a match: consecutive runs and word starts score, gaps and length cost"""
+    score = 0
+    previous = -2
+    for pos in positions:
+        if pos == previous + 1:
+            score += 8
+        elif pos == 0 or text[pos - 1] in '/_-. ':
+            score += 6
+        else:
+            score -= 1
+        previous = pos
+    if positions[0] > text.rfind('/'):
+        score += 10
+    return score - len(text) // 10
+
+class PathIndex:
+    """In-memory list of every visible workspace file for quick open.
+    
+    Built by one walk at startup and then patched from the watcher's
+    events. Queries scan a single newline-joined, lowercased copy of the
+    list with a fuzzy regex, so matching runs in C and only candidates
+    are scored in Python.
+    """
+    def __init__(self, root, ignore, max_age=None):
+        self.root = root
+        self.ignore = ignore
+        # Rebuild interval for when no watcher keeps the index current
+        self.max_age = max_age
+        self.paths = set()
+        self.view = None  # (generation, paths, blob, line starts)
+        self.generation = 0
+        self.built = None
+        self.building = False
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        # Watcher batches waiting for an earlier batch's directory walk
+        self.batches = collections.deque()
+    
+    def build(self):
+        """Replace the index with a fresh walk of the workspace"""
+        self.building = True
+        started = time.perf_counter()
+        try:
+            paths = {relpath for relpath, _ in walk_workspace(self.root, self.ignore)}
+            with self.lock:
+                self.paths = paths
+                self.view = None
+                self.built = time.monotonic()
+        finally:
+            self.building = False
+            self.ready.set()
+        print(f"Path index: {len(paths)} files in {(time.perf_counter() - started) * 1000:.0f} ms")
+    
+    def refresh_if_stale(self, loop):
+        if (self.max_age is not None and self.built is not None and not self.building and
+                time.monotonic() - self.built > self.max_age):
+            self.building = True
+            loop.run_in_executor(None, self.build)
+    
+    def update(self, loop, events):
+        """Apply a batch of watcher events, walking new directories off the loop.
+        
+        Batches apply in arrival order, so later ones queue behind a walk.
+        """
+        self.batches.append(events)
+        if len(self.batches) > 1:
+            return
+        if not any(self.new_directories(events)):
+            self.batches.popleft()
+            self.apply(events)
+        else:
+            asyncio.ensure_future(self.apply_batches(loop))
+    
+    async def apply_batches(self, loop):
+        while self.batches:
+            events = self.batches[0]
+            walked = {}
+            if any(self.new_directories(events)):
+                walked = await loop.run_in_executor(None, self.walk_directories, events)
+            self.apply(events, walked)
+            self.batches.popleft()
+    
+    @staticmethod
+    def new_directories(events):
+        return [event['path'] for event in events
+                if event['type'] in ('created', 'renamed') and event['is_dir']]
+    
+    def walk_directories(self, events):
+        """Files under each directory a batch created or moved in"""
+        return {top: [relpath for relpath, _ in walk_workspace(self.root, self.ignore, top)]
+                for top in self.new_directories(events)}
+    
+    def apply(self, events, walked=None):
+        """Patch the index with a batch of watcher events.
+        
+        walked has the files under the batch's new directories, from
+        walk_directories().
+        """
+        present = {}  # file -> exists, in event order
+        removed_dirs = []
+        for event in events:
+            kind = event['type']
+            if kind in ('deleted', 'renamed'):
+                path = event['from'] if kind == 'renamed' else event['path']
+                if event['is_dir']:
+                    removed_dirs.append(path + '/')
+                    present = {p: exists for p, exists in present.items()
+                               if not p.startswith(path + '/')}
+                else:
+                    present[path] = False
+            if kind in ('created', 'renamed'):
+                if event['is_dir']:
+                    present.update((relpath, True) for relpath in walked[event['path']])
+                else:
+                    present[event['path']] = True
+        
+        with self.lock:
+            count = len(self.paths)
+            if removed_dirs:
+                prefixes = tuple(removed_dirs)
+                self.paths = {p for p in self.paths if not p.startswith(prefixes)}
+            changed = len(self.paths) != count
+            for path, exists in present.items():
+                if exists != (path in self.paths):
+                    changed = True
+                    if exists:
+                        self.paths.add(path)
+                    else:
+                        self.paths.discard(path)
+            # Saves replace files in place and leave the list as it was
+            if changed:
+                self.view = None
+    
+    def snapshot(self):
+        """The current view, rebuilt if the index changed since the last query"""
+        with self.lock:
+            if self.view is None:
+                # Short paths first: they are the ones kept when a query
+                # has more candidates than get scored
+                paths = sorted(self.paths, key=len)
+                blob = '\n'.join(paths).lower()
+                lowered = paths
+                if len(blob) != sum(map(len, paths)) + max(len(paths) - 1, 0):
+                    # A few characters change length when lowercased
+                    lowered = [p.lower() for p in paths]
+                    blob = '\n'.join(lowered)
+                starts = list(itertools.accumulate((len(p) + 1 for p in lowered), initial=0))
+                self.generation += 1
+                self.view = (self.generation, paths, blob, starts)
+            return self.view
+    
+    def query(self, text, limit=QUICKOPEN_RESULTS, state=None):
+        """Top matches for text as {'results': [{path, score, positions}], ...}.
+        
+        state carries the previous query's candidates between calls from
+        one client, so each extra character typed only rechecks those and
+        carries on scanning where the last query stopped.
+        """
+        started = time.perf_counter()
+        self.ready.wait()
+        generation, paths, blob, starts = self.snapshot()
+        needle = ''.join(text.lower().split())[:QUICKOPEN_MAX_QUERY]
+        state = {} if state is None else state
+        if not needle:
+            state.clear()
+            results = [{'path': path, 'score': 0, 'positions': []} for path in paths[:limit]]
+            return {'results': results, 'matched': len(paths), 'truncated': len(paths) > limit,
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)}
+        
+        scan, positions = fuzzy_patterns(needle)
+        candidates = []
+        pos = 0
+        if state.get('generation') == generation and needle.startswith(state['needle']):
+            # Paths the shorter query ruled out can't match this one
+            pos = state['resume']
+            for i in state['candidates']:
+                if len(candidates) >= QUICKOPEN_MAX_SCORED:
+                    pos = starts[i]
+                    break
+                if scan.match(blob, starts[i], starts[i + 1] - 1):
+                    candidates.append(i)
+        match = scan.match
+        line_of = functools.partial(bisect.bisect_right, starts)
+        while len(candidates) < QUICKOPEN_MAX_SCORED:
+            # A scan match is the earliest chain of the characters from pos.
+            # No chain starting later can end sooner, so no line before the
+            # one this ends on can match (and none at all if there is no
+            # chain); that line does if the chain started on it, otherwise
+            # try again from its start.
+            m = match(blob, pos)
+            if m is None:
+                pos = len(blob)
+                break
+            i = line_of(m.end() - 1) - 1
+            if m.start(1) < starts[i]:
+                pos = starts[i]
+                continue
+            candidates.append(i)
+            pos = starts[i + 1]
+        truncated = pos < len(blob)
+        state.update(generation=generation, needle=needle, candidates=candidates, resume=pos)
+        
+        scored = []
+        for i in candidates:
+            line = blob[starts[i]:starts[i + 1] - 1]
+            chars = [end for _, end in positions.match(line).regs[1:]]
+            scored.append((fuzzy_score(line, chars), -i, chars))
+        results = [{'path': paths[-i], 'score': score, 'positions': chars}
+                   for score, i, chars in heapq.nlargest(limit, scored)]
+        return {'results': results, 'matched': len(candidates), 'truncated': truncated,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)}
+    
+    async def websocket_handler(self, websocket):
+        """Answer quick-open queries as they are typed.
+        
+        Clients send {"id": n, "q": text}; only the newest query waiting
+        is answered, so fast typing doesn't queue up stale work.
+        """
+        loop = asyncio.get_running_loop()
+        state = {}
+        latest = None
+        wake = asyncio.Event()
+        
+        async def answer():
+            nonlocal latest
+            while True:
+                await wake.wait()
+                wake.clear()
+                request, latest = latest, None
+                try:
+                    self.refresh_if_stale(loop)
+                    result = await loop.run_in_executor(None, self.query, request['q'], request['limit'], state)
+                except Exception as e:
+                    # Answer with no results so one bad query doesn't end
+                    # quick open for the rest of the connection
+                    print(f"Quick open: query {request['q']!r} failed: {e}")
+                    state.clear()
+                    result = {'results': [], 'error': str(e)}
+                result['id'] = request['id']
+                await websocket.send(json.dumps(result))
+        
+        task = asyncio.create_task(answer())
+        try:
+            async for message in websocket:
+                try:
+                    request = json.loads(message)
+                    latest = {
+                        'id': request.get('id'),
+                        'q': str(request.get('q', '')),
+                        'limit': max(1, min(int(request.get('limit', QUICKOPEN_RESULTS)),
+                                            QUICKOPEN_MAX_RESULTS)),
+                    }
+                except (ValueError, TypeError, AttributeError):
+                    continue
+                wake.set()
+        finally:
+            task.cancel()
+
+class InotifyWatcher:
+    """Linux inotify watcher for the workspace.
+    
+    Keeps an index of every visible directory's children current and
+    pushes coalesced created/deleted/modified/renamed events to clients
+    of the /fs WebSocket. Ignored directories are never watched.
+    """
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_ONLYDIR)
+    EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+    
+    def __init__(self, root, ignore):
+        self.root = root
+        self.ignore = ignore
+        self.loop = None
+        self.fd = None
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.watches = {}  # wd -> directory relative to root ('' for root)
+        self.index = {}    # directory relative to root -> set of child names
+        self.chains = {}   # directory relative to root -> its IgnoreRules chain
+        # New directories are scanned off the loop; events from inside them
+        # that arrive first wait here until their watches are known
+        self.scans = 0
+        self.early = []
+        self.clients = set()
+        self.pending = {}  # path -> event, coalesced until the next flush
+        self.moves = {}    # cookie -> (path, is_dir) awaiting IN_MOVED_TO
+        self.flush_handle = None
+        self.out_of_watches = False
+        # Called on the loop with each batch of events, before clients get it
+        self.listeners = []
+    
+    @staticmethod
+    def available():
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        return hasattr(libc, 'inotify_init1')
+    
+    async def start(self, loop):
+        """Watch the workspace tree and start delivering events on loop"""
+        self.loop = loop
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            print(f"inotify unavailable: {os.strerror(ctypes.get_errno())}")
+            return
+        
+        # The initial walk can take a while on big trees; events queue up
+        # in the kernel until the reader is attached
+        self.add_tree(await loop.run_in_executor(None, self.scan_tree, ''))
+        loop.add_reader(self.fd, self.read_events)
+        print(f"Watching {len(self.watches)} directories under {self.root}")
+    
+    def abs_path(self, relpath):
+        return os.path.join(self.root, relpath) if relpath else self.root
+    
+    def scan_tree(self, top):
+        """Add watches for top and every visible directory below it.
+        
+        Runs off the loop, so it only reports what it found, as a list of
+        (wd, relpath, child names, ignore chain) for add_tree() to record
+        on the loop; watches and index are only ever touched there.
+        """
+        found = []
+        stack = [top]
+        while stack:
+            relpath = stack.pop()
+            directory = self.abs_path(relpath)
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC and not self.out_of_watches:
+                    self.out_of_watches = True
+                    print("inotify watch limit reached (fs.inotify.max_user_watches); "
+                          "some directories won't be watched")
+                continue
+            
+            names = set()
+            chain = self.ignore.chain(directory)
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if self.ignore.is_hidden(chain, directory, entry.name, is_dir):
+                            continue
+                        names.add(entry.name)
+                        if is_dir:
+                            stack.append(f'{relpath}/{entry.name}' if relpath else entry.name)
+            except OSError:
+                pass
+            found.append((wd, relpath, names, chain))
+        return found
+    
+    def add_tree(self, found):
+        """Record what scan_tree() found"""
+        for wd, relpath, names, chain in found:
+            if wd in self.watches:
+                # Already watched: the loop's path for it is the current one,
+                # the scan's may predate a rename
+                continue
+            self.watches[wd] = relpath
+            self.index[relpath] = names
+            self.chains[relpath] = chain
+    
+    async def watch_new_directory(self, path):
+        """Watch a directory created (or moved in) under the workspace"""
+        self.scans += 1
+        try:
+            found = await self.loop.run_in_executor(None, self.scan_tree, path)
+        finally:
+            self.scans -= 1
+        if self.fd is None:
+            return
+        
+        parent, _, name = path.rpartition('/')
+        if name in self.index.get(parent, ()):
+            self.add_tree(found)
+        else:
+            # Gone again before the scan finished
+            for wd, *_ in found:
+                if wd not in self.watches:
+                    self.libc.inotify_rm_watch(self.fd, wd)
+        
+        early, self.early = self.early, []
+        for event in early:
+            self.handle_event(*event)
+        if self.flush_handle is None and (self.pending or self.moves):
+            self.flush_handle = self.loop.call_later(WATCH_COALESCE_DELAY, self.flush)
+    
+    async def reload_chains(self, top):
+        """Re-resolve ignore chains at and below top, off the loop"""
+        prefix = top + '/' if top else ''
+        dirs = [relpath for relpath in self.chains if relpath == top or relpath.startswith(prefix)]
+        def resolve():
+            return {relpath: self.ignore.chain(self.abs_path(relpath)) for relpath in dirs}
+        chains = await self.loop.run_in_executor(None, resolve)
+        self.chains.update((relpath, chain) for relpath, chain in chains.items()
+                           if relpath in self.chains)
+    
+    def forget_tree(self, top, remove_watches=False):
+        """Drop index entries (and optionally watches) for top and below"""
+        prefix = top + '/'
+        for wd, relpath in list(self.watches.items()):
+            if relpath == top or relpath.startswith(prefix):
+                if remove_watches:
+                    self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+        for relpath in list(self.index):
+            if relpath == top or relpath.startswith(prefix):
+                del self.index[relpath]
+                self.chains.pop(relpath, None)
+    
+    def move_tree(self, src, dst):
+        """Re-key watches and index entries after a directory rename"""
+        def moved(relpath):
+            if relpath == src or relpath.startswith(src + '/'):
+                return dst + relpath[len(src):]
+            return relpath
+        self.watches = {wd: moved(relpath) for wd, relpath in self.watches.items()}
+        self.index = {moved(relpath): names for relpath, names in self.index.items()}
+        self.chains = {moved(relpath): chain for relpath, chain in self.chains.items()}
+        # Ignore rules of the new parents apply from now on
+        asyncio.ensure_future(self.reload_chains(dst))
+    
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            self.handle_event(wd, mask, cookie, name)
+        
+        if self.flush_handle is None and (self.pending or self.moves):
+            self.flush_handle = self.loop.call_later(WATCH_COALESCE_DELAY, self.flush)
+    
+    def handle_event(self, wd, mask, cookie, name):
+        if mask & self.IN_Q_OVERFLOW:
+            # Events were lost; clients have to reload what they show
+            self.pending = {'': {'type': 'rescan'}}
+            return
+        if mask & self.IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        
+        parent = self.watches.get(wd)
+        if parent is None:
+            if self.scans:
+                # Probably from a directory still being scanned
+                self.early.append((wd, mask, cookie, name))
+            return
+        if not name:
+            return
+        path = f'{parent}/{name}' if parent else name
+        is_dir = bool(mask & self.IN_ISDIR)
+        directory = self.abs_path(parent)
+        if name == '.gitignore':
+            asyncio.ensure_future(self.reload_chains(parent))
+        if self.ignore.is_hidden(self.chains.get(parent, []), directory, name, is_dir):
+            return
+        
+        if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+            siblings = self.index.setdefault(parent, set())
+            replaced = not is_dir and name in siblings
+            siblings.add(name)
+            source = self.moves.pop(cookie, None) if mask & self.IN_MOVED_TO else None
+            if replaced and mask & self.IN_MOVED_TO:
+                # Saved through a temporary file and a rename (sed -i, most
+                # editors, our own saves): the target changed, and the
+                # temporary, unless hidden and so never reported, is gone
+                if source:
+                    self.record(source[0], {'type': 'deleted', 'path': source[0], 'is_dir': False})
+                self.record(path, {'type': 'modified', 'path': path, 'is_dir': False})
+            elif source:
+                if is_dir:
+                    self.move_tree(source[0], path)
+                self.record(path, {'type': 'renamed', 'path': path, 'from': source[0], 'is_dir': is_dir})
+            else:
+                if is_dir:
+                    asyncio.ensure_future(self.watch_new_directory(path))
+                self.record(path, {'type': 'created', 'path': path, 'is_dir': is_dir})
+        elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            self.index.get(parent, set()).discard(name)
+            if mask & self.IN_MOVED_FROM:
+                # Becomes a rename if the matching IN_MOVED_TO shows up
+                self.moves[cookie] = (path, is_dir)
+            else:
+                if is_dir:
+                    self.forget_tree(path)
+                self.record(path, {'type': 'deleted', 'path': path, 'is_dir': is_dir})
+        elif not is_dir:
+            self.record(path, {'type': 'modified', 'path': path, 'is_dir': False})
+    
+    def record(self, path, event):
+        """Merge an event into the pending batch"""
+        previous = self.pending.pop(path, None)
+        if previous and previous['type'] == 'created':
+            if event['type'] == 'modified':
+                event = previous
+            elif event['type'] == 'deleted':
+                return
+        elif previous and previous['type'] == 'deleted':
+            if event['type'] == 'created' and not event['is_dir']:
+                # Deleted and written again (git checkout): a change in place
+                event = {'type': 'modified', 'path': path, 'is_dir': False}
+        self.pending[path] = event
+    
+    def flush(self):
+        """Send the coalesced batch to clients"""
+        self.flush_handle = None
+        # Moves whose destination never appeared left the watched tree
+        for path, is_dir in self.moves.values():
+            if is_dir:
+                self.forget_tree(path, remove_watches=True)
+            self.record(path, {'type': 'deleted', 'path': path, 'is_dir': is_dir})
+        self.moves.clear()
+        
+        events = list(self.pending.values())
+        self.pending.clear()
+        for listener in self.listeners if events else ():
+            listener(events)
+        if events and self.clients:
+            websockets.broadcast(self.clients, json.dumps({'type': 'fs', 'events': events}))
+    
+    def close(self):
+        """Stop watching"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.fd is not None and self.fd >= 0:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+        self.fd = None
+    
+    async def websocket_handler(self, websocket):
+        """Keep an editor page subscribed to change events"""
+        self.clients.add(websocket)
+        try:
+            await websocket.wait_closed()
+        finally:
+            self.clients.discard(websocket)
+
+class ScrollbackBuffer:
+    """Byte-capped ring buffer of PTY output addressed by stream offset.
+    
+    Offsets count every byte the session has ever produced, so a client
+    that remembers how far it got can ask for just the missing tail.
+    """
+    def __init__(self, max_bytes=SCROLLBACK_BYTES):
+        self.max_bytes = max_bytes
+        self.chunks = collections.deque()
+        self.size = 0
+        self.start = 0  # offset of the oldest byte still held
+        self.end = 0    # offset just past the newest byte
+    
+    def append(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        self.end += len(data)
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            dropped = self.chunks.popleft()
+            self.size -= len(dropped)
+            self.start += len(dropped)
+    
+    def read_from(self, offset):
+        """Bytes from offset to the end, or None if offset is not held"""
+        if offset < self.start or offset > self.end:
+            return None
+        skip = offset - self.start
+        data = b''.join(self.chunks)
+        return data[skip:]
+
+class ScreenModel:
+    """Headless VT screen state fed from the same stream clients receive.
+    
+    Tracks the visible grid, cursor, SGR attributes, scroll region, DEC
+    private modes and the alternate screen well enough to redraw the
+    current screen for a newly attached client. Sequences it doesn't
+    model are parsed and ignored.
+    """
+    DEFAULT_ATTR = ((), None, None)  # (SGR flags, foreground, background)
+    PRINTABLE_RUN = re.compile(r'[^\x00-\x1f\x7f-\x9f]+')
+    CSI_SEQUENCE = re.compile(r'\x1b\[([\x20-\x3f]*)([\x40-\x7e])')
+    
+    def __init__(self, rows=24, cols=80, scrollback_lines=SCREEN_SCROLLBACK_LINES):
+        self.rows = rows
+        self.cols = cols
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.history = collections.deque(maxlen=scrollback_lines)
+        self.sgr_cache = {}
+        self.reset()
+    
+    def reset(self):
+        """Full reset (RIS); scrollback history is kept"""
+        self.main = [self.blank_row() for _ in range(self.rows)]
+        self.alt = [self.blank_row() for _ in range(self.rows)]
+        self.grid = self.main
+        self.attr = self.DEFAULT_ATTR
+        self.x = self.y = 0
+        self.wrap_pending = False
+        self.top, self.bottom = 0, self.rows - 1
+        self.saved_cursor = (0, 0, self.DEFAULT_ATTR)
+        self.modes = set()  # DEC private modes currently set, e.g. '?2004'
+        self.cursor_visible = True
+        self.autowrap = True
+        self.state = 'ground'
+        self.params = ''
+        self.string_escape = False
+    
+    def blank_cell(self):
+        """Erased cell; erasing keeps the current background colour"""
+        bg = self.attr[2] if hasattr(self, 'attr') else None
+        return (' ', ((), None, bg) if bg else self.DEFAULT_ATTR)
+    
+    def blank_row(self):
+        return [self.blank_cell()] * self.cols
+    
+    def feed(self, data):
+        """Apply a chunk of PTY output"""
+        text = self.decoder.decode(data)
+        i, n = 0, len(text)
+        while i < n:
+            if self.state == 'ground':
+                match = self.PRINTABLE_RUN.match(text, i)
+                if match:
+                    self.print_run(match.group())
+                    i = match.end()
+                    continue
+                # Whole CSI sequences in one go; split ones go char by char
+                match = self.CSI_SEQUENCE.match(text, i)
+                if match:
+                    self.csi(match.group(1), match.group(2))
+                    i = match.end()
+                    continue
+                self.control(text[i])
+            else:
+                self.consume(text[i])
+            i += 1
+    
+    # Printing
+    
+    def print_run(self, run):
+        if not run.isascii():
+            for ch in run:
+                self.print_char(ch)
+            return
+        
+        attr = self.attr
+        while run:
+            if self.wrap_pending:
+                self.wrap_pending = False
+                self.x = 0
+                self.linefeed()
+            row = self.grid[self.y]
+            chunk, run = run[:self.cols - self.x], run[self.cols - self.x:]
+            if not self.autowrap and run:
+                # Without autowrap the rest piles up in the last column
+                chunk, run = chunk[:-1] + run[-1], ''
+            row[self.x:self.x + len(chunk)] = [(ch, attr) for ch in chunk]
+            self.x += len(chunk)
+            if self.x >= self.cols:
+                self.x = self.cols - 1
+                self.wrap_pending = self.autowrap
+    
+    def print_char(self, ch):
+        if unicodedata.combining(ch):
+            # Attach to the previous cell
+            x = self.x if self.wrap_pending else max(self.x - 1, 0)
+            prev, attr = self.grid[self.y][x]
+            self.grid[self.y][x] = (prev + ch, attr)
+            return
+        
+        width = 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+        if self.wrap_pending or (width == 2 and self.x == self.cols - 1 and self.autowrap):
+            self.wrap_pending = False
+            self.x = 0
+            self.linefeed()
+        
+        row = self.grid[self.y]
+        row[self.x] = (ch, self.attr)
+        if width == 2 and self.x + 1 < self.cols:
+            # Placeholder for the right half of a wide character
+            self.x += 1
+            row[self.x] = ('', self.attr)
+        if self.x + 1 >= self.cols:
+            self.wrap_pending = self.autowrap
+        else:
+            self.x += 1
+    
+    # Cursor movement and scrolling
+    
+    def linefeed(self):
+        if self.y == self.bottom:
+            self.scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+    
+    def reverse_index(self):
+        if self.y == self.top:
+            self.scroll_down(1)
+        elif self.y > 0:
+            self.y -= 1
+    
+    def scroll_up(self, count):
+        count = min(count, self.bottom - self.top + 1)
+        removed = self.grid[self.top:self.top + count]
+        if self.grid is self.main and self.top == 0:
+            self.history.extend(removed)
+        del self.grid[self.top:self.top + count]
+        for _ in range(count):
+            self.grid.insert(self.bottom - count + 1, self.blank_row())
+    
+    def scroll_down(self, count):
+        count = min(count, self.bottom - self.top + 1)
+        del self.grid[self.bottom - count + 1:self.bottom + 1]
+        for _ in range(count):
+            self.grid.insert(self.top, self.blank_row())
+    
+    def move_to(self, y, x):
+        self.y = min(max(y, 0), self.rows - 1)
+        self.x = min(max(x, 0), self.cols - 1)
+        self.wrap_pending = False
+    
+    # Parser
+    
+    def control(self, ch):
+        """C0 control characters"""
+        if ch == '\x1b':
+            self.state = 'escape'
+        elif ch == '\r':
+            self.x = 0
+            self.wrap_pending = False
+        elif ch in '\n\x0b\x0c':
+            self.wrap_pending = False
+            self.linefeed()
+        elif ch == '\b':
+            self.move_to(self.y, self.x - 1)
+        elif ch == '\t':
+            self.move_to(self.y, (self.x // 8 + 1) * 8)
+    
+    def consume(self, ch):
+        """One character of an escape sequence or string"""
+        state = self.state
+        if state == 'escape':
+            self.escape(ch)
+        elif state == 'csi':
+            if '\x20' <= ch <= '\x3f':
+                self.params += ch
+            elif '\x40' <= ch <= '\x7e':
+                self.state = 'ground'
+                self.csi(self.params, ch)
+            elif ch in '\x18\x1a':
+                self.state = 'ground'
+            else:
+                self.control(ch)
+        elif state == 'string':
+            # OSC/DCS/APC/PM bodies end at BEL or ST (ESC \)
+            if ch == '\x07' or (self.string_escape and ch == '\\'):
+                self.state = 'ground'
+            self.string_escape = ch == '\x1b'
+        elif state == 'charset':
+            self.state = 'ground'
+    
+    def escape(self, ch):
+        self.state = 'ground'
+        if ch == '[':
+            self.state = 'csi'
+            self.params = ''
+        elif ch in ']PX^_':
+            self.state = 'string'
+            self.string_escape = False
+        elif ch in '()*+-./#%':
+            self.state = 'charset'
+        elif ch == '7':
+            self.saved_cursor = (self.x, self.y, self.attr)
+        elif ch == '8':
+            x, y, self.attr = self.saved_cursor
+            self.move_to(y, x)
+        elif ch == 'D':
+            self.linefeed()
+        elif ch == 'E':
+            self.x = 0
+            self.linefeed()
+        elif ch == 'M':
+            self.reverse_index()
+        elif ch == 'c':
+            self.reset()
+    
+    def csi(self, params, final):
+        if final == 'm':
+            # By far the most common sequence; results are memoised
+            key = (self.attr, params)
+            attr = self.sgr_cache.get(key)
+            if attr is None:
+                if params.startswith(('?', '>', '<', '=')):
+                    return
+                self.select_graphic_rendition(params)
+                if len(self.sgr_cache) > 4096:
+                    self.sgr_cache.clear()
+                self.sgr_cache[key] = self.attr
+            else:
+                self.attr = attr
+            return
+        
+        private = params.startswith('?')
+        if private:
+            params = params[1:]
+        elif params[:1] in ('>', '<', '=') or params[-1:] in (' ', '$', '"', "'", '!'):
+            return  # queries and settings with no screen effect
+        args = [int(p) if p.isdigit() else 0 for p in params.split(';')]
+        
+        def arg(index=0, default=1):
+            value = args[index] if index < len(args) else 0
+            return value or default
+        
+        if final in 'hl':
+            self.set_modes(params.split(';'), final == 'h', private)
+        elif final == 'A':
+            self.move_to(self.y - arg(), self.x)
+        elif final in 'Be':
+            self.move_to(self.y + arg(), self.x)
+        elif final in 'Ca':
+            self.move_to(self.y, self.x + arg())
+        elif final == 'D':
+            self.move_to(self.y, self.x - arg())
+        elif final == 'E':
+            self.move_to(self.y + arg(), 0)
+        elif final == 'F':
+            self.move_to(self.y - arg(), 0)
+        elif final in 'G`':
+            self.move_to(self.y, arg() - 1)
+        elif final == 'd':
+            self.move_to(arg() - 1, self.x)
+        elif final in 'Hf':
+            self.move_to(arg(0) - 1, arg(1) - 1)
+        elif final == 'J':
+            self.erase_display(arg(default=0))
+        elif final == 'K':
+            self.erase_line(arg(default=0))
+        elif final in 'LM' and self.top <= self.y <= self.bottom:
+            top = self.top
+            self.top = self.y
+            if final == 'L':
+                self.scroll_down(arg())
+            else:
+                self.scroll_up_in_place(arg())
+            self.top = top
+            self.x = 0
+        elif final in '@PX':
+            count = min(arg(), self.cols - self.x)
+            row = self.grid[self.y]
+            blanks = [self.blank_cell()] * count
+            if final == '@':
+                row[self.x:self.x] = blanks
+                del row[self.cols:]
+            elif final == 'P':
+                del row[self.x:self.x + count]
+                row.extend(blanks)
+            else:
+                row[self.x:self.x + count] = blanks
+        elif final == 'S':
+            self.scroll_up_in_place(arg())
+        elif final == 'T':
+            self.scroll_down(arg())
+        elif final == 'r' and not private:
+            top, bottom = arg(0) - 1, arg(1, self.rows) - 1
+            if top < bottom < self.rows:
+                self.top, self.bottom = top, bottom
+                self.move_to(0, 0)
+        elif final == 's' and not private:
+            self.saved_cursor = (self.x, self.y, self.attr)
+        elif final == 'u' and not private:
+            x, y, self.attr = self.saved_cursor
+            self.move_to(y, x)
+    
+    def scroll_up_in_place(self, count):
+        """Scroll the region without pushing lines into history"""
+        history = self.history
+        self.history = collections.deque(maxlen=0)
+        try:
+            self.scroll_up(count)
+        finally:
+            self.history = history
+    
+    def erase_display(self, mode):
+        if mode == 0:
+            self.erase_line(0)
+            rows = range(self.y + 1, self.rows)
+        elif mode == 1:
+            self.erase_line(1)
+            rows = range(0, self.y)
+        else:
+            rows = range(self.rows)
+            if mode == 3:
+                self.history.clear()
+        for y in rows:
+            self.grid[y] = self.blank_row()
+    
+    def erase_line(self, mode):
+        row = self.grid[self.y]
+        blank = self.blank_cell()
+        if mode == 0:
+            row[self.x:] = [blank] * (self.cols - self.x)
+        elif mode == 1:
+            row[:self.x + 1] = [blank] * (self.x + 1)
+        else:
+            self.grid[self.y] = self.blank_row()
+    
+    def set_modes(self, modes, enable, private):
+        if not private:
+            return
+        for mode in modes:
+            if mode in ('1049', '1047', '47'):
+                self.switch_screen(enable, save_cursor=mode == '1049')
+            elif mode == '25':
+                self.cursor_visible = enable
+            elif mode == '7':
+                self.autowrap = enable
+            elif enable:
+                self.modes.add('?' + mode)
+            else:
+                self.modes.discard('?' + mode)
+    
+    def switch_screen(self, alternate, save_cursor):
+        if alternate == (self.grid is self.alt):
+            return
+        if alternate:
+            if save_cursor:
+                self.saved_cursor = (self.x, self.y, self.attr)
+            self.alt = [self.blank_row() for _ in range(self.rows)]
+            self.grid = self.alt
+        else:
+            self.grid = self.main
+            if save_cursor:
+                x, y, self.attr = self.saved_cursor
+                self.move_to(y, x)
+    
+    def select_graphic_rendition(self, params):
+        flags, fg, bg = set(self.attr[0]), self.attr[1], self.attr[2]
+        codes = params.split(';') if params else ['0']
+        i = 0
+        while i < len(codes):
+            group = codes[i]
+            if ':' in group:
+                # Colon sub-parameters: 38:2::r:g:b, 4:3 (curly underline)
+                head = group.split(':')[0]
+                if head in ('38', '48'):
+                    if head == '38':
+                        fg = group
+                    else:
+                        bg = group
+                    i += 1
+                    continue
+                group = head
+            code = int(group) if group.isdigit() else 0
+            
+            if code == 0:
+                flags.clear()
+                fg = bg = None
+            elif code in (38, 48):
+                # Extended colour: 38;5;n or 38;2;r;g;b
+                length = {'5': 3, '2': 5}.get(codes[i + 1] if i + 1 < len(codes) else '', 1)
+                value = ';'.join(codes[i:i + length]) if length > 1 else None
+                if code == 38:
+                    fg = value
+                else:
+                    bg = value
+                i += length - 1
+            elif 30 <= code <= 37 or 90 <= code <= 97:
+                fg = str(code)
+            elif 40 <= code <= 47 or 100 <= code <= 107:
+                bg = str(code)
+            elif code == 39:
+                fg = None
+            elif code == 49:
+                bg = None
+            elif 1 <= code <= 9 or code == 21:
+                flags.add(str(code))
+            elif code in (22, 23, 24, 25, 27, 28, 29):
+                cleared = {22: ('1', '2'), 24: ('4', '21'), 25: ('5', '6')}
+                flags.difference_update(cleared.get(code, (str(code - 20),)))
+            i += 1
+        self.attr = (tuple(sorted(flags)), fg, bg)
+    
+    # Geometry
+    
+    def resize(self, rows, cols):
+        if (rows, cols) == (self.rows, self.cols) or rows < 1 or cols < 1:
+            return
+        for grid in (self.main, self.alt):
+            for y, row in enumerate(grid):
+                if len(row) > cols:
+                    grid[y] = row[:cols]
+                elif len(row) < cols:
+                    grid[y] = row + [(' ', self.DEFAULT_ATTR)] * (cols - len(row))
+        self.cols = cols
+        
+        if rows < self.rows:
+            # Drop blank lines below the cursor first, then push lines off the top
+            below = self.rows - 1 - self.y
+            from_bottom = min(below, self.rows - rows)
+            from_top = self.rows - rows - from_bottom
+            for grid in (self.main, self.alt):
+                del grid[len(grid) - from_bottom:]
+                if grid is self.main:
+                    self.history.extend(grid[:from_top])
+                del grid[:from_top]
+            self.y -= from_top
+        else:
+            for grid in (self.main, self.alt):
+                grid.extend(self.blank_row() for _ in range(rows - self.rows))
+        
+        self.rows = rows
+        self.top, self.bottom = 0, rows - 1
+        self.move_to(self.y, self.x)
+    
+    # Snapshot
+    
+    def sgr(self, attr):
+        flags, fg, bg = attr
+        codes = ['0', *flags]
+        if fg:
+            codes.append(fg)
+        if bg:
+            codes.append(bg)
+        return '\x1b[' + ';'.join(codes) + 'm'
+    
+    def render_row(self, row):
+        end = len(row)
+        while end and row[end - 1] == (' ', self.DEFAULT_ATTR):
+            end -= 1
+        out = []
+        current = self.DEFAULT_ATTR
+        for ch, attr in row[:end]:
+            if attr != current:
+                out.append(self.sgr(attr))
+                current = attr
+            out.append(ch)
+        if current != self.DEFAULT_ATTR:
+            out.append('\x1b[0m')
+        return ''.join(out)
+    
+    def snapshot(self):
+        """Escape sequences that redraw recent history and the current screen"""
+        alternate = self.grid is self.alt
+        out = ['\x1b[0m\x1b[H\x1b[2J']
+        out.append('\r\n'.join(self.render_row(row) for row in [*self.history, *self.main]))
+        
+        if alternate:
+            # Main screen cursor first, so leaving the alt screen restores it
+            x, y, _ = self.saved_cursor
+            out.append(f'\x1b[{y + 1};{x + 1}H\x1b[?1049h')
+            for y, row in enumerate(self.alt):
+                out.append(f'\x1b[{y + 1};1H' + self.render_row(row))
+        
+        if (self.top, self.bottom) != (0, self.rows - 1):
+            out.append(f'\x1b[{self.top + 1};{self.bottom + 1}r')
+        out.append(f'\x1b[{self.y + 1};{self.x + 1}H')
+        out.append(self.sgr(self.attr))
+        for mode in sorted(self.modes):
+            out.append(f'\x1b[{mode}h')
+        if not self.autowrap:
+            out.append('\x1b[?7l')
+        if not self.cursor_visible:
+            out.append('\x1b[?25l')
+        return ''.join(out)
+
+class AsciicastRecorder:
+    """Asciicast v2 recording of one session, written off the loop.
+    
+    The session appends raw events on the loop; every RECORD_FLUSH_INTERVAL
+    the list is handed to the default executor, which decodes, encodes and
+    writes it, one batch at a time and in order. A file that grows past
+    max_bytes is closed and the next part starts with its own header and
+    clock.
+    """
+    def __init__(self, directory, name, loop, rows=24, cols=80,
+                 max_bytes=RECORD_MAX_BYTES, record_input=False):
+        self.directory = directory
+        self.name = name
+        self.loop = loop
+        self.max_bytes = max_bytes
+        self.record_input = record_input
+        self.started = time.monotonic()
+        self.created = time.time()
+        self.events = []  # (seconds since start, kind, payload)
+        self.flush_handle = None
+        self.writing = False
+        self.closing = False
+        
+        # Writer state, only touched by the batch in flight
+        self.rows = rows
+        self.cols = cols
+        self.file = None
+        self.path = None
+        self.part = 0
+        self.part_start = 0.0
+        self.size = 0
+        self.decoders = {kind: codecs.getincrementaldecoder('utf-8')(errors='replace')
+                         for kind in 'oi'}
+    
+    def output(self, data):
+        self.record('o', data)
+    
+    def input(self, data):
+        # Off by default: keystrokes include passwords typed at prompts
+        if self.record_input:
+            self.record('i', data)
+    
+    def resize(self, rows, cols):
+        self.record('r', (rows, cols))
+    
+    def record(self, kind, payload):
+        if self.closing:
+            return
+        self.events.append((time.monotonic() - self.started, kind, payload))
+        if self.flush_handle is None and not self.writing:
+            self.flush_handle = self.loop.call_later(RECORD_FLUSH_INTERVAL, self.flush)
+    
+    def flush(self):
+        """Hand the buffered events to the executor"""
+        self.flush_handle = None
+        batch, self.events = self.events, []
+        self.writing = True
+        future = self.loop.run_in_executor(None, self.write_batch, batch, self.closing)
+        future.add_done_callback(self.batch_written)
+    
+    def batch_written(self, future):
+        self.writing = False
+        try:
+            final = future.result()
+        except OSError as e:
+            print(f"Recording {self.path} stopped: {e}")
+            self.closing = True
+            self.events.clear()
+            self.loop.run_in_executor(None, self.close_file)
+            return
+        if final:
+            return
+        if self.closing:
+            self.flush()
+        elif self.events:
+            self.flush_handle = self.loop.call_later(RECORD_FLUSH_INTERVAL, self.flush)
+    
+    def close(self):
+        """Write out what is buffered, then close the file"""
+        if self.closing:
+            return
+        self.closing = True
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.writing:
+            self.flush()
+    
+    def open_part(self, at):
+        self.close_file()
+        self.path = os.path.join(self.directory, f'{self.name}-{self.part:03d}.cast')
+        self.part += 1
+        self.part_start = at
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = open(self.path, 'wb')
+        header = {
+            'version': 2,
+            'width': self.cols,
+            'height': self.rows,
+            'timestamp': int(self.created + at),
+            'env': {'SHELL': os.environ.get('SHELL', '/bin/bash'), 'TERM': 'xterm-256color'},
+        }
+        line = (json.dumps(header) + '\n').encode()
+        self.file.write(line)
+        self.size = len(line)
+    
+    def write_batch(self, batch, final):
+        """Append a batch of events to the file (runs on the executor)"""
+        lines = []
+        for at, kind, payload in batch:
+            if self.file is None or self.size >= self.max_bytes:
+                if lines:
+                    self.file.write(b''.join(lines))
+                    lines = []
+                self.open_part(at)
+            if kind == 'r':
+                self.rows, self.cols = payload
+                text = f'{self.cols}x{self.rows}'
+            else:
+                text = self.decoders[kind].decode(payload)
+                if not text:
+                    continue
+            line = (json.dumps([round(at - self.part_start, 6), kind, text]) + '\n').encode()
+            lines.append(line)
+            self.size += len(line)
+        if lines:
+            self.file.write(b''.join(lines))
+        if final:
+            self.close_file()
+        elif self.file:
+            self.file.flush()
+        return final
+    
+    def close_file(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def read_cast(f):
+    """Header and an iterator of (time, kind, data) for an open asciicast v2 file"""
+    header = json.loads(f.readline())
+    if not isinstance(header, dict) or header.get('version') != 2:
+        raise ValueError(f'{f.name} is not an asciicast v2 recording')
+    events = (json.loads(line) for line in f if line.strip())
+    return header, ((float(at), kind, data) for at, kind, data in events)
+
+class TerminalSession:
+    """One PTY and login shell, with the WebSocket clients attached to it.
+    
+    Everything here runs on the WebSocket server loop.
+    """
+    def __init__(self, session_id, loop, coalesce_delay=COALESCE_DELAY,
+                 coalesce_bytes=COALESCE_BYTES, high_watermark=HIGH_WATERMARK,
+                 low_watermark=LOW_WATERMARK, scrollback_bytes=SCROLLBACK_BYTES,
+                 screen_model=SCREEN_MODEL, record_dir=None, record_input=False,
+                 record_max_bytes=RECORD_MAX_BYTES, resize_policy=RESIZE_POLICY,
+                 resize_debounce=RESIZE_DEBOUNCE, pooled=False, cwd=None):
+        self.id = session_id
+        # Directory the shell starts in (the workspace); None for ours
+        self.cwd = cwd
+        self.instance = secrets.token_hex(8)
+        self.loop = loop
+        self.created = time.time()
+        self.started = time.monotonic()
+        # Seconds from spawn to the shell's first output (usually the prompt)
+        self.first_output = None
+        # Monotonic counts for /api/metrics; see Metrics
+        self.counters = {'pty_read_bytes_total': 0, 'pty_reads_total': 0,
+                         'frames_sent_total': 0, 'bytes_sent_total': 0,
+                         'clients_dropped_total': 0, 'read_pauses_total': 0,
+                         'viewer_resyncs_total': 0, 'viewers_dropped_total': 0,
+                         'resize_requests_total': 0, 'resizes_applied_total': 0}
+        self.closed = False
+        self.clients = set()
+        self.send_queues = {}
+        self.client_stats = {}
+        
+        # Read-only viewers are written to directly and skipped while their
+        # socket is backed up, so they never hold up the interactive clients
+        self.viewers = set()
+        self.lagging = {}  # viewer -> loop time it fell behind
+        self.lag_check = None
+        
+        # Clients get raw bytes as binary frames unless they ask for text;
+        # text clients share one incremental decoder so split UTF-8
+        # sequences survive chunk boundaries
+        self.text_clients = set()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        
+        # Output coalescing
+        self.coalesce_delay = coalesce_delay
+        self.coalesce_bytes = coalesce_bytes
+        self.pending_output = bytearray()
+        self.flush_handle = None
+        self.last_flush = 0.0
+        
+        # Flow control: unacked byte counts for clients that send acks
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.unacked = {}
+        self.reading_paused = False
+        
+        # Input from consecutive frames is written to the PTY in one go;
+        # when the PTY can't take it all, the rest waits for writability
+        self.pending_input = bytearray()
+        self.input_scheduled = False
+        self.writer_active = False
+        self.input_drained = asyncio.Event()
+        self.input_drained.set()
+        
+        # Replay buffer for reconnecting clients
+        self.scrollback = ScrollbackBuffer(scrollback_bytes)
+        self.screen = ScreenModel() if screen_model else None
+        self.rows, self.cols = 24, 80
+        
+        # Size each interactive client asked for (None until it says), in
+        # attach order; the PTY gets the negotiated size once they settle
+        self.resize_policy = resize_policy
+        self.resize_debounce = resize_debounce
+        self.client_sizes = {}
+        self.resize_handle = None
+        
+        # Optional asciicast recording of output (and input, if enabled);
+        # a pooled shell starts recording when it is handed out
+        self.record_options = (record_dir, record_input, record_max_bytes)
+        self.recorder = None
+        self.pooled = pooled
+        if not pooled:
+            self.start_recording()
+        
+        self.shell_process = None
+        self.master_fd = None
+        self.setup_pty()
+    
+    def start_recording(self):
+        """Open the asciicast recorder, if recording is on"""
+        record_dir, record_input, record_max_bytes = self.record_options
+        if not record_dir:
+            return
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.created))
+        self.recorder = AsciicastRecorder(
+            record_dir, f'{self.id}-{stamp}-{self.instance[:6]}', self.loop,
+            self.rows, self.cols, max_bytes=record_max_bytes, record_input=record_input)
+        # Output from before the hand-out, such as a pooled shell's prompt
+        if self.scrollback.end:
+            self.recorder.output(self.scrollback.read_from(self.scrollback.start))
+    
+    def adopt(self, session_id):
+        """Take over a pooled shell as session session_id"""
+        print(f"Session {session_id}: using pre-started shell {self.id}")
+        self.id = session_id
+        self.created = time.time()
+        self.start_recording()
+    
+    def setup_pty(self):
+        """Create PTY and shell process, and start reading it on the loop"""
+        try:
+            # Create PTY, at the size clients are assumed to have until
+            # they say otherwise
+            self.master_fd, slave_fd = pty.openpty()
+            self.set_winsize(slave_fd, self.rows, self.cols)
+            
+            # Start shell
+            shell = os.environ.get('SHELL', '/bin/bash')
+            env = os.environ.copy()
+            env['TERM'] = 'xterm-256color'
+            
+            self.shell_process = subprocess.Popen(
+                [shell, '-l'],  # Login shell
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                env=env,
+                cwd=self.cwd,
+                preexec_fn=os.setsid
+            )
+            
+            # Only the shell keeps the slave end open, so its exit shows up
+            # as EOF on master_fd
+            os.close(slave_fd)
+            os.set_blocking(self.master_fd, False)
+            self.loop.add_reader(self.master_fd, self.read_pty)
+            
+            print(f"PTY created with shell: {shell} (session {self.id})")
+            
+        except Exception as e:
+            print(f"Failed to create PTY: {e}")
+            self.close()
+            raise
+    
+    def read_pty(self):
+        """Read from PTY and send to WebSocket clients (runs on the server loop)"""
+        try:
+            data = os.read(self.master_fd, 8192)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        
+        if not data:
+            # Shell exited; deliver what is left and tear the session down
+            self.flush_output()
+            if self.text_clients:
+                self.broadcast_to_clients(b'', self.decoder.decode(b'', final=True))
+            print(f"PTY closed (session {self.id})")
+            self.close()
+            return
+        self.handle_output(data)
+    
+    def handle_output(self, data):
+        """Account a chunk of output and flush it now or after coalescing"""
+        counters = self.counters
+        counters['pty_reads_total'] += 1
+        counters['pty_read_bytes_total'] += len(data)
+        
+        idle = not self.pending_output and self.loop.time() - self.last_flush > self.coalesce_delay
+        self.pending_output += data
+        
+        if idle or len(self.pending_output) >= self.coalesce_bytes:
+            # Interactive echo goes out immediately, bursts are batched
+            self.flush_output()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.coalesce_delay, self.flush_output)
+    
+    def flush_output(self):
+        """Send coalesced PTY output to clients"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.last_flush = self.loop.time()
+        
+        if not self.pending_output:
+            return
+        data = bytes(self.pending_output)
+        self.pending_output.clear()
+        if self.first_output is None:
+            self.first_output = time.monotonic() - self.started
+            print(f"Session {self.id}: first shell output after {self.first_output * 1000:.0f} ms")
+        self.scrollback.append(data)
+        if self.screen:
+            self.screen.feed(data)
+        if self.recorder:
+            self.recorder.output(data)
+        
+        text = None
+        if self.text_clients:
+            text = self.decoder.decode(data)
+        self.broadcast_to_clients(data, text)
+    
+    def broadcast_to_clients(self, data, text=None):
+        """Queue data for all WebSocket clients"""
+        for client in list(self.send_queues):
+            frame = text if client in self.text_clients else data
+            if frame:
+                self.send_to_client(client, frame)
+        if self.viewers and data:
+            self.broadcast_to_viewers(data)
+    
+    def broadcast_to_viewers(self, data):
+        """Write one shared frame to every viewer that is keeping up"""
+        live = []
+        for viewer in self.viewers:
+            if viewer in self.lagging:
+                continue
+            if viewer.transport.get_write_buffer_size() > VIEWER_LAG_BYTES:
+                # Stop buffering for it; it gets a redraw once it drains
+                self.lagging[viewer] = self.loop.time()
+                if self.lag_check is None:
+                    self.lag_check = self.loop.call_later(VIEWER_CHECK_INTERVAL, self.check_lagging)
+                continue
+            live.append(viewer)
+        
+        websockets.broadcast(live, data)
+        for viewer in live:
+            stats = self.client_stats[viewer]
+            stats['frames'] += 1
+            stats['bytes'] += len(data)
+        self.counters['frames_sent_total'] += len(live)
+        self.counters['bytes_sent_total'] += len(data) * len(live)
+    
+    def check_lagging(self):
+        """Redraw viewers that have drained; drop those behind for too long"""
+        self.lag_check = None
+        now = self.loop.time()
+        for viewer, since in list(self.lagging.items()):
+            if viewer.transport.get_write_buffer_size() <= VIEWER_RESYNC_BYTES:
+                del self.lagging[viewer]
+                self.counters['viewer_resyncs_total'] += 1
+                self.replay_to_client(viewer, {})
+            elif now - since > VIEWER_DROP_AFTER:
+                print(f"Viewer of session {self.id} too far behind, disconnecting")
+                self.counters['viewers_dropped_total'] += 1
+                self.remove_client(viewer)
+                asyncio.ensure_future(viewer.close(1013, 'viewer lagging'))
+        if self.lagging and not self.closed:
+            self.lag_check = self.loop.call_later(VIEWER_CHECK_INTERVAL, self.check_lagging)
+    
+    def send_frame(self, client, frame):
+        """Send one frame to a client, by its queue or directly for viewers"""
+        if client in self.viewers:
+            websockets.broadcast([client], frame)
+        else:
+            self.send_to_client(client, frame)
+    
+    def send_to_client(self, client, frame):
+        """Queue one frame for a client, accounting it for flow control"""
+        try:
+            self.send_queues[client].put_nowait(frame)
+        except asyncio.QueueFull:
+            # Client can't keep up; drop it rather than stall the reader
+            print("Terminal client too slow, disconnecting")
+            self.counters['clients_dropped_total'] += 1
+            self.remove_client(client)
+            asyncio.ensure_future(client.close(1013, 'send queue overflow'))
+            return
+        
+        # Binary clients only ack PTY bytes, not control messages
+        counted = client in self.text_clients or not isinstance(frame, str)
+        if counted and client in self.unacked:
+            self.unacked[client] += len(frame)
+            if self.unacked[client] > self.high_watermark:
+                self.pause_reading()
+    
+    def replay_to_client(self, client, params):
+        """Send a newly attached client the output it hasn't seen yet"""
+        data = None
+        if params.get('instance') == [self.instance]:
+            try:
+                data = self.scrollback.read_from(int(params['offset'][0]))
+            except (KeyError, ValueError):
+                pass
+        
+        # Resume from the client's offset if still buffered, else redraw
+        # from the screen model or replay everything buffered
+        reset = data is None
+        if reset and self.screen:
+            data = self.screen.snapshot().encode('utf-8')
+        elif reset:
+            data = self.scrollback.read_from(self.scrollback.start)
+        
+        if client in self.text_clients:
+            # Text clients predate the control channel; just replay
+            text = codecs.decode(data, 'utf-8', errors='replace')
+            if text:
+                self.send_to_client(client, text)
+            return
+        
+        self.send_frame(client, json.dumps({
+            'type': 'hello',
+            'session': self.id,
+            'instance': self.instance,
+            'offset': self.scrollback.end,  # where the live stream resumes
+            'replay': len(data),            # bytes of replay sent before it
+            'reset': reset,
+            'viewer': client in self.viewers,
+        }))
+        for start in range(0, len(data), COALESCE_BYTES):
+            self.send_frame(client, data[start:start + COALESCE_BYTES])
+    
+    def ack_output(self, client, count):
+        """Record output the client's terminal has finished rendering"""
+        if client not in self.unacked:
+            return
+        self.unacked[client] = max(0, self.unacked[client] - count)
+        self.maybe_resume_reading()
+    
+    def pause_reading(self):
+        """Stop reading the PTY so the shell blocks on a full tty buffer"""
+        if not self.reading_paused and not self.closed:
+            self.set_reading(False)
+            self.reading_paused = True
+            self.counters['read_pauses_total'] += 1
+    
+    def maybe_resume_reading(self):
+        """Resume reading once every flow-controlled client has caught up"""
+        if not self.reading_paused or self.closed:
+            return
+        if all(count <= self.low_watermark for count in self.unacked.values()):
+            self.reading_paused = False
+            self.set_reading(True)
+    
+    def set_reading(self, enabled):
+        if enabled:
+            self.loop.add_reader(self.master_fd, self.read_pty)
+        else:
+            self.loop.remove_reader(self.master_fd)
+    
+    def remove_client(self, client):
+        """Forget a client and any flow control state it holds"""
+        self.send_queues.pop(client, None)
+        self.client_stats.pop(client, None)
+        self.clients.discard(client)
+        self.text_clients.discard(client)
+        self.viewers.discard(client)
+        self.lagging.pop(client, None)
+        if self.client_sizes.pop(client, None) and not self.closed:
+            # The PTY may be able to grow now
+            self.schedule_resize()
+        if self.unacked.pop(client, None) is not None:
+            self.maybe_resume_reading()
+    
+    async def client_sender(self, websocket, queue):
+        """Drain a client's send queue onto its WebSocket"""
+        stats = self.client_stats[websocket]
+        counters = self.counters
+        try:
+            while True:
+                data = await queue.get()
+                await websocket.send(data)
+                stats['frames'] += 1
+                stats['bytes'] += len(data)
+                counters['frames_sent_total'] += 1
+                counters['bytes_sent_total'] += len(data)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    
+    def connection_info(self, websocket):
+        """Traffic stats for one client, including compression ratio"""
+        stats = self.client_stats.get(websocket, {'frames': 0, 'bytes': 0})
+        deflate = next((ext for ext in websocket.protocol.extensions
+                        if isinstance(ext, ThresholdPerMessageDeflate)), None)
+        payload = deflate.payload_bytes if deflate else stats['bytes']
+        wire = deflate.wire_bytes if deflate else stats['bytes']
+        return {
+            'remote': '%s:%s' % websocket.remote_address[:2],
+            'viewer': websocket in self.viewers,
+            'frames': stats['frames'],
+            'bytes': stats['bytes'],
+            'wire_bytes': wire,
+            'compressed': deflate is not None,
+            'compression_ratio': round(payload / wire, 2) if wire else None,
+        }
+    
+    async def websocket_handler(self, websocket, params):
+        """Handle a WebSocket client attached to this session"""
+        self.clients.add(websocket)
+        self.client_stats[websocket] = {'frames': 0, 'bytes': 0}
+        sender = None
+        
+        # Viewers (?role=viewer) take binary output only and can't type,
+        # resize or hold up the PTY
+        viewer = params.get('role') == ['viewer']
+        if viewer:
+            self.viewers.add(websocket)
+        else:
+            queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+            self.send_queues[websocket] = queue
+            self.client_sizes[websocket] = None
+            
+            # Clients opt into flow control with ?flow=1 and must then ack output
+            if params.get('flow') == ['1']:
+                self.unacked[websocket] = 0
+            
+            # Compatibility path for clients that can't take binary frames
+            if params.get('mode') == ['text']:
+                if not self.text_clients:
+                    self.decoder.reset()
+                self.text_clients.add(websocket)
+        
+        self.replay_to_client(websocket, params)
+        if not viewer:
+            sender = asyncio.create_task(self.client_sender(websocket, queue))
+        role = 'viewer' if viewer else 'client'
+        print(f"Terminal {role} connected to session {self.id}. Total: {len(self.clients)}")
+        
+        # Input held back while a big paste drains. The frame loop keeps
+        # going: if it stopped, the acks that let the PTY be read again
+        # (and so let the shell take more input) would never arrive
+        held = collections.deque()
+        releaser = None
+        try:
+            async for message in websocket:
+                data = None
+                if isinstance(message, str):
+                    opcode, payload = message[:1], message[1:]
+                    if opcode == OP_INPUT:
+                        data = payload.encode('utf-8')
+                    else:
+                        self.handle_control(websocket, opcode, payload)
+                elif message[:1] == OP_INPUT.encode():
+                    # Binary input - send directly to PTY
+                    data = message[1:]
+                
+                if data and not viewer:
+                    if held or not self.input_drained.is_set():
+                        held.append(data)
+                        if releaser is None or releaser.done():
+                            releaser = asyncio.create_task(self.release_input(held))
+                    else:
+                        self.write_input(data)
+                        
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"WebSocket error: {e}")
+        finally:
+            if sender:
+                sender.cancel()
+            if releaser:
+                releaser.cancel()
+            self.remove_client(websocket)
+            print(f"Terminal {role} disconnected from session {self.id}. Total: {len(self.clients)}")
+    
+    def handle_control(self, websocket, opcode, payload):
+        """Apply a resize, ping or ack frame; malformed ones are ignored"""
+        try:
+            if opcode == OP_RESIZE:
+                if websocket not in self.viewers:
+                    size = json.loads(payload)
+                    self.request_resize(websocket, int(size['rows']), int(size['cols']))
+            elif opcode == OP_PING:
+                if websocket not in self.text_clients:
+                    self.send_frame(websocket, json.dumps({'type': 'pong', 'token': payload}))
+            elif opcode == OP_ACK:
+                self.ack_output(websocket, int(payload))
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"Bad control frame {opcode!r}: {e}")
+    
+    async def release_input(self, held):
+        """Pass a client's held-back input to the PTY, in order, as it drains"""
+        while held:
+            await self.input_drained.wait()
+            self.write_input(held.popleft())
+    
+    def write_input(self, data):
+        """Queue input for the PTY; frames that arrive together share a write"""
+        if self.closed or not data:
+            return
+        if self.recorder:
+            self.recorder.input(data)
+        self.pending_input += data
+        if len(self.pending_input) >= MAX_PENDING_INPUT:
+            self.input_drained.clear()
+        if not self.input_scheduled and not self.writer_active:
+            self.input_scheduled = True
+            self.loop.call_soon(self.flush_input)
+    
+    def flush_input(self):
+        """Write pending input until the PTY stops accepting it"""
+        self.input_scheduled = False
+        if self.closed:
+            self.pending_input.clear()
+            self.input_drained.set()
+            return
+        
+        while self.pending_input:
+            end = input_chunk_end(self.pending_input, INPUT_CHUNK)
+            try:
+                written = os.write(self.master_fd, self.pending_input[:end])
+            except BlockingIOError:
+                written = 0
+            except OSError as e:
+                print(f"PTY write error: {e}")
+                self.pending_input.clear()
+                break
+            del self.pending_input[:written]
+            if written < end:
+                # PTY input buffer is full; carry on once it's writable
+                if not self.writer_active:
+                    self.loop.add_writer(self.master_fd, self.flush_input)
+                    self.writer_active = True
+                break
+        else:
+            if self.writer_active:
+                self.loop.remove_writer(self.master_fd)
+                self.writer_active = False
+        
+        if len(self.pending_input) < MAX_PENDING_INPUT // 2:
+            self.input_drained.set()
+    
+    def request_resize(self, client, rows, cols):
+        """Note the size a client wants; the PTY follows once sizes settle"""
+        if not (0 < rows <= MAX_TERMINAL_SIZE and 0 < cols <= MAX_TERMINAL_SIZE):
+            raise ValueError(f'bad terminal size {rows}x{cols}')
+        if self.client_sizes.get(client) == (rows, cols):
+            return
+        self.client_sizes[client] = (rows, cols)
+        self.counters['resize_requests_total'] += 1
+        self.schedule_resize()
+    
+    def schedule_resize(self):
+        # Every change restarts the timer, so only the settled size is applied
+        if self.resize_handle is not None:
+            self.resize_handle.cancel()
+        self.resize_handle = self.loop.call_later(self.resize_debounce, self.apply_resize)
+    
+    def negotiated_size(self):
+        """The PTY size the attached clients agree on, or None"""
+        sizes = [size for size in self.client_sizes.values() if size]
+        if not sizes:
+            return None
+        if self.resize_policy == 'owner':
+            return sizes[0]
+        return min(rows for rows, _ in sizes), min(cols for _, cols in sizes)
+    
+    def apply_resize(self):
+        """Resize the PTY to the negotiated size, if it changed"""
+        self.resize_handle = None
+        size = self.negotiated_size()
+        if self.closed or size is None or size == (self.rows, self.cols):
+            return
+        self.resize_pty(*size)
+        self.counters['resizes_applied_total'] += 1
+        
+        # Tell clients, since a bigger window than the PTY leaves blank space
+        message = json.dumps({'type': 'size', 'rows': self.rows, 'cols': self.cols})
+        for client in list(self.clients):
+            if client not in self.text_clients:
+                self.send_frame(client, message)
+    
+    def set_winsize(self, fd, rows, cols):
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+    
+    def resize_pty(self, rows, cols):
+        """Resize PTY"""
+        try:
+            self.set_winsize(self.master_fd, rows, cols)
+            self.rows, self.cols = rows, cols
+            if self.screen:
+                self.screen.resize(rows, cols)
+            if self.recorder:
+                self.recorder.resize(rows, cols)
+        except Exception as e:
+            print(f"Resize error: {e}")
+    
+    def close(self):
+        """Stop reading, close the PTY and hang up the shell and its clients"""
+        if self.closed:
+            return
+        self.closed = True
+        
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.lag_check is not None:
+            self.lag_check.cancel()
+            self.lag_check = None
+        if self.resize_handle is not None:
+            self.resize_handle.cancel()
+            self.resize_handle = None
+        if self.master_fd is not None:
+            self.loop.remove_reader(self.master_fd)
+            self.loop.remove_writer(self.master_fd)
+            os.close(self.master_fd)
+        self.pending_input.clear()
+        self.input_drained.set()
+        if self.recorder:
+            self.recorder.close()
+        
+        if self.shell_process and self.shell_process.poll() is None:
+            try:
+                os.killpg(self.shell_process.pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+        
+        for client in list(self.clients):
+            self.remove_client(client)
+            asyncio.ensure_future(client.close(1000, 'session ended'))
+    
+    def info(self):
+        """Summary of the session for the sessions API"""
+        return {
+            'id': self.id,
+            'pid': self.shell_process.pid if self.shell_process else None,
+            'clients': len(self.clients),
+            'rows': self.rows,
+            'cols': self.cols,
+            'created': self.created,
+            'first_output': self.first_output,
+            'alive': not self.closed,
+            'ws_path': f'/ws/{self.id}',
+            'recording': self.recorder.path if self.recorder else None,
+            'pooled': self.pooled,
+            'connections': [self.connection_info(client) for client in self.clients],
+        }
+
+class ReplaySession(TerminalSession):
+    """A session whose output comes from an asciicast recording, not a shell.
+    
+    Output goes through the same coalescing, scrollback and broadcast path
+    as a PTY's, at speed times the recorded pace (0 for as fast as the
+    clients keep up), so real sessions double as repeatable workloads.
+    Playback starts when the first client attaches; client input is
+    dropped.
+    """
+    def __init__(self, session_id, loop, path, speed=REPLAY_SPEED, **options):
+        self.cast_path = path
+        self.speed = speed
+        self.cast_file = None
+        self.cast_events = None
+        self.replay_task = None
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.replay_stats = {'path': path, 'speed': speed, 'events': 0, 'bytes': 0,
+                             'seconds': None, 'finished': False}
+        super().__init__(session_id, loop, **dict(options, record_dir=None))
+    
+    def setup_pty(self):
+        self.cast_file = open(self.cast_path, encoding='utf-8')
+        try:
+            header, self.cast_events = read_cast(self.cast_file)
+        except ValueError:
+            self.cast_file.close()
+            raise
+        self.resize_pty(int(header.get('height', 24)), int(header.get('width', 80)))
+        pace = f'{self.speed}x' if self.speed else 'full speed'
+        print(f"Replay of {self.cast_path} at {pace} ready (session {self.id})")
+    
+    async def replay(self):
+        """Feed the recording's output events through handle_output"""
+        stats = self.replay_stats
+        started = self.loop.time()
+        try:
+            while True:
+                batch = await self.loop.run_in_executor(
+                    None, list, itertools.islice(self.cast_events, REPLAY_BATCH))
+                if not batch:
+                    break
+                for at, kind, data in batch:
+                    if kind == 'r':
+                        cols, _, rows = data.partition('x')
+                        self.resize_pty(int(rows), int(cols))
+                        continue
+                    if kind != 'o':
+                        continue
+                    if self.speed:
+                        delay = started + at / self.speed - self.loop.time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    if not self.resumed.is_set():
+                        # Clients are behind; hold the recorded pace from here
+                        paused = self.loop.time()
+                        await self.resumed.wait()
+                        started += self.loop.time() - paused
+                    elif not self.speed:
+                        await asyncio.sleep(0)
+                    data = data.encode('utf-8')
+                    stats['events'] += 1
+                    stats['bytes'] += len(data)
+                    self.handle_output(data)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Replay of {self.cast_path} failed: {e}")
+        
+        self.flush_output()
+        stats['seconds'] = round(self.loop.time() - started, 3)
+        stats['finished'] = True
+        print(f"Replay finished (session {self.id}): {stats['bytes']} bytes in {stats['seconds']} s")
+        end = json.dumps(dict(stats, type='replay_end'))
+        for client in list(self.send_queues):
+            if client not in self.text_clients:
+                self.send_to_client(client, end)
+    
+    async def websocket_handler(self, websocket, params):
+        if self.replay_task is None:
+            self.replay_task = asyncio.create_task(self.replay())
+        await super().websocket_handler(websocket, params)
+    
+    def set_reading(self, enabled):
+        if enabled:
+            self.resumed.set()
+        else:
+            self.resumed.clear()
+    
+    def write_input(self, data):
+        pass
+    
+    def resize_pty(self, rows, cols):
+        self.rows, self.cols = rows, cols
+        if self.screen:
+            self.screen.resize(rows, cols)
+    
+    def close(self):
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+        if self.cast_file is not None:
+            self.cast_file.close()
+        super().close()
+    
+    def info(self):
+        return dict(super().info(), replay=self.replay_stats)
+
+class ShellPool:
+    """Login shells started ahead of time and handed out as new sessions.
+    
+    Waiting shells are ordinary TerminalSessions with no clients; their
+    startup output goes to the scrollback and is replayed to the first
+    client. Runs on the WebSocket server loop.
+    """
+    def __init__(self, size=SHELL_POOL_SIZE, idle_timeout=SHELL_POOL_IDLE, **session_options):
+        self.loop = None
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.session_options = session_options
+        self.shells = collections.deque()  # (session, loop time it was started)
+        self.refill_handle = None
+        self.closed = False
+        self.stats = {'hits': 0, 'misses': 0, 'started': 0, 'expired': 0, 'exited': 0}
+    
+    def take(self):
+        """The longest-waiting shell, or None when the pool is empty"""
+        stale = self.prune()
+        if self.shells:
+            session, _ = self.shells.popleft()
+            self.stats['hits'] += 1
+        else:
+            session = None
+            self.stats['misses'] += 1
+        self.refill()
+        return session, stale
+    
+    def refill(self):
+        """Start shells until the pool is full, one per loop iteration"""
+        if self.closed or self.refill_handle is not None:
+            return
+        if len(self.shells) < self.size:
+            self.refill_handle = self.loop.call_soon(self.start_one)
+    
+    def start_one(self):
+        self.refill_handle = None
+        if len(self.shells) >= self.size:
+            return
+        try:
+            session = TerminalSession(f'pool-{secrets.token_hex(4)}', self.loop,
+                                      pooled=True, **self.session_options)
+        except Exception as e:
+            # Retried on the next reap
+            print(f"Shell pool: could not start a shell: {e}")
+            return
+        self.shells.append((session, self.loop.time()))
+        self.stats['started'] += 1
+        self.refill()
+    
+    def prune(self):
+        """Close shells that exited or waited too long; returns them for reaping"""
+        now = self.loop.time()
+        stale = []
+        for entry in list(self.shells):
+            session, started = entry
+            if session.closed or session.shell_process.poll() is not None:
+                self.stats['exited'] += 1
+            elif now - started > self.idle_timeout:
+                self.stats['expired'] += 1
+            else:
+                continue
+            self.shells.remove(entry)
+            session.close()
+            stale.append(session)
+        return stale
+    
+    def warm(self):
+        """Waiting shells whose startup output has arrived"""
+        return sum(session.first_output is not None for session, _ in self.shells)
+    
+    def info(self):
+        """Pool size and hit/miss counts for the sessions API"""
+        return dict(self.stats, size=self.size, waiting=len(self.shells), warm=self.warm(),
+                    idle_timeout=self.idle_timeout)
+    
+    def close(self):
+        """Close every waiting shell; returns them for reaping"""
+        self.closed = True
+        if self.refill_handle is not None:
+            self.refill_handle.cancel()
+            self.refill_handle = None
+        stale = [session for session, _ in self.shells]
+        self.shells.clear()
+        for session in stale:
+            session.close()
+        return stale
+
+class SessionManager:
+    """Registry of terminal sessions, keyed by session id"""
+    def __init__(self, max_sessions=MAX_SESSIONS, pool_size=SHELL_POOL_SIZE,
+                 pool_idle=SHELL_POOL_IDLE, **session_options):
+        self.loop = None
+        self.max_sessions = max_sessions
+        self.session_options = session_options
+        self.pool = ShellPool(pool_size, pool_idle, **session_options) if pool_size > 0 else None
+        self.sessions = {}
+        self.zombies = []
+        # Counters of sessions that are gone, so metric totals never go down
+        self.retired = collections.Counter()
+    
+    def create(self, session_id=None, replay=None, speed=REPLAY_SPEED):
+        """Start a new shell session, or a replay of an asciicast file"""
+        self.reap()
+        if len(self.sessions) >= self.max_sessions:
+            raise RuntimeError(f'Too many sessions (max {self.max_sessions})')
+        
+        session_id = session_id or secrets.token_hex(4)
+        if session_id in self.sessions:
+            raise ValueError(f'Session {session_id} already exists')
+        
+        session = None
+        if replay:
+            session = ReplaySession(session_id, self.loop, replay, speed, **self.session_options)
+        elif self.pool:
+            session, stale = self.pool.take()
+            self.zombies += stale
+            if session:
+                session.adopt(session_id)
+        if session is None:
+            session = TerminalSession(session_id, self.loop, **self.session_options)
+        self.sessions[session_id] = session
+        return session
+    
+    def start_pool(self):
+        """Begin filling the shell pool (once the loop is running)"""
+        if self.pool:
+            self.pool.loop = self.loop
+            self.pool.refill()
+    
+    def get(self, session_id):
+        """Look up a live session, or None"""
+        session = self.sessions.get(session_id)
+        if session is None or session.closed:
+            return None
+        return session
+    
+    def list(self):
+        """Info for all live sessions"""
+        self.reap()
+        return [session.info() for session in self.sessions.values()]
+    
+    def destroy(self, session_id):
+        """Close a session and hang up its shell"""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        self.retired.update(session.counters)
+        self.zombies.append(session)
+        return True
+    
+    def reap(self):
+        """Drop closed sessions and collect exited shells"""
+        if self.pool and self.pool.loop:
+            self.zombies += self.pool.prune()
+            self.pool.refill()
+        for session_id, session in list(self.sessions.items()):
+            if session.shell_process and session.shell_process.poll() is not None:
+                session.close()
+            if session.closed:
+                del self.sessions[session_id]
+                self.retired.update(session.counters)
+                self.zombies.append(session)
+        
+        # Wait on hung-up shells so they don't linger as zombies
+        self.zombies = [s for s in self.zombies
+                        if s.shell_process and s.shell_process.poll() is None]
+    
+    async def reaper(self):
+        """Periodically reap dead sessions"""
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            self.reap()
+    
+    def close_all(self):
+        """Close every session and pooled shell"""
+        for session_id in list(self.sessions):
+            self.destroy(session_id)
+        if self.pool:
+            self.zombies += self.pool.close()
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def samples(self, name, labels):
+        """(name, labels, value) rows for the text exposition format"""
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket', dict(labels, le=le), cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+class Metrics:
+    """Always-on instrumentation, rendered for /api/metrics.
+    
+    Hot paths only bump plain counters on the objects they already touch
+    (sessions, clients); everything else is read at scrape time. The
+    histograms here are the only shared state written from pool threads.
+    """
     def __init__(self):
+        self.lock = threading.Lock()
+        self.http = {}  # (method, route, status) -> Histogram
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.loop_lag_max = 0.0
+    
+    def observe_request(self, environ, status, seconds):
+        route = environ.get('bottle.route')
+        key = (environ['REQUEST_METHOD'], route.rule if route else 'unmatched', status.split()[0])
+        with self.lock:
+            histogram = self.http.get(key)
+            if histogram is None:
+                histogram = self.http[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+    
+    async def monitor_loop(self):
+        """Sample how late the event loop wakes up a sleeping task"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(loop.time() - start - LAG_INTERVAL, 0.0)
+            self.loop_lag.observe(lag)
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+    
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+    
+    def render(self, families):
+        """Prometheus text format for [(name, type, help, rows)]; rows are
+        (labels, value) or, for histograms, (sample name, labels, value)"""
+        lines = []
+        for name, kind, help_text, rows in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for row in rows:
+                sample, labels, value = row if len(row) == 3 else (name,) + tuple(row)
+                lines.append(f'{sample}{self.format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+class AssetBundle:
+    """The vendored xterm.js/Monaco bundle written by vendor_assets.py.
+    
+    Assets are served under /static/<bundle hash>/ so they can be cached
+    as immutable; without a bundle, pages load the same files from the CDN.
+    """
+    def __init__(self, root=STATIC_DIR):
+        self.root = root
+        self.hash = None
+        try:
+            with open(os.path.join(root, 'manifest.json')) as f:
+                self.hash = json.load(f)['hash']
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    @property
+    def prefix(self):
+        """Base URL that __ASSETS__ in page templates expands to"""
+        return f'/static/{self.hash}' if self.hash else ASSET_CDN
+    
+    def resolve(self, relpath, accept_encoding):
+        """(abs_path, content_encoding) of the best stored variant, or None"""
+        abs_path = os.path.normpath(os.path.join(self.root, relpath))
+        if not abs_path.startswith(self.root + os.sep) or not os.path.isfile(abs_path):
+            return None
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accept_encoding and os.path.isfile(abs_path + suffix):
+                return abs_path + suffix, encoding
+        return abs_path, None
+
+class AsyncHTTPServer:
+    """HTTP/1.1 front end for a WSGI app, running on an asyncio loop.
+    
+    Connections are parsed on the loop and kept alive between requests;
+    the app itself, and reading any streamed response body, run on a
+    bounded thread pool so one slow request doesn't hold up the rest.
+    Compressible responses are gzipped when the client accepts it.
+    """
+    REASONS = {400: 'Bad Request', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+               501: 'Not Implemented'}
+    
+    def __init__(self, app, executor, host, port, metrics=None):
+        self.app = app
+        self.metrics = metrics
+        self.executor = executor
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.connections = 0
+        self.requests = 0
+    
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                 limit=MAX_REQUEST_HEAD)
+    
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, 431)
+                    break
+                
+                try:
+                    environ = self.parse_head(head, peer)
+                except ValueError:
+                    await self.send_error(writer, 400)
+                    break
+                if 'HTTP_TRANSFER_ENCODING' in environ:
+                    # Browsers send a Content-Length for fetch() bodies
+                    await self.send_error(writer, 501)
+                    break
+                
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                if length > MAX_REQUEST_BODY:
+                    await self.send_error(writer, 413)
+                    break
+                if length and environ.get('HTTP_EXPECT', '').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                environ['wsgi.input'] = io.BytesIO(body)
+                
+                connection = environ.get('HTTP_CONNECTION', '').lower()
+                if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+                    keep_alive = 'close' not in connection
+                else:
+                    keep_alive = 'keep-alive' in connection
+                
+                self.requests += 1
+                keep_alive = await self.respond(writer, environ, keep_alive)
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            print(f"HTTP error: {e}")
+        finally:
+            self.connections -= 1
+            writer.close()
+    
+    def parse_head(self, head, peer):
+        """WSGI environ for a request head; raises ValueError if malformed"""
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, protocol = lines[0].split(' ')
+        if not protocol.startswith('HTTP/1.'):
+            raise ValueError(protocol)
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, 'latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': peer[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, value = line.split(':', 1)
+            key = name.strip().upper().replace('-', '_')
+            if key == 'CONTENT_LENGTH':
+                # Digits only, and no second header disagreeing with the first
+                value = value.strip()
+                if not re.fullmatch('[0-9]+', value) or environ.get(key, value) != value:
+                    raise ValueError(f'bad Content-Length {value!r}')
+                environ[key] = value
+            elif key == 'CONTENT_TYPE':
+                environ[key] = value.strip()
+            else:
+                key = 'HTTP_' + key
+                value = value.strip()
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+    
+    def call_app(self, environ):
+        """Run the app (on a pool thread); returns status, headers, body, iterator.
+        
+        Buffered responses come back as body bytes, gzipped if worthwhile;
+        anything else comes back as an iterator to drain chunk by chunk.
+        """
+        started = {}
+        written = []
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+            return written.append
+        
+        result = self.app(environ, start_response)
+        if not isinstance(result, (list, tuple)):
+            iterator = iter(result)
+            first = next(iterator, b'')
+            return started['status'], started['headers'], None, (result, iterator, written + [first])
+        
+        body = b''.join(written + list(result))
+        if hasattr(result, 'close'):
+            result.close()
+        headers = started['headers']
+        
+        # The one place Vary is set: for anything we might gzip here, for
+        # responses a handler already picked an encoding for, and for 304s
+        # (Bottle drops their Content-Type, but they stand in for one of those)
+        names = {name.lower(): value for name, value in headers}
+        content_type = names.get('content-type', '').split(';')[0].strip()
+        if content_type in GZIP_TYPES or 'content-encoding' in names or started['status'].startswith('304'):
+            headers = headers + [('Vary', 'Accept-Encoding')]
+        if content_type in GZIP_TYPES:
+            if (len(body) >= GZIP_MIN_SIZE and 'content-encoding' not in names and
+                    'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')):
+                body = gzip.compress(body, GZIP_LEVEL)
+                headers = [(name, value) for name, value in headers
+                           if name.lower() != 'content-length']
+                headers += [('Content-Encoding', 'gzip'), ('Content-Length', str(len(body)))]
+        return started['status'], headers, body, None
+    
+    async def respond(self, writer, environ, keep_alive):
+        """Send the app's response; returns whether the connection stays open"""
+        started = time.perf_counter()
+        status, headers, body, stream = await self.loop.run_in_executor(
+            self.executor, self.call_app, environ)
+        
+        names = {name.lower() for name, _ in headers}
+        chunked = body is None and 'content-length' not in names
+        if chunked and environ['SERVER_PROTOCOL'] != 'HTTP/1.1':
+            keep_alive = False
+        head = [f'HTTP/1.1 {status}']
+        head += [f'{name}: {value}' for name, value in headers]
+        if body is not None and 'content-length' not in names:
+            head.append(f'Content-Length: {len(body)}')
+        if chunked and keep_alive:
+            head.append('Transfer-Encoding: chunked')
+        head.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        
+        send_body = environ['REQUEST_METHOD'] != 'HEAD'
+        if body is not None:
+            if send_body:
+                writer.write(body)
+            await writer.drain()
+            self.observe(environ, status, started)
+            return keep_alive
+        
+        # Streamed body: pull each chunk on the pool, write it with backpressure
+        result, iterator, pending = stream
+        try:
+            while True:
+                for chunk in pending:
+                    if chunk and send_body:
+                        if chunked and keep_alive:
+                            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        else:
+                            writer.write(chunk)
+                await writer.drain()
+                chunk = await self.loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                pending = [chunk]
+            if chunked and keep_alive and send_body:
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+        finally:
+            if hasattr(result, 'close'):
+                await self.loop.run_in_executor(self.executor, result.close)
+        self.observe(environ, status, started)
+        return keep_alive
+    
+    def observe(self, environ, status, started):
+        if self.metrics:
+            self.metrics.observe_request(environ, status, time.perf_counter() - started)
+    
+    async def send_error(self, writer, code):
+        writer.write(f'HTTP/1.1 {code} {self.REASONS[code]}\r\n'
+                     f'Content-Length: 0\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+    
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+class ProperTerminal:
+    def __init__(self, coalesce_delay=COALESCE_DELAY, coalesce_bytes=COALESCE_BYTES,
+                 high_watermark=HIGH_WATERMARK, low_watermark=LOW_WATERMARK,
+                 scrollback_bytes=SCROLLBACK_BYTES, screen_model=SCREEN_MODEL,
+                 host=HOST, http_port=HTTP_PORT, ws_port=WS_PORT, compression=None,
+                 large_file_bytes=LARGE_FILE_BYTES, content_cache_bytes=CONTENT_CACHE_BYTES,
+                 http_workers=HTTP_WORKERS, search_index=False, record_dir=None,
+                 record_input=False, record_max_bytes=RECORD_MAX_BYTES, replay=None,
+                 replay_speed=REPLAY_SPEED, shell_pool=SHELL_POOL_SIZE,
+                 shell_pool_idle=SHELL_POOL_IDLE, resize_policy=RESIZE_POLICY,
+                 resize_debounce=RESIZE_DEBOUNCE, workspace=None):
+        self.host = host
+        self.http_port = http_port
+        self.ws_port = ws_port
+        # Keyword arguments for compression_extensions()
+        self.compression = compression or {}
+        self.workspace = os.path.abspath(workspace or os.getcwd())
+        self.listings = DirectoryListingCache(self.workspace)
+        self.large_file_bytes = large_file_bytes
+        self.search = WorkspaceSearch(self.workspace, self.listings.ignore, use_index=search_index)
+        self.contents = FileContentCache(content_cache_bytes)
+        # Serializes the version check and write of concurrent saves
+        self.save_lock = threading.Lock()
+        self.assets = AssetBundle()
+        # Rendered page templates: name -> (body, gzipped body, etag)
+        self.pages = {}
+        self.watcher = None
+        if InotifyWatcher.available():
+            self.watcher = InotifyWatcher(self.workspace, self.listings.ignore)
+            self.watcher.listeners.append(self.update_paths)
+        self.paths = PathIndex(self.workspace, self.listings.ignore,
+                               max_age=None if self.watcher else PATH_INDEX_MAX_AGE)
         self.app = Bottle()
         self.setup_routes()
-        self.clients = set()
-        self.shell_process = None
-        self.master_fd = None
-        self.slave_fd = None
-        self.setup_pty()
+        self.loop = None
+        # Blocking work (HTTP requests, filesystem walks) runs here, off the loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(http_workers, thread_name_prefix='worker')
+        self.http_server = None
+        self.metrics = Metrics()
+        # Set once both ports accept connections (or startup failed)
+        self.ready = threading.Event()
+        self.stopping = asyncio.Event()
+        self.server_thread = None
+        self.reaper_task = self.lag_task = self.watcher_task = None
+        self.startup_error = None
+        self.launched = time.monotonic()
+        self.sessions = SessionManager(
+            pool_size=shell_pool,
+            pool_idle=shell_pool_idle,
+            coalesce_delay=coalesce_delay,
+            coalesce_bytes=coalesce_bytes,
+            high_watermark=high_watermark,
+            low_watermark=low_watermark,
+            scrollback_bytes=scrollback_bytes,
+            screen_model=screen_model,
+            record_dir=record_dir,
+            record_input=record_input,
+            record_max_bytes=record_max_bytes,
+            resize_policy=resize_policy,
+            resize_debounce=resize_debounce,
+            # Shells start in the workspace, whatever the cwd is by then
+            cwd=self.workspace,
+        )
+        # An asciicast file to replay as the default session instead of a shell
+        self.replay = replay
+        self.replay_speed = replay_speed
+        
+    def run_on_loop(self, func, *args):
+        """Call func on the WebSocket server loop from another thread"""
+        async def call():
+            return func(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result(timeout=10)
+    
+    def workspace_path(self, relpath):
+        """Absolute path for relpath if it stays inside the workspace, else None"""
+        abs_path = os.path.abspath(os.path.join(self.workspace, relpath))
+        if abs_path != self.workspace and not abs_path.startswith(self.workspace + os.sep):
+            return None
+        return abs_path
+    
+    def metrics_families(self):
+        """Metric families for /api/metrics (runs on the server loop)"""
+        prefix = 'proper_terminal_'
+        sessions = list(self.sessions.sessions.values())
+        totals = collections.Counter(self.sessions.retired)
+        for session in sessions:
+            totals.update(session.counters)
+        
+        clients = []
+        for session in sessions:
+            for client in session.clients:
+                labels = {'session': session.id, 'client': '%s:%s' % client.remote_address[:2]}
+                clients.append((session, client, labels))
+        
+        def counter(name, help_text):
+            return (prefix + name, 'counter', help_text, [({}, totals[name])])
+        
+        pool = collections.Counter(self.sessions.pool.info() if self.sessions.pool else {})
         
+        families = [
+            counter('pty_read_bytes_total', 'Bytes read from PTYs'),
+            counter('pty_reads_total', 'Reads (chunks) from PTYs'),
+            counter('frames_sent_total', 'WebSocket frames sent to terminal clients'),
+            counter('bytes_sent_total', 'Payload bytes sent to terminal clients'),
+            counter('clients_dropped_total', 'Clients disconnected for overflowing their send queue'),
+            counter('read_pauses_total', 'Times PTY reading paused for a slow flow-controlled client'),
+            counter('viewer_resyncs_total', 'Times a lagging viewer was redrawn after draining'),
+            counter('viewers_dropped_total', 'Viewers disconnected for lagging too long'),
+            counter('resize_requests_total', 'Terminal size changes requested by clients'),
+            counter('resizes_applied_total', 'PTY resizes after debouncing and negotiation'),
+            (prefix + 'sessions', 'gauge', 'Live terminal sessions', [({}, len(sessions))]),
+            (prefix + 'shell_pool_hits_total', 'counter', 'New sessions given a pre-started shell',
+             [({}, pool['hits'])]),
+            (prefix + 'shell_pool_misses_total', 'counter', 'New sessions that had to start a shell',
+             [({}, pool['misses'])]),
+            (prefix + 'shell_pool_started_total', 'counter', 'Shells started for the pool',
+             [({}, pool['started'])]),
+            (prefix + 'shell_pool_expired_total', 'counter', 'Pooled shells replaced after waiting too long',
+             [({}, pool['expired'])]),
+            (prefix + 'shell_pool_waiting', 'gauge', 'Pre-started shells waiting for a session',
+             [({}, pool['waiting'])]),
+            (prefix + 'clients', 'gauge', 'Attached terminal clients',
+             [({'session': s.id}, len(s.clients)) for s in sessions]),
+            (prefix + 'viewers', 'gauge', 'Attached read-only viewers',
+             [({'session': s.id}, len(s.viewers)) for s in sessions]),
+            (prefix + 'lagging_viewers', 'gauge', 'Viewers skipped until their socket drains',
+             [({'session': s.id}, len(s.lagging)) for s in sessions]),
+            (prefix + 'reading_paused', 'gauge', '1 while a session is not reading its PTY',
+             [({'session': s.id}, int(s.reading_paused)) for s in sessions]),
+            (prefix + 'slow_clients', 'gauge', 'Flow-controlled clients over the high watermark',
+             [({'session': s.id}, sum(count > s.high_watermark for count in s.unacked.values()))
+              for s in sessions]),
+            (prefix + 'client_frames_sent_total', 'counter', 'Frames sent per client',
+             [(labels, s.client_stats.get(c, {}).get('frames', 0)) for s, c, labels in clients]),
+            (prefix + 'client_bytes_sent_total', 'counter', 'Bytes sent per client',
+             [(labels, s.client_stats.get(c, {}).get('bytes', 0)) for s, c, labels in clients]),
+            (prefix + 'client_send_queue_depth', 'gauge', 'Frames waiting in each client send queue',
+             [(labels, s.send_queues[c].qsize()) for s, c, labels in clients if c in s.send_queues]),
+            (prefix + 'client_unacked_bytes', 'gauge', 'Output bytes a flow-controlled client has not acked',
+             [(labels, s.unacked[c]) for s, c, labels in clients if c in s.unacked]),
+            (prefix + 'event_loop_lag_seconds', 'histogram', 'Event loop wake-up lag',
+             list(self.metrics.loop_lag.samples(prefix + 'event_loop_lag_seconds', {}))),
+            (prefix + 'event_loop_lag_max_seconds', 'gauge', 'Largest event loop lag seen',
+             [({}, self.metrics.loop_lag_max)]),
+        ]
+        
+        with self.metrics.lock:
+            http_rows = []
+            for (method, route, status), histogram in sorted(self.metrics.http.items()):
+                labels = {'method': method, 'route': route, 'status': status}
+                http_rows += histogram.samples(prefix + 'http_request_duration_seconds', labels)
+        families.append((prefix + 'http_request_duration_seconds', 'histogram',
+                         'HTTP request latency by route, including time queued for a worker',
+                         http_rows))
+        families.append((prefix + 'http_connections', 'gauge', 'Open HTTP connections',
+                         [({}, self.http_server.connections if self.http_server else 0)]))
+        return families
+    
+    def render_page(self, name, template):
+        """Serve a page template, filled in and compressed once per process"""
+        from bottle import request, response
+        page = self.pages.get(name)
+        if page is None:
+            body = (template.replace('__WS_PORT__', str(self.ws_port))
+                            .replace('__ASSETS__', self.assets.prefix)).encode('utf-8')
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            page = self.pages[name] = (body, gzip.compress(body, 9), etag)
+        
+        body, compressed, etag = page
+        response.content_type = 'text/html; charset=utf-8'
+        response.set_header('ETag', etag)
+        response.set_header('Cache-Control', 'no-cache')
+        if request.headers.get('If-None-Match') == etag:
+            response.status = 304
+            return ''
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response.set_header('Content-Encoding', 'gzip')
+            return compressed
+        return body
+    
     def setup_routes(self):
         @self.app.route('/editor')
         def editor_page():
-            return '''
+            return self.render_page('editor', '''
             <!DOCTYPE html>
             <html>
             <head>
                 <title>Monaco Editor</title>
-                <script src="https://cdn.jsdelivr.net/npm/monaco-editor@0.45.0/min/vs/loader.js"></script>
+                <script src="__ASSETS__/monaco-editor@0.45.0/min/vs/loader.js"></script>
                 <style>
                     body { 
                         margin: 0; 
@@ -55,17 +3692,95 @@ class ProperTerminal:
                         align-items: center;
                         gap: 10px;
                     }
-                    .file-tree {
+                    .sidebar {
                         width: 250px;
                         background: #252526;
                         border-right: 1px solid #444;
+                        display: flex;
+                        flex-direction: column;
+                    }
+                    .file-tree, .search-results {
+                        flex: 1;
                         overflow-y: auto;
                         padding: 5px;
                     }
+                    .search-results { display: none; }
+                    .search-box {
+                        margin: 5px;
+                        padding: 4px 6px;
+                        background: #3c3c3c;
+                        color: #cccccc;
+                        border: 1px solid #555;
+                        font-size: 12px;
+                    }
+                    .search-file {
+                        color: #007acc;
+                        font-size: 12px;
+                        padding: 6px 8px 2px;
+                    }
+                    .search-hit {
+                        padding: 2px 8px 2px 16px;
+                        cursor: pointer;
+                        color: #cccccc;
+                        font-size: 12px;
+                        white-space: nowrap;
+                        overflow: hidden;
+                        text-overflow: ellipsis;
+                    }
+                    .search-hit:hover { background: #2a2d2e; }
+                    .search-status {
+                        color: #888;
+                        font-size: 11px;
+                        padding: 2px 8px;
+                    }
                     .editor-container {
                         flex: 1;
                         display: flex;
                     }
+                    .quick-open {
+                        position: fixed;
+                        top: 60px;
+                        left: 50%;
+                        transform: translateX(-50%);
+                        width: 600px;
+                        max-width: 90vw;
+                        background: #252526;
+                        border: 1px solid #444;
+                        box-shadow: 0 4px 16px rgba(0, 0, 0, 0.5);
+                        z-index: 100;
+                        display: none;
+                    }
+                    .quick-open input {
+                        width: 100%;
+                        box-sizing: border-box;
+                        padding: 8px;
+                        background: #3c3c3c;
+                        color: #cccccc;
+                        border: none;
+                        border-bottom: 1px solid #444;
+                        font-size: 14px;
+                        outline: none;
+                    }
+                    .quick-open-list {
+                        max-height: 400px;
+                        overflow-y: auto;
+                    }
+                    .quick-open-item {
+                        padding: 4px 10px;
+                        color: #cccccc;
+                        font-size: 13px;
+                        cursor: pointer;
+                        white-space: nowrap;
+                        overflow: hidden;
+                        text-overflow: ellipsis;
+                    }
+                    .quick-open-item.selected { background: #094771; }
+                    .quick-open-item b { color: #18a3ff; }
+                    .quick-open-item .dir {
+                        color: #888;
+                        font-size: 11px;
+                        margin-left: 8px;
+                    }
                     .monaco-container {
                         flex: 1;
                         height: 100%;
@@ -110,23 +3825,48 @@ class ProperTerminal:
                         <button class="btn" onclick="saveFile()">Save (Ctrl+S)</button>
                         <button class="btn" onclick="newFile()">New File</button>
                         <button class="btn" onclick="refreshFiles()">Refresh</button>
+                        <button class="btn" onclick="showQuickOpen()">Go to File (Ctrl+P)</button>
                     </div>
                     <span id="currentFile" style="margin-left: auto; color: #888;"></span>
                 </div>
                 
                 <div class="editor-container">
-                    <div class="file-tree" id="fileTree">
-                        <div>Loading files...</div>
+                    <div class="sidebar">
+                        <input id="searchBox" class="search-box" placeholder="Search workspace (Enter)">
+                        <div class="search-results" id="searchResults"></div>
+                        <div class="file-tree" id="fileTree">
+                            <div>Loading files...</div>
+                        </div>
                     </div>
                     <div class="monaco-container" id="editor"></div>
                 </div>
                 
+                <div class="quick-open" id="quickOpen">
+                    <input id="quickOpenInput" placeholder="Go to file">
+                    <div class="quick-open-list" id="quickOpenList"></div>
+                </div>
+                
                 <script>
                     let editor = null;
                     let currentFilePath = null;
+                    // Model version at the last open/save, to tell if the buffer is dirty
+                    let cleanVersionId = null;
+                    // Offset of the next page when a large file is open read-only
+                    let largeFileNext = null;
+                    let largeFileLoading = false;
+                    // Version the buffer was loaded at, and edits made since the
+                    // last save, in the order Monaco reported them
+                    let baseVersion = null;
+                    let pendingEdits = [];
+                    // False when the file's BOM or line endings differ from
+                    // Monaco's model, so edit offsets wouldn't match the disk
+                    let deltaSaves = false;
+                    // While a save is in flight the watcher reports our own write
+                    let saving = false;
+                    const WS_PORT = __WS_PORT__;
                     
                     // Configure Monaco
-                    require.config({ paths: { vs: 'https://cdn.jsdelivr.net/npm/monaco-editor@0.45.0/min/vs' }});
+                    require.config({ paths: { vs: '__ASSETS__/monaco-editor@0.45.0/min/vs' }});
                     
                     require(['vs/editor/editor.main'], function () {
                         // Create Monaco editor
@@ -144,74 +3884,434 @@ class ProperTerminal:
                         
                         // Keyboard shortcuts
                         editor.addCommand(monaco.KeyMod.CtrlCmd | monaco.KeyCode.KeyS, saveFile);
+                        editor.addCommand(monaco.KeyMod.CtrlCmd | monaco.KeyCode.KeyP, showQuickOpen);
+                        
+                        // Record edits so a save only uploads what changed. Changes
+                        // within one event refer to the pre-event text, so apply
+                        // them back to front.
+                        editor.onDidChangeModelContent(event => {
+                            if (event.isFlush) {
+                                pendingEdits = [];
+                                return;
+                            }
+                            const changes = event.changes.slice().sort((a, b) => b.rangeOffset - a.rangeOffset);
+                            changes.forEach(change => pendingEdits.push({
+                                offset: change.rangeOffset,
+                                length: change.rangeLength,
+                                text: change.text
+                            }));
+                        });
+                        
+                        // Large files load the next page as the view nears the end
+                        editor.onDidScrollChange(event => {
+                            if (largeFileNext !== null &&
+                                event.scrollTop + editor.getLayoutInfo().height > event.scrollHeight - 2000) {
+                                loadNextPage();
+                            }
+                        });
                         
                         console.log('Monaco Editor loaded successfully');
                         loadFileTree();
+                        watchWorkspace();
+                        
+                        const searchBox = document.getElementById('searchBox');
+                        searchBox.addEventListener('keydown', event => {
+                            if (event.key === 'Enter') {
+                                runSearch(searchBox.value.trim());
+                            } else if (event.key === 'Escape') {
+                                searchBox.value = '';
+                                runSearch('');
+                            }
+                        });
+                        
+                        const quickOpenInput = document.getElementById('quickOpenInput');
+                        quickOpenInput.addEventListener('input', sendQuickOpen);
+                        quickOpenInput.addEventListener('blur', hideQuickOpen);
+                        quickOpenInput.addEventListener('keydown', event => {
+                            if (event.key === 'ArrowDown' || event.key === 'ArrowUp') {
+                                event.preventDefault();
+                                const step = event.key === 'ArrowDown' ? 1 : -1;
+                                quickOpenSelected = Math.max(0, Math.min(quickOpenResults.length - 1,
+                                                                         quickOpenSelected + step));
+                                renderQuickOpen();
+                            } else if (event.key === 'Enter') {
+                                pickQuickOpen(quickOpenSelected);
+                            } else if (event.key === 'Escape') {
+                                hideQuickOpen();
+                            }
+                        });
+                    });
+                    
+                    // Ctrl+P outside the editor too (the browser would print)
+                    document.addEventListener('keydown', event => {
+                        if ((event.ctrlKey || event.metaKey) && event.key === 'p') {
+                            event.preventDefault();
+                            showQuickOpen();
+                        }
                     });
                     
+                    // Directory listings are paged and fetched on expand
+                    const LIST_PAGE_SIZE = 500;
+                    
                     async function loadFileTree() {
+                        const tree = document.getElementById('fileTree');
+                        tree.innerHTML = '';
+                        try {
+                            await loadDirectory('', tree);
+                        } catch (error) {
+                            console.error('Failed to load file tree:', error);
+                            tree.innerHTML = '<div style="color: red;">Error loading files</div>';
+                        }
+                    }
+                    
+                    // Append one page of a directory's children to container.
+                    // The server sends an ETag, so the browser revalidates and
+                    // unchanged directories come back as 304s.
+                    async function loadDirectory(path, container, offset = 0) {
+                        const url = '/api/list?path=' + encodeURIComponent(path) +
+                                    '&offset=' + offset + '&limit=' + LIST_PAGE_SIZE;
+                        const response = await fetch(url, { cache: 'no-cache' });
+                        const listing = await response.json();
+                        if (listing.error) {
+                            throw new Error(listing.error);
+                        }
+                        
+                        listing.entries.forEach(entry => {
+                            container.appendChild(renderEntry(entry, path));
+                        });
+                        
+                        if (listing.next_offset !== null) {
+                            const more = document.createElement('div');
+                            more.className = 'file-item';
+                            more.textContent = '… ' + (listing.total - listing.next_offset) + ' more';
+                            more.onclick = () => {
+                                more.remove();
+                                loadDirectory(path, container, listing.next_offset);
+                            };
+                            container.appendChild(more);
+                        }
+                    }
+                    
+                    function renderEntry(entry, parentPath) {
+                        const div = document.createElement('div');
+                        div.className = 'file-item';
+                        
+                        const fullPath = parentPath ? parentPath + '/' + entry.name : entry.name;
+                        
+                        div.dataset.path = fullPath;
+                        div.dataset.type = entry.type;
+                        
+                        if (entry.type === 'dir') {
+                            // Directory
+                            div.className += ' folder';
+                            div.textContent = '📁 ' + entry.name;
+                            div.onclick = () => toggleFolder(div, fullPath);
+                        } else {
+                            // File
+                            div.textContent = '📄 ' + entry.name;
+                            div.onclick = () => openFile(fullPath);
+                        }
+                        return div;
+                    }
+                    
+                    async function toggleFolder(folderDiv, path) {
+                        const name = path.split('/').pop();
+                        
+                        if (folderDiv.dataset.expanded === 'true') {
+                            // Collapse
+                            folderDiv.nextElementSibling.remove();
+                            folderDiv.textContent = '📁 ' + name;
+                            folderDiv.dataset.expanded = 'false';
+                            return;
+                        }
+                        
+                        // Expand, fetching the children now
+                        folderDiv.textContent = '📂 ' + name;
+                        folderDiv.dataset.expanded = 'true';
+                        
+                        const subContainer = document.createElement('div');
+                        subContainer.style.paddingLeft = '15px';
+                        folderDiv.insertAdjacentElement('afterend', subContainer);
                         try {
-                            const response = await fetch('/api/files');
-                            const files = await response.json();
-                            renderFileTree(files);
+                            await loadDirectory(path, subContainer);
                         } catch (error) {
-                            console.error('Failed to load file tree:', error);
-                            document.getElementById('fileTree').innerHTML = '<div style="color: red;">Error loading files</div>';
+                            console.error('Failed to list folder:', error);
+                            subContainer.textContent = 'Error: ' + error.message;
                         }
                     }
                     
-                    function renderFileTree(files, container = document.getElementById('fileTree'), path = '') {
-                        if (path === '') {
-                            container.innerHTML = '';
+                    // Live updates: the server pushes coalesced filesystem
+                    // events, applied to the tree and the open buffer
+                    function watchWorkspace() {
+                        const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+                        const socket = new WebSocket(scheme + window.location.hostname + ':' + WS_PORT + '/fs');
+                        socket.onmessage = function(event) {
+                            const message = JSON.parse(event.data);
+                            if (message.type === 'fs') {
+                                message.events.forEach(applyFsEvent);
+                            }
+                        };
+                        socket.onclose = function(event) {
+                            if (event.code !== 4404) setTimeout(watchWorkspace, 2000);
+                        };
+                    }
+                    
+                    function applyFsEvent(event) {
+                        if (event.type === 'rescan') {
+                            loadFileTree();
+                        } else if (event.type === 'created') {
+                            addTreeEntry(event.path, event.is_dir);
+                            // A file replaced in a way the server couldn't merge
+                            if (event.path === currentFilePath) reloadCurrentFile();
+                        } else if (event.type === 'deleted') {
+                            removeTreeEntry(event.path);
+                        } else if (event.type === 'renamed') {
+                            removeTreeEntry(event.from);
+                            addTreeEntry(event.path, event.is_dir);
+                            if (currentFilePath === event.from) {
+                                currentFilePath = event.path;
+                                document.getElementById('currentFile').textContent = event.path;
+                            } else if (currentFilePath === event.path) {
+                                // Another file was renamed over the open one
+                                reloadCurrentFile();
+                            }
+                        } else if (event.type === 'modified' && event.path === currentFilePath) {
+                            reloadCurrentFile();
                         }
+                    }
+                    
+                    function findTreeEntry(path) {
+                        return document.querySelector('.file-item[data-path="' + CSS.escape(path) + '"]');
+                    }
+                    
+                    // The element holding a directory's children, if it is shown
+                    function findTreeContainer(dirPath) {
+                        if (dirPath === '') return document.getElementById('fileTree');
+                        const folder = findTreeEntry(dirPath);
+                        if (folder && folder.dataset.expanded === 'true') return folder.nextElementSibling;
+                        return null;
+                    }
+                    
+                    function addTreeEntry(path, isDir) {
+                        const slash = path.lastIndexOf('/');
+                        const parent = slash === -1 ? '' : path.slice(0, slash);
+                        const name = path.slice(slash + 1);
+                        const container = findTreeContainer(parent);
+                        if (!container || findTreeEntry(path)) return;
                         
-                        Object.keys(files).sort().forEach(name => {
-                            const item = files[name];
-                            const div = document.createElement('div');
-                            div.className = 'file-item';
-                            
-                            const fullPath = path ? path + '/' + name : name;
-                            
-                            if (typeof item === 'object') {
-                                // Directory
-                                div.className += ' folder';
-                                div.innerHTML = '📁 ' + name;
-                                div.onclick = () => toggleFolder(div, item, fullPath);
-                            } else {
-                                // File
-                                div.innerHTML = '📄 ' + name;
-                                div.onclick = () => openFile(fullPath);
+                        // Keep folders first, then case-insensitive name order
+                        const div = renderEntry({ name: name, type: isDir ? 'dir' : 'file' }, parent);
+                        const key = (isDir ? '0' : '1') + name.toLowerCase();
+                        let before = null;
+                        for (const child of container.children) {
+                            if (!child.dataset.path) {
+                                if (!child.style.paddingLeft) { before = child; break; }
+                                continue;
                             }
-                            
-                            container.appendChild(div);
-                        });
+                            const childKey = (child.dataset.type === 'dir' ? '0' : '1') +
+                                             child.dataset.path.split('/').pop().toLowerCase();
+                            if (childKey > key) { before = child; break; }
+                        }
+                        container.insertBefore(div, before);
+                    }
+                    
+                    function removeTreeEntry(path) {
+                        const div = findTreeEntry(path);
+                        if (!div) return;
+                        if (div.dataset.expanded === 'true') div.nextElementSibling.remove();
+                        div.remove();
+                    }
+                    
+                    // Pick up changes made on disk unless the buffer has edits.
+                    // setValue drops the undo stack, so only reload real changes
+                    async function reloadCurrentFile() {
+                        const label = document.getElementById('currentFile');
+                        if (saving || editor.getOption(monaco.editor.EditorOption.readOnly)) return;
+                        if (editor.getModel().getAlternativeVersionId() !== cleanVersionId) {
+                            label.textContent = currentFilePath + ' (changed on disk)';
+                            return;
+                        }
+                        const filePath = currentFilePath;
+                        const response = await fetch('/api/file/' + encodeURIComponent(filePath));
+                        const data = await response.json();
+                        if (data.error || filePath !== currentFilePath || saving) return;
+                        // What we loaded or saved last: nothing changed
+                        if (data.version === baseVersion) return;
+                        // Typed into while the file was fetched: keep the edits
+                        if (editor.getModel().getAlternativeVersionId() !== cleanVersionId) {
+                            label.textContent = currentFilePath + ' (changed on disk)';
+                            return;
+                        }
+                        
+                        const viewState = editor.saveViewState();
+                        editor.setValue(data.content || '');
+                        editor.restoreViewState(viewState);
+                        cleanVersionId = editor.getModel().getAlternativeVersionId();
+                        baseVersion = data.version;
+                        deltaSaves = !!data.deltas;
                     }
                     
-                    function toggleFolder(folderDiv, contents, path) {
-                        const expanded = folderDiv.dataset.expanded === 'true';
+                    // Workspace search: matches stream in as NDJSON lines
+                    let searchController = null;
+                    
+                    async function runSearch(query) {
+                        if (searchController) searchController.abort();
+                        const results = document.getElementById('searchResults');
+                        const tree = document.getElementById('fileTree');
+                        results.innerHTML = '';
+                        results.style.display = query ? 'block' : 'none';
+                        tree.style.display = query ? 'none' : '';
+                        if (!query) return;
                         
-                        if (expanded) {
-                            // Collapse
-                            const nextSibling = folderDiv.nextElementSibling;
-                            while (nextSibling && nextSibling.style.paddingLeft) {
-                                const toRemove = nextSibling;
-                                nextSibling = nextSibling.nextElementSibling;
-                                toRemove.remove();
+                        const status = document.createElement('div');
+                        status.className = 'search-status';
+                        status.textContent = 'Searching…';
+                        results.appendChild(status);
+                        
+                        searchController = new AbortController();
+                        try {
+                            const response = await fetch('/api/search?q=' + encodeURIComponent(query),
+                                                         { signal: searchController.signal });
+                            if (!response.ok) {
+                                status.textContent = (await response.json()).error;
+                                return;
                             }
-                            folderDiv.innerHTML = '📁 ' + path.split('/').pop();
-                            folderDiv.dataset.expanded = 'false';
+                            const reader = response.body.getReader();
+                            const decoder = new TextDecoder();
+                            let buffered = '';
+                            let lastPath = null;
+                            while (true) {
+                                const { value, done } = await reader.read();
+                                if (done) break;
+                                buffered += decoder.decode(value, { stream: true });
+                                const lines = buffered.split('\\n');
+                                buffered = lines.pop();
+                                for (const line of lines) {
+                                    const result = JSON.parse(line);
+                                    if (result.type === 'done') {
+                                        status.textContent = result.matches + (result.truncated ? '+' : '') +
+                                                             ' matches in ' + result.elapsed_ms + ' ms';
+                                        continue;
+                                    }
+                                    if (result.path !== lastPath) {
+                                        const header = document.createElement('div');
+                                        header.className = 'search-file';
+                                        header.textContent = result.path;
+                                        results.appendChild(header);
+                                        lastPath = result.path;
+                                    }
+                                    const hit = document.createElement('div');
+                                    hit.className = 'search-hit';
+                                    hit.textContent = result.line + ': ' + result.text.trim();
+                                    hit.onclick = () => openFileAt(result.path, result.line, result.column);
+                                    results.appendChild(hit);
+                                }
+                            }
+                        } catch (error) {
+                            if (error.name !== 'AbortError') status.textContent = 'Search failed: ' + error.message;
+                        }
+                    }
+                    
+                    // Quick open: the server keeps every workspace path in memory and
+                    // answers each keystroke over a WebSocket; replies to queries the
+                    // user has already typed past are dropped
+                    let quickOpenSocket = null;
+                    let quickOpenQuery = 0;
+                    let quickOpenResults = [];
+                    let quickOpenSelected = 0;
+                    
+                    function connectQuickOpen() {
+                        const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+                        quickOpenSocket = new WebSocket(scheme + window.location.hostname + ':' + WS_PORT + '/quickopen');
+                        quickOpenSocket.onopen = sendQuickOpen;
+                        quickOpenSocket.onmessage = function(event) {
+                            const message = JSON.parse(event.data);
+                            if (message.id !== quickOpenQuery) return;
+                            quickOpenResults = message.results;
+                            quickOpenSelected = 0;
+                            renderQuickOpen();
+                        };
+                        quickOpenSocket.onclose = function() {
+                            quickOpenSocket = null;
+                        };
+                    }
+                    
+                    function showQuickOpen() {
+                        const input = document.getElementById('quickOpenInput');
+                        document.getElementById('quickOpen').style.display = 'block';
+                        input.value = '';
+                        input.focus();
+                        if (quickOpenSocket) {
+                            sendQuickOpen();
                         } else {
-                            // Expand
-                            folderDiv.innerHTML = '📂 ' + path.split('/').pop();
-                            folderDiv.dataset.expanded = 'true';
-                            
-                            const subContainer = document.createElement('div');
-                            subContainer.style.paddingLeft = '15px';
-                            folderDiv.insertAdjacentElement('afterend', subContainer);
-                            renderFileTree(contents, subContainer, path);
+                            connectQuickOpen();
                         }
                     }
                     
+                    function hideQuickOpen() {
+                        const panel = document.getElementById('quickOpen');
+                        if (panel.style.display === 'none') return;
+                        panel.style.display = 'none';
+                        if (editor) editor.focus();
+                    }
+                    
+                    function sendQuickOpen() {
+                        if (!quickOpenSocket || quickOpenSocket.readyState !== WebSocket.OPEN) return;
+                        quickOpenQuery += 1;
+                        quickOpenSocket.send(JSON.stringify({
+                            id: quickOpenQuery,
+                            q: document.getElementById('quickOpenInput').value
+                        }));
+                    }
+                    
+                    function renderQuickOpen() {
+                        const list = document.getElementById('quickOpenList');
+                        list.innerHTML = '';
+                        quickOpenResults.forEach((result, index) => {
+                            const item = document.createElement('div');
+                            item.className = 'quick-open-item' + (index === quickOpenSelected ? ' selected' : '');
+                            // File name with the matched characters in bold, then its directory
+                            const slash = result.path.lastIndexOf('/');
+                            const marked = new Set(result.positions);
+                            for (let i = slash + 1; i < result.path.length; i++) {
+                                if (marked.has(i)) {
+                                    const bold = document.createElement('b');
+                                    bold.textContent = result.path[i];
+                                    item.appendChild(bold);
+                                } else {
+                                    item.appendChild(document.createTextNode(result.path[i]));
+                                }
+                            }
+                            if (slash > 0) {
+                                const dir = document.createElement('span');
+                                dir.className = 'dir';
+                                dir.textContent = result.path.slice(0, slash);
+                                item.appendChild(dir);
+                            }
+                            item.onmousedown = event => {
+                                event.preventDefault();
+                                pickQuickOpen(index);
+                            };
+                            list.appendChild(item);
+                        });
+                        const selected = list.children[quickOpenSelected];
+                        if (selected) selected.scrollIntoView({ block: 'nearest' });
+                    }
+                    
+                    function pickQuickOpen(index) {
+                        const result = quickOpenResults[index];
+                        hideQuickOpen();
+                        if (result) openFile(result.path);
+                    }
+                    
+                    async function openFileAt(filePath, line, column) {
+                        if (filePath !== currentFilePath) await openFile(filePath);
+                        if (filePath !== currentFilePath) return;
+                        editor.setPosition({ lineNumber: line, column: column || 1 });
+                        editor.revealLineInCenter(line);
+                        editor.focus();
+                    }
+                    
                     async function openFile(filePath) {
                         try {
                             const response = await fetch('/api/file/' + encodeURIComponent(filePath));
@@ -224,6 +4324,11 @@ class ProperTerminal:
                             
                             // Set content and language
                             editor.setValue(data.content || '');
+                            cleanVersionId = editor.getModel().getAlternativeVersionId();
+                            baseVersion = data.version;
+                            deltaSaves = !!data.deltas;
+                            editor.updateOptions({ readOnly: data.large });
+                            largeFileNext = data.large ? data.next_offset : null;
                             
                             // Auto-detect language
                             const extension = filePath.split('.').pop().toLowerCase();
@@ -231,7 +4336,8 @@ class ProperTerminal:
                             monaco.editor.setModelLanguage(editor.getModel(), language);
                             
                             currentFilePath = filePath;
-                            document.getElementById('currentFile').textContent = filePath;
+                            document.getElementById('currentFile').textContent =
+                                data.large ? filePath + ' (large file, read-only)' : filePath;
                             
                             // Update selected file in tree
                             document.querySelectorAll('.file-item').forEach(item => {
@@ -247,22 +4353,78 @@ class ProperTerminal:
                         }
                     }
                     
+                    // Append the next page of a large file to the read-only model
+                    async function loadNextPage() {
+                        if (largeFileLoading) return;
+                        largeFileLoading = true;
+                        const filePath = currentFilePath;
+                        try {
+                            const response = await fetch('/api/file/' + encodeURIComponent(filePath) +
+                                                         '?offset=' + largeFileNext);
+                            const data = await response.json();
+                            if (data.error || filePath !== currentFilePath) return;
+                            
+                            const model = editor.getModel();
+                            const end = model.getFullModelRange().getEndPosition();
+                            model.applyEdits([{
+                                range: new monaco.Range(end.lineNumber, end.column, end.lineNumber, end.column),
+                                text: data.content
+                            }]);
+                            largeFileNext = data.next_offset;
+                            pendingEdits = [];
+                        } finally {
+                            largeFileLoading = false;
+                        }
+                    }
+                    
                     async function saveFile() {
                         if (!currentFilePath) {
                             alert('No file selected to save');
                             return;
                         }
+                        if (editor.getOption(monaco.editor.EditorOption.readOnly)) {
+                            alert('Large files are opened read-only');
+                            return;
+                        }
                         
+                        saving = true;
                         try {
-                            const content = editor.getValue();
-                            const response = await fetch('/api/save/' + encodeURIComponent(currentFilePath), {
-                                method: 'POST',
-                                headers: { 'Content-Type': 'application/json' },
-                                body: JSON.stringify({ content: content })
-                            });
+                            // Send only the edits when the server has our base version,
+                            // with the length it must arrive at
+                            const model = editor.getModel();
+                            let sent = pendingEdits.length;
+                            let versionId = model.getAlternativeVersionId();
+                            let body = { base: baseVersion, content: editor.getValue() };
+                            if (baseVersion === null) {
+                                body = { content: editor.getValue() };
+                            } else if (deltaSaves) {
+                                body = { base: baseVersion, edits: pendingEdits.slice(0, sent),
+                                         length: model.getValueLength() };
+                            }
+                            let result = await postSave(currentFilePath, body);
+                            
+                            if (result.resend) {
+                                // The edits wouldn't reproduce this buffer; send it whole
+                                sent = pendingEdits.length;
+                                versionId = model.getAlternativeVersionId();
+                                result = await postSave(currentFilePath, { base: baseVersion, content: editor.getValue() });
+                            }
+                            
+                            if (result.conflict) {
+                                if (!confirm(currentFilePath + ' changed on disk since it was opened. Overwrite it?')) {
+                                    return;
+                                }
+                                sent = pendingEdits.length;
+                                versionId = editor.getModel().getAlternativeVersionId();
+                                result = await postSave(currentFilePath, { content: editor.getValue() });
+                            }
                             
-                            const result = await response.json();
                             if (result.success) {
+                                pendingEdits.splice(0, sent);
+                                baseVersion = result.version;
+                                deltaSaves = result.deltas;
+                                cleanVersionId = versionId;
+                                document.getElementById('currentFile').textContent = currentFilePath;
                                 console.log('File saved successfully');
                                 // Visual feedback could be added here
                             } else {
@@ -271,12 +4433,27 @@ class ProperTerminal:
                         } catch (error) {
                             console.error('Failed to save file:', error);
                             alert('Failed to save file: ' + error.message);
+                        } finally {
+                            saving = false;
                         }
                     }
                     
+                    async function postSave(filePath, body) {
+                        const response = await fetch('/api/save/' + encodeURIComponent(filePath), {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify(body)
+                        });
+                        return response.json();
+                    }
+                    
                     function newFile() {
                         const filename = prompt('Enter filename:');
                         if (filename) {
+                            editor.updateOptions({ readOnly: false });
+                            largeFileNext = null;
+                            baseVersion = null;
+                            deltaSaves = false;
                             editor.setValue('');
                             currentFilePath = filename;
                             document.getElementById('currentFile').textContent = filename + ' (new)';
@@ -317,18 +4494,18 @@ class ProperTerminal:
                 </script>
             </body>
             </html>
-            '''
+            ''')
         
         @self.app.route('/')
         def terminal_page():
-            return '''
+            return self.render_page('terminal', '''
             <!DOCTYPE html>
             <html>
             <head>
                 <title>Real Terminal</title>
-                <script src="https://cdn.jsdelivr.net/npm/xterm@5.3.0/lib/xterm.min.js"></script>
-                <script src="https://cdn.jsdelivr.net/npm/@xterm/addon-fit@0.10.0/lib/addon-fit.min.js"></script>
-                <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/xterm@5.3.0/css/xterm.css">
+                <script src="__ASSETS__/xterm@5.3.0/lib/xterm.js"></script>
+                <script src="__ASSETS__/@xterm/addon-fit@0.10.0/lib/addon-fit.js"></script>
+                <link rel="stylesheet" href="__ASSETS__/xterm@5.3.0/css/xterm.css">
                 <style>
                     body { 
                         margin: 0; 
@@ -348,10 +4525,15 @@ class ProperTerminal:
                         font-weight: bold;
                         border-bottom: 1px solid #444;
                     }
+                    .status {
+                        float: right;
+                        color: #888;
+                        font-weight: normal;
+                    }
                 </style>
             </head>
             <body>
-                <div class="header">💻 Real PTY Terminal (xterm.js)</div>
+                <div class="header">💻 Real PTY Terminal (xterm.js) <span id="status" class="status"></span></div>
                 <div class="terminal-container" id="terminal"></div>
                 
                 <script>
@@ -396,38 +4578,141 @@ class ProperTerminal:
                     // Open terminal in container
                     terminal.open(document.getElementById('terminal'));
                     
-                    // WebSocket connection
-                    const ws = new WebSocket('ws://localhost:8081');
+                    // WebSocket connection (with output flow control);
+                    // PTY output arrives as raw bytes in binary frames,
+                    // control messages as JSON text frames.
+                    // ?session=<id> attaches to a session from /api/sessions;
+                    // ?view=1 watches it read-only
+                    const pageParams = new URLSearchParams(window.location.search);
+                    const session = pageParams.get('session');
+                    const viewer = pageParams.get('view') === '1';
+                    const wsPath = session ? '/ws/' + encodeURIComponent(session) : '/';
+                    const status = document.getElementById('status');
+                    const WS_PORT = __WS_PORT__;
+                    
+                    // Frame opcodes for client-to-server messages
+                    const OP_INPUT = '0', OP_RESIZE = '1', OP_PING = '2', OP_ACK = '3';
+                    
+                    // Ack rendered output in batches so the server can pause
+                    // reading the PTY while xterm.js is behind
+                    const ACK_BYTES = 16384;
+                    let renderedBytes = 0;
+                    
+                    // Resume state: which session instance this terminal shows
+                    // and the output offset it has received up to
+                    let instance = null;
+                    let offset = 0;
+                    let replayBytes = 0;
+                    let retryDelay = 500;
+                    let ws = null;
+                    
+                    function connect() {
+                        const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+                        let url = scheme + window.location.hostname + ':' + WS_PORT + wsPath +
+                            (viewer ? '?role=viewer' : '?flow=1');
+                        if (instance !== null) {
+                            url += '&instance=' + encodeURIComponent(instance) + '&offset=' + offset;
+                        }
+                        const socket = new WebSocket(url);
+                        socket.binaryType = 'arraybuffer';
+                        ws = socket;
+                        renderedBytes = 0;
+                        
+                        socket.onopen = function() {
+                            retryDelay = 500;
+                            status.textContent = viewer ? '✓ viewing' : '✓ connected';
+                            sendResize(terminal.cols, terminal.rows);
+                        };
+                        
+                        socket.onmessage = function(event) {
+                            if (typeof event.data === 'string') {
+                                handleControl(JSON.parse(event.data));
+                                return;
+                            }
+                            
+                            // Write data from PTY to terminal
+                            const data = new Uint8Array(event.data);
+                            if (replayBytes > 0) {
+                                replayBytes -= data.length;
+                            } else {
+                                offset += data.length;
+                            }
+                            terminal.write(data, function() {
+                                if (viewer) return;
+                                renderedBytes += data.length;
+                                if (renderedBytes >= ACK_BYTES && socket.readyState === WebSocket.OPEN) {
+                                    socket.send(OP_ACK + renderedBytes);
+                                    renderedBytes = 0;
+                                }
+                            });
+                        };
+                        
+                        socket.onclose = function(event) {
+                            if (event.code === 4404) {
+                                status.textContent = '✗ session not found';
+                                return;
+                            }
+                            // Reconnect and pick up from the last offset; a
+                            // half-received replay can't be resumed
+                            if (replayBytes > 0) instance = null;
+                            status.textContent = '✗ disconnected, reconnecting...';
+                            setTimeout(connect, retryDelay);
+                            retryDelay = Math.min(retryDelay * 2, 10000);
+                        };
+                    }
+                    
+                    function handleControl(message) {
+                        if (message.type === 'hello') {
+                            // A reset means the server is replaying from scratch
+                            if (message.reset) terminal.reset();
+                            instance = message.instance;
+                            offset = message.offset;
+                            replayBytes = message.replay;
+                        } else if (message.type === 'size') {
+                            // Other clients can keep the shell smaller than this window
+                            const shared = message.cols !== terminal.cols || message.rows !== terminal.rows;
+                            status.title = shared ? 'shell is ' + message.cols + '×' + message.rows +
+                                ' to fit another client' : '';
+                        } else if (message.type === 'pong') {
+                            const rtt = performance.now() - parseFloat(message.token);
+                            status.textContent = (viewer ? '✓ viewing · ' : '✓ connected · ') + rtt.toFixed(1) + ' ms';
+                        }
+                    }
                     
-                    ws.onopen = function() {
-                        terminal.writeln('\\x1b[32m✓ Terminal connected!\\x1b[0m');
-                    };
+                    function sendResize(cols, rows) {
+                        if (!viewer && ws && ws.readyState === WebSocket.OPEN) {
+                            ws.send(OP_RESIZE + JSON.stringify({ cols: cols, rows: rows }));
+                        }
+                    }
                     
-                    ws.onmessage = function(event) {
-                        // Write data from PTY to terminal
-                        terminal.write(event.data);
-                    };
+                    // Round-trip latency probe, shown in the header
+                    setInterval(function() {
+                        if (ws && ws.readyState === WebSocket.OPEN) {
+                            ws.send(OP_PING + performance.now());
+                        }
+                    }, 5000);
                     
-                    ws.onclose = function() {
-                        terminal.writeln('\\r\\n\\x1b[31m✗ Terminal disconnected\\x1b[0m');
-                    };
+                    connect();
                     
-                    // Send terminal input to PTY
+                    // Send terminal input to PTY; big pastes go out in frames
+                    // under the server's message size limit, never splitting
+                    // a surrogate pair
+                    const INPUT_FRAME_CHARS = 65536;
                     terminal.onData(function(data) {
-                        if (ws.readyState === WebSocket.OPEN) {
-                            ws.send(data);
+                        if (viewer || ws.readyState !== WebSocket.OPEN) return;
+                        let start = 0;
+                        while (start < data.length) {
+                            let end = Math.min(start + INPUT_FRAME_CHARS, data.length);
+                            const last = data.charCodeAt(end - 1);
+                            if (end < data.length && last >= 0xD800 && last <= 0xDBFF) end--;
+                            ws.send(OP_INPUT + data.slice(start, end));
+                            start = end;
                         }
                     });
                     
                     // Handle terminal resize
                     terminal.onResize(function(size) {
-                        if (ws.readyState === WebSocket.OPEN) {
-                            ws.send(JSON.stringify({
-                                type: 'resize',
-                                cols: size.cols,
-                                rows: size.rows
-                            }));
-                        }
+                        sendResize(size.cols, size.rows);
                     });
                     
                     // Fit terminal to container
@@ -443,9 +4728,33 @@ class ProperTerminal:
                 </script>
             </body>
             </html>
-            '''
+            ''')
             
         # File operations API
+        @self.app.route('/static/<bundle>/<filepath:path>')
+        def static_asset(bundle, filepath):
+            """Vendored assets; URLs carry the bundle hash, so they never change"""
+            from bottle import request, response
+            resolved = None
+            if bundle == self.assets.hash:
+                resolved = self.assets.resolve(filepath, request.headers.get('Accept-Encoding', ''))
+            if resolved is None:
+                response.status = 404
+                return ''
+            
+            abs_path, encoding = resolved
+            st = os.stat(abs_path)
+            response.content_type = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+            etag = f'"{file_version(st)}"'
+            response.set_header('Cache-Control', f'public, max-age={STATIC_MAX_AGE}, immutable')
+            response.set_header('ETag', etag)
+            if encoding:
+                response.set_header('Content-Encoding', encoding)
+            if request.headers.get('If-None-Match') == etag:
+                response.status = 304
+                return ''
+            return self.contents.read(abs_path, st, 0, st.st_size)
+        
         @self.app.route('/api/files')
         def list_files():
             try:
@@ -468,7 +4777,7 @@ class ProperTerminal:
                         pass
                     return tree
                 
-                files = build_tree(os.getcwd())
+                files = build_tree(self.workspace)
                 from bottle import response
                 response.content_type = 'application/json'
                 return json.dumps(files)
@@ -478,339 +4787,600 @@ class ProperTerminal:
                 response.status = 500
                 return json.dumps({'error': str(e)})
         
+        @self.app.route('/api/list')
+        def list_directory():
+            """One page of a directory's children, for lazy tree expansion"""
+            from bottle import request, response
+            response.content_type = 'application/json'
+            relpath = request.query.getunicode('path', default='')
+            abs_path = self.workspace_path(relpath)
+            if abs_path is None:
+                response.status = 403
+                return json.dumps({'error': 'Access denied'})
+            
+            try:
+                offset = max(int(request.query.get('offset', 0)), 0)
+                limit = min(max(int(request.query.get('limit', LIST_PAGE_SIZE)), 1), LIST_PAGE_SIZE)
+            except ValueError:
+                response.status = 400
+                return json.dumps({'error': 'Bad offset or limit'})
+            
+            try:
+                etag, entries = self.listings.listing(abs_path)
+            except FileNotFoundError:
+                response.status = 404
+                return json.dumps({'error': 'Directory not found'})
+            except NotADirectoryError:
+                response.status = 400
+                return json.dumps({'error': 'Path is not a directory'})
+            except PermissionError:
+                response.status = 403
+                return json.dumps({'error': 'Permission denied'})
+            
+            # Clients revalidate every time; unchanged listings are a 304
+            etag = f'"{etag}-{offset}-{limit}"'
+            response.set_header('ETag', etag)
+            response.set_header('Cache-Control', 'no-cache')
+            if request.headers.get('If-None-Match') == etag:
+                response.status = 304
+                return ''
+            
+            end = offset + limit
+            return json.dumps({
+                'path': relpath,
+                'entries': entries[offset:end],
+                'total': len(entries),
+                'offset': offset,
+                'next_offset': end if end < len(entries) else None,
+            })
+        
         @self.app.route('/api/file/<filepath:path>')
         def read_file(filepath):
+            """File text for the editor.
+            
+            Files over large_file_bytes come back one page at a time
+            (offset/length query parameters) with large=True so the
+            editor can open them read-only; binary files are refused.
+            """
+            from bottle import request, response
+            response.content_type = 'application/json'
+            abs_path = self.workspace_path(filepath)
+            if abs_path is None:
+                response.status = 403
+                return json.dumps({'error': 'Access denied'})
+            
             try:
-                # Security: ensure filepath is within current directory
-                abs_path = os.path.abspath(filepath)
-                cwd = os.path.abspath(os.getcwd())
-                if not abs_path.startswith(cwd):
-                    from bottle import response
-                    response.status = 403
-                    return json.dumps({'error': 'Access denied'})
-                
-                if not os.path.exists(abs_path):
-                    from bottle import response
-                    response.status = 404
-                    return json.dumps({'error': 'File not found'})
-                
+                st = os.stat(abs_path)
                 if os.path.isdir(abs_path):
-                    from bottle import response
                     response.status = 400
                     return json.dumps({'error': 'Path is a directory'})
                 
-                with open(abs_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                head = self.contents.read(abs_path, st, 0, min(st.st_size, SNIFF_BYTES))
+                if sniff_binary(head):
+                    response.status = 400
+                    return json.dumps({'error': 'File is not text (binary file)',
+                                       'binary': True, 'size': st.st_size})
                 
-                from bottle import response
-                response.content_type = 'application/json'
+                large = st.st_size > self.large_file_bytes
+                if not large and 'offset' not in request.query:
+                    data = self.contents.read(abs_path, st, 0, st.st_size)
+                    content = data.decode('utf-8')
+                    return json.dumps({
+                        'content': content,
+                        'filepath': filepath,
+                        'size': st.st_size,
+                        'version': file_version(st, data),
+                        'large': False,
+                        # Whether saves may send edits instead of the whole text
+                        'deltas': edits_apply_cleanly(content),
+                    })
+                
+                try:
+                    offset = min(max(int(request.query.get('offset', 0)), 0), st.st_size)
+                    length = min(max(int(request.query.get('length', FILE_PAGE_SIZE)), 1), FILE_PAGE_SIZE)
+                except ValueError:
+                    response.status = 400
+                    return json.dumps({'error': 'Bad offset or length'})
+                
+                data = self.contents.read(abs_path, st, offset, offset + length)
+                content, used = decode_page(data)
+                next_offset = offset + used
                 return json.dumps({
                     'content': content,
                     'filepath': filepath,
-                    'size': len(content)
+                    'size': st.st_size,
+                    'version': file_version(st),
+                    'large': large,
+                    'offset': offset,
+                    'next_offset': next_offset if next_offset < st.st_size else None,
                 })
                 
+            except FileNotFoundError:
+                response.status = 404
+                return json.dumps({'error': 'File not found'})
             except UnicodeDecodeError:
-                from bottle import response
                 response.status = 400
-                return json.dumps({'error': 'File is not text (binary file)'})
+                return json.dumps({'error': 'File is not text (binary file)', 'binary': True})
             except Exception as e:
-                from bottle import response
                 response.status = 500
                 return json.dumps({'error': str(e)})
         
+        @self.app.route('/api/raw/<filepath:path>')
+        def read_raw(filepath):
+            """Raw file bytes, streamed, with single-range Range support"""
+            from bottle import request, response, parse_range_header
+            abs_path = self.workspace_path(filepath)
+            if abs_path is None:
+                response.status = 403
+                return ''
+            try:
+                st = os.stat(abs_path)
+            except FileNotFoundError:
+                response.status = 404
+                return ''
+            if os.path.isdir(abs_path):
+                response.status = 400
+                return ''
+            
+            etag = f'"{file_version(st)}"'
+            response.set_header('ETag', etag)
+            response.set_header('Accept-Ranges', 'bytes')
+            response.set_header('Cache-Control', 'no-cache')
+            if request.headers.get('If-None-Match') == etag:
+                response.status = 304
+                return ''
+            
+            head = self.contents.read(abs_path, st, 0, min(st.st_size, SNIFF_BYTES))
+            if sniff_binary(head):
+                response.content_type = mimetypes.guess_type(abs_path)[0] or 'application/octet-stream'
+            else:
+                response.content_type = 'text/plain; charset=utf-8'
+            
+            start, end = 0, st.st_size
+            range_header = request.headers.get('Range')
+            if range_header and request.headers.get('If-Range', etag) == etag:
+                ranges = list(parse_range_header(range_header, st.st_size))
+                if not ranges:
+                    response.status = 416
+                    response.set_header('Content-Range', f'bytes */{st.st_size}')
+                    return ''
+                if len(ranges) == 1:
+                    # Multiple ranges would need multipart/byteranges; send
+                    # the whole file instead, which the spec allows
+                    start, end = ranges[0]
+                    response.status = 206
+                    response.set_header('Content-Range', f'bytes {start}-{end - 1}/{st.st_size}')
+            
+            response.set_header('Content-Length', str(end - start))
+            if request.method == 'HEAD':
+                return ''
+            return self.contents.stream(abs_path, st, start, end)
+        
         @self.app.route('/api/save/<filepath:path>', method='POST')
         def save_file(filepath):
+            """Save from the editor.
+            
+            The body carries either the whole buffer ({content}) or edits
+            against the version the editor loaded ({base, edits, length},
+            length being the buffer's UTF-16 length after them). When a
+            base is given and the file has changed since, nothing is written
+            and a 409 reports the current version. Edits that can't be
+            applied faithfully (BOM, mixed line endings, or a result of the
+            wrong length) get a 409 with resend=True, asking for the whole
+            buffer instead.
+            """
+            from bottle import request, response
+            response.content_type = 'application/json'
+            abs_path = self.workspace_path(filepath)
+            if abs_path is None or cross_origin(request):
+                response.status = 403
+                return json.dumps({'error': 'Access denied'})
+            # Only JSON: other types can be POSTed cross-origin without a preflight
+            if request.content_type.split(';')[0].strip().lower() != 'application/json':
+                response.status = 415
+                return json.dumps({'error': 'Expected application/json'})
+            
             try:
-                # Security: ensure filepath is within current directory
-                abs_path = os.path.abspath(filepath)
-                cwd = os.path.abspath(os.getcwd())
-                if not abs_path.startswith(cwd):
-                    from bottle import response
-                    response.status = 403
-                    return json.dumps({'error': 'Access denied'})
-                
-                # Get content from request
-                import bottle
-                data = bottle.request.json
-                if not data or 'content' not in data:
-                    from bottle import response
-                    response.status = 400
-                    return json.dumps({'error': 'No content provided'})
-                
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-                
-                # Write file
-                with open(abs_path, 'w', encoding='utf-8') as f:
-                    f.write(data['content'])
+                # Read the body directly; request.json stops at MEMFILE_MAX
+                data = json.loads(request.body.read() or b'null')
+            except ValueError:
+                data = None
+            if not isinstance(data, dict) or ('content' not in data and 'edits' not in data):
+                response.status = 400
+                return json.dumps({'error': 'No content provided'})
+            if (not isinstance(data.get('base'), (str, type(None))) or
+                    ('edits' in data and not valid_edits(data['edits'])) or
+                    ('edits' not in data and not isinstance(data['content'], str))):
+                response.status = 400
+                return json.dumps({'error': 'Bad save: content must be a string, edits a list '
+                                            'of {offset, length, text}'})
+            
+            base = data.get('base')
+            try:
+                with self.save_lock:
+                    # Straight from disk: the conflict check can't trust a cached copy
+                    current = disk = None
+                    if base is not None:
+                        try:
+                            with open(abs_path, 'rb') as f:
+                                disk = f.read()
+                                current = file_version(os.fstat(f.fileno()), disk)
+                        except FileNotFoundError:
+                            pass
+                    if base is not None and current != base:
+                        response.status = 409
+                        return json.dumps({
+                            'error': 'File changed on disk',
+                            'conflict': True,
+                            'version': current,
+                        })
+                    
+                    if 'edits' in data:
+                        if disk is None or not isinstance(data.get('length'), int):
+                            response.status = 400
+                            return json.dumps({'error': 'Edits need the base version of an existing '
+                                                        'file and the resulting length'})
+                        text = disk.decode('utf-8')
+                        content = None
+                        if edits_apply_cleanly(text):
+                            content = apply_text_edits(text, data['edits'])
+                        if content is None or utf16_length(content) != data['length']:
+                            response.status = 409
+                            return json.dumps({'error': 'Edits do not match the file; send the whole text',
+                                               'resend': True})
+                    else:
+                        content = data['content']
+                    
+                    encoded = content.encode('utf-8')
+                    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+                    st = atomic_write(abs_path, encoded)
                 
-                from bottle import response
-                response.content_type = 'application/json'
                 return json.dumps({
                     'success': True,
                     'filepath': filepath,
-                    'size': len(data['content'])
+                    'size': st.st_size,
+                    'version': file_version(st, encoded),
+                    'deltas': edits_apply_cleanly(content),
                 })
                 
+            except (ValueError, KeyError, TypeError) as e:
+                # Malformed edits, or a file that isn't UTF-8 text
+                response.status = 400
+                return json.dumps({'error': f'Bad edit: {e}'})
             except Exception as e:
-                from bottle import response
                 response.status = 500
                 return json.dumps({'error': str(e)})
-    
-    def setup_pty(self):
-        """Create PTY and shell process"""
-        try:
-            # Create PTY
-            self.master_fd, self.slave_fd = pty.openpty()
-            
-            # Start shell
-            shell = os.environ.get('SHELL', '/bin/bash')
-            env = os.environ.copy()
-            env['TERM'] = 'xterm-256color'
-            
-            self.shell_process = subprocess.Popen(
-                [shell, '-l'],  # Login shell
-                stdin=self.slave_fd,
-                stdout=self.slave_fd,
-                stderr=self.slave_fd,
-                env=env,
-                cwd=os.getcwd(),
-                preexec_fn=os.setsid
-            )
-            
-            # Start PTY reader thread
-            self.pty_thread = threading.Thread(target=self.read_pty, daemon=True)
-            self.pty_thread.start()
+        
+        @self.app.route('/api/search')
+        def search():
+            """Stream workspace matches as NDJSON, one object per line.
             
-            print(f"PTY created with shell: {shell}")
+            q is the text to find (a regular expression with regex=1);
+            matching is case-insensitive unless case=1. The last line is
+            a {"type": "done"} summary.
+            """
+            from bottle import request, response
+            pattern = request.query.getunicode('q', default='')
+            literal = request.query.get('regex') != '1'
+            ignore_case = request.query.get('case') != '1'
+            try:
+                max_results = max(1, min(int(request.query.get('max', SEARCH_MAX_RESULTS)), SEARCH_MAX_RESULTS))
+                compile_search(pattern, literal, ignore_case)
+            except (ValueError, re.error) as e:
+                response.status = 400
+                response.content_type = 'application/json'
+                return json.dumps({'error': f'Bad query: {e}'})
+            if not pattern:
+                response.status = 400
+                response.content_type = 'application/json'
+                return json.dumps({'error': 'Empty query'})
             
-        except Exception as e:
-            print(f"Failed to create PTY: {e}")
-    
-    def read_pty(self):
-        """Read from PTY and send to WebSocket clients"""
-        while True:
+            response.content_type = 'application/x-ndjson'
+            response.set_header('Cache-Control', 'no-store')
+            return (json.dumps(result).encode() + b'\n'
+                    for result in self.search.search(pattern, literal, ignore_case, max_results))
+        
+        @self.app.route('/api/quickopen')
+        def quickopen():
+            """Best fuzzy matches for q among all workspace paths"""
+            from bottle import request, response
+            response.content_type = 'application/json'
             try:
-                # Wait for data from PTY
-                ready, _, _ = select.select([self.master_fd], [], [], 1.0)
-                if ready:
-                    data = os.read(self.master_fd, 8192)
-                    if data:
-                        # Send to all connected clients
-                        text = data.decode('utf-8', errors='replace')
-                        self.broadcast_to_clients(text)
-                    else:
-                        break
-            except OSError:
-                break
+                limit = max(1, min(int(request.query.get('limit', QUICKOPEN_RESULTS)), QUICKOPEN_MAX_RESULTS))
+            except ValueError:
+                response.status = 400
+                return json.dumps({'error': 'Bad limit'})
+            self.loop.call_soon_threadsafe(self.paths.refresh_if_stale, self.loop)
+            return json.dumps(self.paths.query(request.query.getunicode('q', default=''), limit))
+        
+        @self.app.route('/api/metrics')
+        def metrics():
+            """Prometheus text exposition of the server's counters"""
+            from bottle import response
+            response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            return self.metrics.render(self.run_on_loop(self.metrics_families))
+        
+        # Terminal sessions API
+        @self.app.route('/api/sessions')
+        def list_sessions():
+            from bottle import response
+            response.content_type = 'application/json'
+            return json.dumps(self.run_on_loop(self.sessions.list))
+        
+        @self.app.route('/api/sessions', method='POST')
+        def create_session():
+            """Start a shell, or with {"replay": path, "speed": n} replay a recording"""
+            from bottle import request, response
+            response.content_type = 'application/json'
+            if cross_origin(request):
+                response.status = 403
+                return json.dumps({'error': 'Access denied'})
+            try:
+                options = json.loads(request.body.read() or b'{}')
+                replay = options.get('replay')
+                speed = float(options.get('speed', REPLAY_SPEED))
+            except (ValueError, TypeError, AttributeError) as e:
+                response.status = 400
+                return json.dumps({'error': f'Bad request: {e}'})
+            try:
+                session = self.run_on_loop(self.sessions.create, None, replay, speed)
+                return json.dumps(session.info())
             except Exception as e:
-                print(f"PTY read error: {e}")
-                break
+                response.status = 503
+                return json.dumps({'error': str(e)})
+        
+        @self.app.route('/api/sessions/pool')
+        def shell_pool():
+            """Pre-started shell pool size and hit/miss counts"""
+            from bottle import response
+            response.content_type = 'application/json'
+            pool = self.sessions.pool
+            return json.dumps(self.run_on_loop(pool.info) if pool else {'size': 0})
+        
+        @self.app.route('/api/sessions/<session_id>', method='DELETE')
+        def destroy_session(session_id):
+            from bottle import response
+            response.content_type = 'application/json'
+            if not self.run_on_loop(self.sessions.destroy, session_id):
+                response.status = 404
+                return json.dumps({'error': 'Session not found'})
+            return json.dumps({'success': True})
     
-    def broadcast_to_clients(self, data):
-        """Send data to all WebSocket clients"""
-        if not self.clients:
+    async def websocket_handler(self, websocket):
+        """Route a WebSocket connection to its session by path"""
+        url = urlparse(websocket.request.path)
+        params = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        
+        if path == '/fs':
+            # Workspace change events for the editor
+            if self.watcher is None:
+                await websocket.close(4404, 'file watching not available')
+            else:
+                await self.watcher.websocket_handler(websocket)
             return
-            
-        # Use asyncio to send to clients
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        async def send_data():
-            if self.clients:
-                # Send to all clients
-                tasks = []
-                for client in self.clients.copy():
-                    try:
-                        tasks.append(client.send(data))
-                    except:
-                        self.clients.discard(client)
-                        
-                if tasks:
-                    await asyncio.gather(*tasks, return_exceptions=True)
         
-        try:
-            loop.run_until_complete(send_data())
-        except:
-            pass
-        finally:
-            loop.close()
+        if path == '/quickopen':
+            await self.paths.websocket_handler(websocket)
+            return
+        
+        if path in ('', '/ws'):
+            # Default terminal; a fresh shell replaces one that has exited
+            session = self.sessions.get(DEFAULT_SESSION)
+            if session is None:
+                self.sessions.reap()
+                session = self.sessions.create(DEFAULT_SESSION)
+        elif path.startswith('/ws/'):
+            session = self.sessions.get(path[len('/ws/'):])
+        else:
+            session = None
+        
+        if session is None:
+            await websocket.close(4404, 'unknown session')
+            return
+        await session.websocket_handler(websocket, params)
     
-    async def websocket_handler(self, websocket):
-        """Handle WebSocket connections"""
-        self.clients.add(websocket)
-        print(f"Terminal client connected. Total: {len(self.clients)}")
+    def update_paths(self, events):
+        """Keep the quick-open index in step with the watcher"""
+        if any(event['type'] == 'rescan' for event in events):
+            self.loop.run_in_executor(None, self.paths.build)
+        else:
+            self.paths.update(self.loop, events)
+    
+    async def serve(self):
+        """Run the HTTP and WebSocket servers on this thread's event loop"""
+        # PTYs are read on this loop, the one that owns the websockets
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(self.executor)
+        self.sessions.loop = self.loop
         
-        try:
-            async for message in websocket:
-                if isinstance(message, str):
-                    try:
-                        # Try to parse as JSON (for resize commands)
-                        data = json.loads(message)
-                        if data.get('type') == 'resize':
-                            self.resize_pty(data['rows'], data['cols'])
-                    except json.JSONDecodeError:
-                        # Regular terminal input
-                        if self.master_fd:
-                            os.write(self.master_fd, message.encode('utf-8'))
-                else:
-                    # Binary data - send directly to PTY
-                    if self.master_fd:
-                        os.write(self.master_fd, message)
-                        
-        except websockets.exceptions.ConnectionClosed:
-            pass
-        except Exception as e:
-            print(f"WebSocket error: {e}")
-        finally:
-            self.clients.discard(websocket)
-            print(f"Terminal client disconnected. Total: {len(self.clients)}")
+        self.http_server = AsyncHTTPServer(self.app, self.executor, self.host, self.http_port,
+                                           metrics=self.metrics)
+        await self.http_server.start()
+        print(f"HTTP server started on {self.host}:{self.http_port}")
+        
+        async with websockets.serve(self.websocket_handler, self.host, self.ws_port,
+                                    compression=None,
+                                    extensions=compression_extensions(**self.compression)):
+            print(f"Terminal WebSocket server started on {self.host}:{self.ws_port}")
+            # Both ports are bound; spawn the shell the terminal page attaches to
+            self.sessions.start_pool()
+            self.sessions.create(DEFAULT_SESSION, self.replay, self.replay_speed)
+            self.reaper_task = asyncio.create_task(self.sessions.reaper())
+            self.lag_task = asyncio.create_task(self.metrics.monitor_loop())
+            if self.watcher:
+                self.watcher_task = asyncio.create_task(self.watcher.start(self.loop))
+            self.loop.run_in_executor(None, self.paths.build)
+            self.ready.set()
+            print(f"Servers ready after {(time.monotonic() - self.launched) * 1000:.0f} ms")
+            await self.stopping.wait()  # Run until stop()
+            
+            self.http_server.server.close()
+            for task in (self.reaper_task, self.lag_task, self.watcher_task):
+                if task:
+                    task.cancel()
+            if self.watcher:
+                self.watcher.close()
+            self.sessions.close_all()
     
-    def resize_pty(self, rows, cols):
-        """Resize PTY"""
-        try:
-            import struct, fcntl, termios
-            winsize = struct.pack('HHHH', rows, cols, 0, 0)
-            fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, winsize)
-        except Exception as e:
-            print(f"Resize error: {e}")
+    def stop(self, timeout=10):
+        """Shut the servers down and hang up every shell (from another thread)"""
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.server_thread.join(timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.search.close()
     
-    def start_websocket_server(self):
-        """Start WebSocket server"""
-        async def server():
-            async with websockets.serve(self.websocket_handler, "localhost", 8081):
-                print("Terminsal WebSocket server started on port 8081")
-                await asyncio.Future()  # Run forever
+    def start_servers(self):
+        """Start both servers"""
+        if self.host not in ('localhost', '127.0.0.1', '::1'):
+            print(f"WARNING: serving an unauthenticated shell on {self.host}; "
+                  "only do this on a trusted network or behind a tunnel")
         
-        def run_server():
+        def run_servers():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-            loop.run_until_complete(server())
+            try:
+                loop.run_until_complete(self.serve())
+            except Exception as e:
+                print(f"Server failed to start: {e}")
+                self.startup_error = e
+                self.ready.set()
         
-        ws_thread = threading.Thread(target=run_server, daemon=True)
-        ws_thread.start()
+        self.server_thread = threading.Thread(target=run_servers, daemon=True)
+        self.server_thread.start()
     
-    def start_http_server(self):
-        """Start HTTP server"""
-        def run_http():
-            self.app.run(host='localhost', port=8080, quiet=True)
-        
-        http_thread = threading.Thread(target=run_http, daemon=True)
-        http_thread.start()
+    def wait_ready(self, timeout=None):
+        """Block until the servers accept connections; raises if they couldn't start"""
+        if not self.ready.wait(timeout):
+            raise RuntimeError(f'Servers not ready after {timeout} s')
+        if self.startup_error:
+            raise self.startup_error
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Terminal + Editor + Browser IDE")
+    parser.add_argument('--remote', action='store_true',
+                        help="serve the terminal for remote browsers without the Qt window "
+                             "(still only on this machine unless --host is given)")
+    parser.add_argument('--host', default=HOST,
+                        help=f"address to bind (default {HOST}; 0.0.0.0 exposes the unauthenticated shell)")
+    parser.add_argument('--http-port', type=int, default=HTTP_PORT)
+    parser.add_argument('--ws-port', type=int, default=WS_PORT)
+    parser.add_argument('--screen-model', action='store_true',
+                        help="keep a server-side screen model for compact attach snapshots")
+    parser.add_argument('--resize-policy', choices=RESIZE_POLICIES, default=RESIZE_POLICY,
+                        help="terminal size with several clients: the smallest one, or the first attached")
+    parser.add_argument('--resize-debounce', type=float, default=RESIZE_DEBOUNCE,
+                        help="seconds a client's size must hold before the shell is resized")
     
-    def start_servers(self):
-        """Start both servers"""
-        self.start_http_server()
-        self.start_websocket_server()
+    parser.add_argument('--web-cache-size', type=int, default=WEB_CACHE_BYTES,
+                        help="HTTP cache cap in bytes for the terminal and editor views")
+    parser.add_argument('--search-index', action='store_true',
+                        help="keep a persistent trigram index to speed up repeated searches")
+    parser.add_argument('--http-workers', type=int, default=HTTP_WORKERS,
+                        help="threads serving HTTP requests and other blocking work")
+    parser.add_argument('--large-file-size', type=int, default=LARGE_FILE_BYTES,
+                        help="open files larger than this many bytes read-only, in pages")
+    parser.add_argument('--content-cache-size', type=int, default=CONTENT_CACHE_BYTES,
+                        help="memory cap in bytes for cached file contents")
+    parser.add_argument('--shell-pool', type=int, default=SHELL_POOL_SIZE,
+                        help="login shells to keep started ahead of new terminals (0 disables)")
+    parser.add_argument('--shell-pool-idle', type=float, default=SHELL_POOL_IDLE,
+                        help="seconds a pre-started shell may wait before it is replaced")
+    
+    recording = parser.add_argument_group('session recording')
+    recording.add_argument('--record', metavar='DIR',
+                           help="record every terminal session to asciicast files in DIR")
+    recording.add_argument('--record-input', action='store_true',
+                           help="record keystrokes too (they include anything typed at password prompts)")
+    recording.add_argument('--record-max-size', type=int, default=RECORD_MAX_BYTES,
+                           help="start a new recording file after this many bytes")
+    recording.add_argument('--replay', metavar='FILE',
+                           help="replay an asciicast recording as the default session")
+    recording.add_argument('--replay-speed', type=float, default=REPLAY_SPEED,
+                           help="replay speed multiplier; 0 replays as fast as clients keep up")
+    
+    compression = parser.add_argument_group('websocket compression')
+    compression.add_argument('--compress-level', type=int, default=COMPRESS_LEVEL,
+                             help="zlib level 0-9; 0 disables permessage-deflate")
+    compression.add_argument('--compress-window-bits', type=int, default=COMPRESS_WINDOW_BITS,
+                             help="LZ77 window size, 8-15")
+    compression.add_argument('--compress-mem-level', type=int, default=COMPRESS_MEM_LEVEL,
+                             help="zlib memLevel, 1-9")
+    compression.add_argument('--no-context-takeover', action='store_true',
+                             help="reset the compressor for every message")
+    compression.add_argument('--compress-min-size', type=int, default=COMPRESS_MIN_SIZE,
+                             help="send frames smaller than this many bytes uncompressed")
+    return parser.parse_args(argv)
 
-class MainWindow(QMainWindow):
-    def __init__(self):
-        super().__init__()
-        self.terminal_server = ProperTerminal()
-        self.init_ui()
-        
-    def init_ui(self):
-        self.setWindowTitle("Terminal + Editor + Browser IDE")
-        self.setGeometry(100, 100, 1800, 1000)
-        
-        self.setStyleSheet("""
-            QMainWindow { background-color: #1e1e1e; }
-            QWidget { background-color: #1e1e1e; color: white; }
-            QLineEdit { 
-                background-color: #333; 
-                color: white; 
-                border: 1px solid #666;
-                padding: 8px;
-                font-size: 14px;
-            }
-            QPushButton {
-                background-color: #007acc;
-                color: white;
-                border: none;
-                padding: 8px 16px;
-                border-radius: 4px;
-                font-weight: bold;
-            }
-            QPushButton:hover { background-color: #005a9e; }
-            QLabel { color: #007acc; font-weight: bold; }
-        """)
-        
-        central_widget = QWidget()
-        self.setCentralWidget(central_widget)
-        
-        layout = QVBoxLayout(central_widget)
-        layout.setContentsMargins(0, 0, 0, 0)
-        
-        # URL bar
-        url_frame = QFrame()
-        url_frame.setFixedHeight(50)
-        url_frame.setStyleSheet("background-color: #2d2d2d; border-bottom: 2px solid #007acc;")
-        url_layout = QHBoxLayout(url_frame)
-        
-        url_layout.addWidget(QLabel("🌐 Browser URL:"))
-        self.url_input = QLineEdit("https://www.google.com")
-        self.url_input.returnPressed.connect(self.load_url)
-        url_layout.addWidget(self.url_input)
-        
-        go_btn = QPushButton("Go")
-        go_btn.clicked.connect(self.load_url)
-        url_layout.addWidget(go_btn)
-        
-        layout.addWidget(url_frame)
-        
-        # Splitter for 3 panes
-        splitter = QSplitter(Qt.Orientation.Horizontal)
-        layout.addWidget(splitter)
-        
-        # Terminal WebView (loads xterm.js)
-        self.terminal_view = QWebEngineView()
-        self.terminal_view.setUrl(QUrl("http://localhost:8080"))
-        splitter.addWidget(self.terminal_view)
-        
-        # Editor WebView (loads Monaco Editor)
-        self.editor_view = QWebEngineView()
-        self.editor_view.setUrl(QUrl("http://localhost:8080/editor"))
-        splitter.addWidget(self.editor_view)
-        
-        # Browser WebView
-        self.browser_view = QWebEngineView()
-        self.browser_view.setUrl(QUrl("https://www.google.com"))
-        splitter.addWidget(self.browser_view)
-        
-        # Equal 3-way split
-        splitter.setSizes([466, 467, 467])
-        
-        # Start terminal servers
-        self.terminal_server.start_servers()
-        
-    def load_url(self):
-        url = self.url_input.text().strip()
-        if not url.startswith(('http://', 'https://')):
-            if '.' in url and ' ' not in url:
-                url = 'https://' + url
-            else:
-                url = f"https://www.google.com/search?q={url.replace(' ', '+')}"
-        
-        self.browser_view.setUrl(QUrl(url))
-        self.url_input.setText(url)
+def server_from_args(args):
+    return ProperTerminal(
+        host=args.host,
+        http_port=args.http_port,
+        ws_port=args.ws_port,
+        screen_model=args.screen_model,
+        large_file_bytes=args.large_file_size,
+        http_workers=args.http_workers,
+        search_index=args.search_index,
+        content_cache_bytes=args.content_cache_size,
+        record_dir=args.record,
+        record_input=args.record_input,
+        record_max_bytes=args.record_max_size,
+        replay=args.replay,
+        replay_speed=args.replay_speed,
+        shell_pool=args.shell_pool,
+        shell_pool_idle=args.shell_pool_idle,
+        resize_policy=args.resize_policy,
+        resize_debounce=args.resize_debounce,
+        compression={
+            'level': args.compress_level,
+            'window_bits': args.compress_window_bits,
+            'mem_level': args.compress_mem_level,
+            'context_takeover': not args.no_context_takeover,
+            'min_size': args.compress_min_size,
+        },
+    )
 
 def main():
-    app = QApplication(sys.argv)
+    args = parse_args()
+    terminal_server = server_from_args(args)
     
-    # Give servers time to start
-    import time
+    if args.remote:
+        # Headless: browsers connect straight to the HTTP/WebSocket ports
+        terminal_server.start_servers()
+        try:
+            terminal_server.wait_ready()
+        except Exception:
+            sys.exit(1)
+        print(f"Serving terminal on http://{terminal_server.host}:{terminal_server.http_port}")
+        if terminal_server.host == HOST:
+            print("Only reachable from this machine; tunnel the ports or pass --host to expose them")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        return
     
-    window = MainWindow()
-    window.show()
+    # Qt is only imported here: remote mode, bench.py and the search
+    # workers (which re-import the main module under spawn) never load it
+    try:
+        from PyQt6.QtWidgets import QApplication
+        from ide_window import MainWindow
+    except ImportError:
+        print("PyQt6 WebEngine is not installed; use --remote to serve without the window")
+        sys.exit(1)
     
-    # Wait a bit for servers to start, then reload terminal and editor
-    def reload_views():
-        window.terminal_view.reload()
-        window.editor_view.reload()
-        
-    from PyQt6.QtCore import QTimer
-    QTimer.singleShot(2000, reload_views)
+    # Bind the ports while Qt starts up; the window loads its views when
+    # the servers signal they're ready
+    terminal_server.start_servers()
+    
+    # Let same-site views (terminal and editor) share a renderer process
+    flags = os.environ.get('QTWEBENGINE_CHROMIUM_FLAGS', '')
+    if '--process-per-site' not in flags:
+        os.environ['QTWEBENGINE_CHROMIUM_FLAGS'] = (flags + ' --process-per-site').strip()
+    app = QApplication(sys.argv[:1])
+    
+    window = MainWindow(terminal_server, BROWSER_HOME, web_cache_bytes=args.web_cache_size)
+    window.show()
     
     sys.exit(app.exec())
 
@@ -0,0 +1,81 @@
+import os
+import io
+import sys
+import socket
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+# proper_terminal.py is a single module at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proper_terminal import AsyncHTTPServer, ProperTerminal
+
+def make_environ(path, method='GET', body=b'', headers=None):
+    url = urlsplit(path)
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'wsgi.input': io.BytesIO(body),
+        'CONTENT_LENGTH': str(len(body)),
+    })
+    for name, value in (headers or {}).items():
+        key = name.upper().replace('-', '_')
+        environ[key if key in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + key] = value
+    return environ
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A ProperTerminal whose workspace is tmp_path, servers not started"""
+    monkeypatch.chdir(tmp_path)
+    server = ProperTerminal(http_port=0, ws_port=0)
+    yield server
+    server.executor.shutdown()
+    server.search.close()
+
+@pytest.fixture
+def http(server):
+    """Call the server's WSGI app: http(path, method, body, headers) -> (status, headers, body)"""
+    def call(path, method='GET', body=b'', headers=None):
+        started = {}
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split()[0])
+            started['headers'] = dict(response_headers)
+        data = b''.join(server.app(make_environ(path, method, body, headers), start_response))
+        return started['status'], started['headers'], data
+    return call
+
+@pytest.fixture
+def served(server):
+    """Like http, but through the HTTP front end (gzip and Vary applied): headers come back as a list"""
+    front = AsyncHTTPServer(server.app, server.executor, 'localhost', 0)
+    def call(path, headers=None):
+        status, response_headers, body, _ = front.call_app(make_environ(path, headers=headers))
+        return int(status.split()[0]), response_headers, body
+    return call
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    """Start a server with its own shells; yields a factory taking ProperTerminal options"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('PS1', '$ ')
+    servers = []
+    def start(**options):
+        options = {'shell_pool': 0, **options}
+        server = ProperTerminal(http_port=free_port(), ws_port=free_port(), **options)
+        server.start_servers()
+        server.wait_ready(timeout=10)
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
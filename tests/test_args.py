@@ -0,0 +1,17 @@
+import pytest
+
+from proper_terminal import parse_args, server_from_args
+
+@pytest.mark.parametrize('argv, host', [
+    ([], 'localhost'),
+    (['--remote'], 'localhost'),
+    (['--remote', '--host', '0.0.0.0'], '0.0.0.0'),
+])
+def test_only_an_explicit_host_exposes_the_shell(argv, host, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = server_from_args(parse_args(argv + ['--http-port', '0', '--ws-port', '0']))
+    try:
+        assert server.host == host
+    finally:
+        server.executor.shutdown()
+        server.search.close()
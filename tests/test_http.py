@@ -0,0 +1,105 @@
+import os
+import json
+import gzip
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from proper_terminal import AssetBundle, AsyncHTTPServer
+
+def header(headers, name):
+    return [value for key, value in headers if key.lower() == name.lower()]
+
+def test_page_vary_and_revalidation(served):
+    status, headers, body = served('/editor', {'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert header(headers, 'Content-Encoding') == ['gzip']
+    assert header(headers, 'Vary') == ['Accept-Encoding']
+    assert b'<html' in gzip.decompress(body).lower()
+    
+    etag, = header(headers, 'ETag')
+    status, headers, body = served('/editor', {'If-None-Match': etag})
+    assert (status, body) == (304, b'')
+    assert header(headers, 'Vary') == ['Accept-Encoding']
+
+def test_json_gzipped_once(served, server):
+    with open(os.path.join(server.workspace, 'big.txt'), 'w') as f:
+        f.write('x' * 10000)
+    status, headers, body = served('/api/file/big.txt', {'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert header(headers, 'Vary') == ['Accept-Encoding']
+    assert json.loads(gzip.decompress(body))['content'] == 'x' * 10000
+
+def test_static_assets(served, server, tmp_path):
+    static = tmp_path / 'static'
+    (static / 'xterm').mkdir(parents=True)
+    (static / 'manifest.json').write_text(json.dumps({'hash': 'abc'}))
+    (static / 'xterm' / 'xterm.js').write_text('var x;' * 100)
+    (static / 'xterm' / 'xterm.js.br').write_bytes(b'brotli')
+    (static / 'font.woff2').write_bytes(b'font')
+    server.assets = AssetBundle(str(static))
+    
+    status, headers, body = served('/static/abc/xterm/xterm.js', {'Accept-Encoding': 'gzip, br'})
+    assert (status, body) == (200, b'brotli')
+    assert header(headers, 'Content-Encoding') == ['br']
+    assert header(headers, 'Vary') == ['Accept-Encoding']
+    
+    etag, = header(headers, 'ETag')
+    status, headers, body = served('/static/abc/xterm/xterm.js',
+                                   {'Accept-Encoding': 'gzip, br', 'If-None-Match': etag})
+    assert (status, body) == (304, b'')
+    assert header(headers, 'Vary') == ['Accept-Encoding']
+    # The plain variant has its own ETag
+    status, headers, body = served('/static/abc/xterm/xterm.js', {'If-None-Match': etag})
+    assert status == 200 and body == b'var x;' * 100
+    
+    # Nothing to negotiate for an uncompressed binary type
+    status, headers, body = served('/static/abc/font.woff2')
+    assert (status, body) == (200, b'font')
+    assert header(headers, 'Vary') == []
+    
+    assert served('/static/other/xterm/xterm.js')[0] == 404
+    assert served('/static/abc/../manifest.json')[0] == 404
+
+def test_sessions_refuse_cross_origin(http):
+    # Any page could otherwise start shells or replays with a simple POST
+    status, _, _ = http('/api/sessions', 'POST', b'{}',
+                        {'Content-Type': 'text/plain', 'Origin': 'http://evil.example', 'Host': 'localhost'})
+    assert status == 403
+
+def raw_exchange(request):
+    """Send raw bytes to an AsyncHTTPServer; returns everything it sends back before closing"""
+    def app(environ, start_response):
+        body = environ['wsgi.input'].read()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'got %d' % len(body)]
+    
+    async def run():
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            front = AsyncHTTPServer(app, executor, 'localhost', 0)
+            await front.start()
+            port = front.server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('localhost', port)
+            writer.write(request)
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            await front.close()
+            return response
+    return asyncio.run(run())
+
+@pytest.mark.parametrize('length', [b'abc', b'-5', b'1 2', b'\xb2'])
+def test_bad_content_length_gets_400(length):
+    response = raw_exchange(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: ' + length + b'\r\n\r\nhello')
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'\r\nConnection: close\r\n' in response
+
+def test_conflicting_content_lengths_get_400():
+    response = raw_exchange(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n'
+                            b'Content-Length: 3\r\nConnection: close\r\n\r\nhello')
+    assert response.startswith(b'HTTP/1.1 400 ')
+
+def test_good_content_length():
+    response = raw_exchange(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n'
+                            b'Connection: close\r\n\r\nhello')
+    assert response.startswith(b'HTTP/1.1 200 ') and response.endswith(b'got 5')
@@ -0,0 +1,105 @@
+import json
+import time
+import asyncio
+
+import websockets
+
+from proper_terminal import OP_ACK, OP_INPUT, OP_RESIZE
+
+async def attach(server, session_id):
+    websocket = await websockets.connect(f'ws://localhost:{server.ws_port}/ws/{session_id}?flow=1',
+                                         max_size=None)
+    await websocket.send(OP_RESIZE + json.dumps({'rows': 24, 'cols': 80}))
+    return websocket
+
+async def read_acking(websocket, marker, count, step=64 * 1024):
+    """Read output, acking it like xterm.js, until marker has shown up count times"""
+    seen = 0
+    unacked = 0
+    tail = b''
+    while seen < count:
+        message = await websocket.recv()
+        if isinstance(message, str):
+            continue
+        unacked += len(message)
+        if unacked >= step:
+            await websocket.send(OP_ACK + str(unacked))
+            unacked = 0
+        tail = tail[-len(marker):] + message
+        seen += tail.count(marker)
+        tail = tail[-len(marker) + 1:]
+
+def test_large_paste_into_cat(live):
+    server = live(screen_model=False)
+    session = server.run_on_loop(server.sessions.create)
+    paste = (b'x' * 99 + b'\n') * 40000 + b'END-OF-PASTE\n'
+    
+    async def scenario():
+        websocket = await attach(server, session.id)
+        await websocket.send(OP_INPUT + 'cat\r')
+        await asyncio.sleep(0.5)
+        
+        async def send():
+            # The page splits a paste into frames of this many characters
+            for start in range(0, len(paste), 65536):
+                await websocket.send(OP_INPUT + paste[start:start + 65536].decode())
+        sender = asyncio.create_task(send())
+        # Once echoed by the tty and once written back by cat
+        await asyncio.wait_for(read_acking(websocket, b'END-OF-PASTE', 2), 60)
+        await sender
+        
+        # Interrupting works once the paste is through
+        await websocket.send(OP_INPUT + '\x03')
+        await asyncio.sleep(0.2)
+        await websocket.send(OP_INPUT + 'echo after_$(echo PASTE)\r')
+        await asyncio.wait_for(read_acking(websocket, b'after_PASTE', 1), 10)
+        await websocket.close()
+    asyncio.run(scenario())
+    assert not session.pending_input
+    assert not session.reading_paused
+
+def test_acks_resume_reading_while_input_is_held(live):
+    server = live(screen_model=False)
+    session = server.run_on_loop(server.sessions.create)
+    paste = (b'y' * 99 + b'\n') * 40000 + b'END-OF-PASTE\n'
+    
+    def state():
+        return server.run_on_loop(lambda: (session.reading_paused, session.input_drained.is_set(),
+                                           session.counters['pty_read_bytes_total']))
+    
+    async def wait_for(condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition(*state()):
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.05)
+    
+    async def scenario():
+        websocket = await attach(server, session.id)
+        await websocket.send(OP_INPUT + 'cat\r')
+        await asyncio.sleep(0.5)
+        
+        # Input faster than the PTY drains it, with no acks: output fills
+        # the client's window and reading pauses, so cat stops taking input
+        async def send():
+            for start in range(0, len(paste), 65536):
+                await websocket.send(OP_INPUT + paste[start:start + 65536].decode())
+        sender = asyncio.create_task(send())
+        await wait_for(lambda paused, drained, _: paused and not drained)
+        _, _, read = state()
+        
+        # Acks still get through and the PTY is read again
+        received = 0
+        try:
+            while True:
+                message = await asyncio.wait_for(websocket.recv(), 0.5)
+                if isinstance(message, bytes):
+                    received += len(message)
+        except asyncio.TimeoutError:
+            pass
+        await websocket.send(OP_ACK + str(received))
+        await wait_for(lambda paused, drained, now_read: now_read > read)
+        
+        await asyncio.wait_for(read_acking(websocket, b'END-OF-PASTE', 2), 60)
+        await sender
+        await websocket.close()
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import os
+import json
+import asyncio
+
+from proper_terminal import PathIndex, IgnoreRules
+
+def make_index(root, files):
+    for relpath in files:
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+    index = PathIndex(str(root), IgnoreRules(str(root)))
+    index.build()
+    return index
+
+def paths(result):
+    return [match['path'] for match in result['results']]
+
+def test_fuzzy_match_and_positions(tmp_path):
+    index = make_index(tmp_path, ['src/server/main.py', 'src/client/app.js', 'README.md'])
+    result = index.query('srvmain')
+    assert paths(result) == ['src/server/main.py']
+    # Positions point at the matched characters
+    match = result['results'][0]
+    assert ''.join(match['path'][i] for i in match['positions']).lower() == 'srvmain'
+
+def test_no_match(tmp_path):
+    index = make_index(tmp_path, ['a.py', 'b.py'])
+    assert paths(index.query('zzz')) == []
+
+def test_basename_and_consecutive_matches_rank_first(tmp_path):
+    index = make_index(tmp_path, ['lib/main_test/other.py', 'lib/test/main.py', 'm/a/i/n.py'])
+    assert paths(index.query('main'))[0] == 'lib/test/main.py'
+
+def test_matches_do_not_span_paths(tmp_path):
+    # "ab" must not match across the end of one path and the start of the next
+    index = make_index(tmp_path, ['xa', 'by'])
+    assert paths(index.query('ab')) == []
+
+def test_ignored_and_hidden_files_left_out(tmp_path):
+    (tmp_path / '.gitignore').write_text('build/\n')
+    index = make_index(tmp_path, ['build/out.js', '.hidden/x.js', 'src/x.js'])
+    assert paths(index.query('x.js')) == ['src/x.js']
+
+def test_narrowing_matches_a_fresh_query(tmp_path):
+    files = [f'pkg{i}/mod{j}/file{i * j}.py' for i in range(20) for j in range(20)]
+    index = make_index(tmp_path, files)
+    state = {}
+    for typed in ('f', 'fi', 'fil', 'file1', 'file12'):
+        narrowed = index.query(typed, limit=1000, state=state)
+        fresh = index.query(typed, limit=1000)
+        assert paths(narrowed) == paths(fresh)
+
+def test_update_applies_batches_in_order(tmp_path):
+    index = make_index(tmp_path, ['a.py'])
+    
+    async def run():
+        loop = asyncio.get_running_loop()
+        os.makedirs(tmp_path / 'new' / 'deep')
+        (tmp_path / 'new' / 'deep' / 'b.py').write_text('')
+        index.update(loop, [{'type': 'created', 'path': 'new', 'is_dir': True}])
+        # Queued behind the directory walk above
+        index.update(loop, [{'type': 'deleted', 'path': 'new/deep/b.py', 'is_dir': False},
+                            {'type': 'renamed', 'path': 'c.py', 'from': 'a.py', 'is_dir': False}])
+        while index.batches:
+            await asyncio.sleep(0.01)
+    asyncio.run(run())
+    assert index.paths == {'c.py'}
+
+class FakeSocket:
+    """Feeds queries to websocket_handler and collects its replies"""
+    
+    def __init__(self, queries):
+        self.queries = queries
+        self.sent = []
+    
+    async def __aiter__(self):
+        for query in self.queries:
+            yield json.dumps(query)
+            # Let each query be answered before the next is typed
+            while len(self.sent) < query['id']:
+                await asyncio.sleep(0.01)
+    
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+def test_failed_query_still_answers_later_ones(tmp_path, monkeypatch):
+    index = make_index(tmp_path, ['src/main.py'])
+    query = index.query
+    
+    def flaky(q, limit=None, state=None):
+        if q == 'boom':
+            raise RuntimeError('index broke')
+        return query(q, limit, state)
+    monkeypatch.setattr(index, 'query', flaky)
+    websocket = FakeSocket([{'id': 1, 'q': 'boom'}, {'id': 2, 'q': 'main'}])
+    asyncio.run(asyncio.wait_for(index.websocket_handler(websocket), 5))
+    assert websocket.sent[0] == {'id': 1, 'results': [], 'error': 'index broke'}
+    assert websocket.sent[1]['id'] == 2
+    assert paths(websocket.sent[1]) == ['src/main.py']
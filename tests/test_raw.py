@@ -0,0 +1,61 @@
+import os
+
+def write(server, name, data):
+    with open(os.path.join(server.workspace, name), 'wb') as f:
+        f.write(data)
+
+def test_whole_file(server, http):
+    write(server, 'a.txt', b'0123456789')
+    status, headers, body = http('/api/raw/a.txt')
+    assert (status, body) == (200, b'0123456789')
+    assert headers['Content-Type'] == 'text/plain; charset=utf-8'
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert headers['Content-Length'] == '10'
+    
+    status, _, body = http('/api/raw/a.txt', headers={'If-None-Match': headers['Etag']})
+    assert (status, body) == (304, b'')
+
+def test_binary_type(server, http):
+    write(server, 'image.png', b'\x89PNG\r\n\x1a\n\x00\x00')
+    status, headers, _ = http('/api/raw/image.png')
+    assert (status, headers['Content-Type']) == (200, 'image/png')
+
+def test_ranges(server, http):
+    write(server, 'a.txt', b'0123456789')
+    status, headers, body = http('/api/raw/a.txt', headers={'Range': 'bytes=2-4'})
+    assert (status, body) == (206, b'234')
+    assert headers['Content-Range'] == 'bytes 2-4/10'
+    assert headers['Content-Length'] == '3'
+    
+    status, headers, body = http('/api/raw/a.txt', headers={'Range': 'bytes=-3'})
+    assert (status, body, headers['Content-Range']) == (206, b'789', 'bytes 7-9/10')
+    status, _, body = http('/api/raw/a.txt', headers={'Range': 'bytes=8-'})
+    assert (status, body) == (206, b'89')
+    
+    # Several ranges get the whole file
+    status, _, body = http('/api/raw/a.txt', headers={'Range': 'bytes=0-1,5-6'})
+    assert (status, body) == (200, b'0123456789')
+    
+    status, headers, body = http('/api/raw/a.txt', headers={'Range': 'bytes=20-30'})
+    assert (status, body) == (416, b'')
+    assert headers['Content-Range'] == 'bytes */10'
+
+def test_if_range(server, http):
+    write(server, 'a.txt', b'0123456789')
+    etag = http('/api/raw/a.txt')[1]['Etag']
+    assert http('/api/raw/a.txt', headers={'Range': 'bytes=0-0', 'If-Range': etag})[0] == 206
+    # A stale validator gets the whole (changed) file
+    status, _, body = http('/api/raw/a.txt', headers={'Range': 'bytes=0-0', 'If-Range': '"old"'})
+    assert (status, body) == (200, b'0123456789')
+
+def test_head(server, http):
+    write(server, 'a.txt', b'0123456789')
+    status, headers, body = http('/api/raw/a.txt', method='HEAD')
+    assert (status, headers['Content-Length'], body) == (200, '10', b'')
+
+def test_errors(server, http, tmp_path):
+    os.mkdir(os.path.join(server.workspace, 'dir'))
+    assert http('/api/raw/../outside.txt')[0] == 403
+    assert http('/api/raw/dir/../../outside.txt')[0] == 403
+    assert http('/api/raw/missing.txt')[0] == 404
+    assert http('/api/raw/dir')[0] == 400
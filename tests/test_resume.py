@@ -0,0 +1,139 @@
+import json
+import asyncio
+
+import websockets
+
+from proper_terminal import OP_INPUT, OP_RESIZE, ScrollbackBuffer
+
+def test_scrollback_offsets():
+    buffer = ScrollbackBuffer(max_bytes=10)
+    buffer.append(b'abcd')
+    buffer.append(b'efgh')
+    assert (buffer.start, buffer.end) == (0, 8)
+    assert buffer.read_from(0) == b'abcdefgh'
+    assert buffer.read_from(6) == b'gh'
+    assert buffer.read_from(8) == b''
+    assert buffer.read_from(9) is None
+    
+    # Whole chunks are dropped once over the cap; their offsets are gone
+    buffer.append(b'ijkl')
+    assert (buffer.start, buffer.end) == (4, 12)
+    assert buffer.read_from(3) is None
+    assert buffer.read_from(4) == b'efghijkl'
+
+def test_scrollback_keeps_newest_chunk():
+    buffer = ScrollbackBuffer(max_bytes=4)
+    buffer.append(b'0123456789')
+    assert buffer.read_from(0) == b'0123456789'
+
+class Client:
+    """Reads a session's hello and output, remembering where it got to"""
+    def __init__(self, server, session_id, **query):
+        query = '&'.join(f'{name}={value}' for name, value in query.items())
+        self.url = f'ws://localhost:{server.ws_port}/ws/{session_id}?{query}'
+    
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        await self.websocket.send(OP_RESIZE + json.dumps({'rows': 24, 'cols': 80}))
+        while True:
+            message = await self.websocket.recv()
+            if isinstance(message, str):
+                self.hello = json.loads(message)
+                assert self.hello['type'] == 'hello'
+                break
+        self.replay = b''
+        while len(self.replay) < self.hello['replay']:
+            self.replay += await self.websocket.recv()
+        assert len(self.replay) == self.hello['replay']
+        self.output = b''
+        return self
+    
+    @property
+    def offset(self):
+        return self.hello['offset'] + len(self.output)
+    
+    async def read_until(self, marker, timeout=10):
+        async def scan():
+            while marker not in self.output:
+                message = await self.websocket.recv()
+                if isinstance(message, bytes):
+                    self.output += message
+        await asyncio.wait_for(scan(), timeout)
+    
+    async def run(self, command, marker):
+        # $(...) keeps the marker itself out of the echoed command line
+        await self.websocket.send(OP_INPUT + f'{command}; echo {marker}_$(echo DONE)\r')
+        await self.read_until(f'{marker}_DONE'.encode())
+    
+    async def close(self):
+        await self.websocket.close()
+
+def test_resume_sends_only_missed_output(live):
+    server = live(screen_model=False)
+    session = server.run_on_loop(server.sessions.create)
+    
+    async def scenario():
+        first = await Client(server, session.id).connect()
+        assert first.hello['reset'] and first.hello['session'] == session.id
+        await first.run('echo one', 'FIRST')
+        offset = first.offset
+        await first.close()
+        
+        # Output produced while the first client is away
+        other = await Client(server, session.id).connect()
+        await other.run('echo two', 'SECOND')
+        await other.close()
+        
+        resumed = await Client(server, session.id, instance=first.hello['instance'],
+                               offset=offset).connect()
+        assert not resumed.hello['reset']
+        assert b'SECOND_DONE' in resumed.replay and b'FIRST_DONE' not in resumed.replay
+        # Resuming at the new offset continues the stream seamlessly
+        assert resumed.hello['offset'] == offset + len(resumed.replay)
+        await resumed.run('echo three', 'THIRD')
+        await resumed.close()
+        
+        # Another instance's offsets mean nothing here: replay everything held
+        stranger = await Client(server, session.id, instance='other', offset=offset).connect()
+        assert stranger.hello['reset']
+        assert b'FIRST_DONE' in stranger.replay and b'THIRD_DONE' in stranger.replay
+        await stranger.close()
+    asyncio.run(scenario())
+
+def test_resume_past_the_buffer_resets(live):
+    server = live(screen_model=False, scrollback_bytes=4096)
+    session = server.run_on_loop(server.sessions.create)
+    
+    async def scenario():
+        client = await Client(server, session.id).connect()
+        await client.run('true', 'READY')
+        offset = client.offset
+        await client.run('head -c 20000 /dev/zero | tr "\\0" x', 'FLOOD')
+        await client.close()
+        
+        late = await Client(server, session.id, instance=client.hello['instance'],
+                            offset=offset).connect()
+        assert late.hello['reset']
+        # What's still buffered starts after the offset asked for
+        assert late.hello['offset'] - late.hello['replay'] > offset
+        assert b'FLOOD_DONE' in late.replay
+        await late.close()
+    asyncio.run(scenario())
+
+def test_attach_with_screen_model_sends_snapshot(live):
+    server = live(screen_model=True)
+    session = server.run_on_loop(server.sessions.create)
+    
+    async def scenario():
+        client = await Client(server, session.id).connect()
+        await client.run('clear; echo hello', 'SHOWN')
+        await client.close()
+        
+        fresh = await Client(server, session.id).connect()
+        assert fresh.hello['reset']
+        # A redraw of the screen, not the raw stream: the clear is gone
+        prefix = b'\x1b[0m\x1b[H\x1b[2J'
+        assert fresh.replay.startswith(prefix)
+        assert b'SHOWN_DONE' in fresh.replay and b'\x1b[2J' not in fresh.replay[len(prefix):]
+        await fresh.close()
+    asyncio.run(scenario())
@@ -0,0 +1,135 @@
+import os
+import json
+
+import pytest
+
+from proper_terminal import apply_text_edits, edits_apply_cleanly, file_version, utf16_length
+
+def test_apply_text_edits_in_order():
+    text = apply_text_edits('hello world', [
+        {'offset': 6, 'length': 5, 'text': 'there'},
+        {'offset': 0, 'length': 0, 'text': '>> '},
+    ])
+    assert text == '>> hello there'
+
+def test_apply_text_edits_counts_utf16_units():
+    # The emoji is two UTF-16 units, as Monaco counts it
+    assert apply_text_edits('a😀b', [{'offset': 3, 'length': 1, 'text': 'c'}]) == 'a😀c'
+    assert utf16_length('a😀b') == 4
+
+@pytest.mark.parametrize('edit', [
+    {'offset': 5, 'length': 1, 'text': ''},
+    {'offset': -1, 'length': 0, 'text': ''},
+    {'offset': 2, 'length': 0, 'text': 'x'},  # inside the surrogate pair
+])
+def test_apply_text_edits_rejects_bad_ranges(edit):
+    with pytest.raises(ValueError):
+        apply_text_edits('a😀b', [edit])
+
+@pytest.mark.parametrize('text, clean', [
+    ('a\nb\n', True),
+    ('a\r\nb\r\n', True),
+    ('', True),
+    ('a\r\nb\n', False),   # mixed endings
+    ('a\rb', False),       # lone CR
+    ('\ufeffa\n', False),  # BOM
+])
+def test_edits_apply_cleanly(text, clean):
+    assert edits_apply_cleanly(text) == clean
+
+def test_file_version_changes_with_content_at_same_stat(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_bytes(b'aaaa')
+    st = os.stat(path)
+    assert file_version(st, b'aaaa') != file_version(st, b'bbbb')
+    assert file_version(st, b'aaaa') == file_version(st, b'aaaa')
+
+def load(http, name):
+    status, _, body = http('/api/file/' + name)
+    assert status == 200
+    return json.loads(body)
+
+def save(http, name, headers=None, **body):
+    headers = {'Content-Type': 'application/json', **(headers or {})}
+    status, _, data = http('/api/save/' + name, 'POST', json.dumps(body).encode(), headers)
+    return status, json.loads(data)
+
+def test_delta_save(http, tmp_path):
+    (tmp_path / 'a.txt').write_text('one\ntwo\n')
+    loaded = load(http, 'a.txt')
+    assert loaded['deltas']
+    
+    status, result = save(http, 'a.txt', base=loaded['version'], length=10,
+                          edits=[{'offset': 4, 'length': 3, 'text': 'three'}])
+    assert status == 200 and result['success']
+    assert (tmp_path / 'a.txt').read_text() == 'one\nthree\n'
+    assert result['version'] == load(http, 'a.txt')['version']
+
+def test_save_conflict_when_changed_on_disk(http, tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('one\n')
+    loaded = load(http, 'a.txt')
+    
+    # Same size, same mtime: only the contents tell the versions apart
+    st = os.stat(path)
+    path.write_text('two\n')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    
+    status, result = save(http, 'a.txt', base=loaded['version'], content='mine\n')
+    assert status == 409 and result['conflict']
+    assert path.read_text() == 'two\n'
+
+@pytest.mark.parametrize('original', [b'one\r\ntwo\nthree\n', b'\xef\xbb\xbfone\ntwo\n'])
+def test_delta_save_refused_when_offsets_would_not_match(http, tmp_path, original):
+    path = tmp_path / 'a.txt'
+    path.write_bytes(original)
+    loaded = load(http, 'a.txt')
+    assert not loaded['deltas']
+    
+    status, result = save(http, 'a.txt', base=loaded['version'], length=3,
+                          edits=[{'offset': 0, 'length': 3, 'text': 'ONE'}])
+    assert status == 409 and result['resend']
+    assert path.read_bytes() == original
+
+def test_delta_save_refused_on_length_mismatch(http, tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('one\n')
+    loaded = load(http, 'a.txt')
+    status, result = save(http, 'a.txt', base=loaded['version'], length=99,
+                          edits=[{'offset': 0, 'length': 3, 'text': 'ONE'}])
+    assert status == 409 and result['resend']
+    assert path.read_text() == 'one\n'
+
+def test_save_outside_workspace_is_refused(http):
+    status, result = save(http, '../escape.txt', content='x')
+    assert status == 403
+
+def test_save_needs_json(http, tmp_path):
+    # A text/plain POST needs no CORS preflight, so any page could send one
+    status, _, _ = http('/api/save/evil.txt', 'POST', json.dumps({'content': 'x'}).encode(),
+                        {'Content-Type': 'text/plain'})
+    assert status == 415
+    assert not (tmp_path / 'evil.txt').exists()
+    assert save(http, 'ok.txt', headers={'Content-Type': 'application/json; charset=utf-8'},
+                content='x')[0] == 200
+
+def test_save_refuses_cross_origin(http, tmp_path):
+    headers = {'Origin': 'http://evil.example', 'Host': 'localhost:8080'}
+    assert save(http, 'evil.txt', headers=headers, content='x')[0] == 403
+    assert not (tmp_path / 'evil.txt').exists()
+    headers['Origin'] = 'http://localhost:8080'
+    assert save(http, 'ok.txt', headers=headers, content='x')[0] == 200
+
+@pytest.mark.parametrize('body', [
+    {'content': 5},
+    {'content': None},
+    {'content': 'x', 'base': 5},
+    {'base': 'v', 'edits': {'offset': 0}, 'length': 1},
+    {'base': 'v', 'edits': [{'offset': 0, 'length': 0, 'text': 5}], 'length': 1},
+    {'base': 'v', 'edits': [{'offset': '0', 'length': 0, 'text': ''}], 'length': 1},
+    {'base': 'v', 'edits': ['x'], 'length': 1},
+])
+def test_save_rejects_bad_types(http, tmp_path, body):
+    (tmp_path / 'a.txt').write_text('abc')
+    assert save(http, 'a.txt', **body)[0] == 400
+    assert (tmp_path / 'a.txt').read_text() == 'abc'
@@ -0,0 +1,88 @@
+from proper_terminal import ScreenModel
+
+def lines(grid):
+    return [''.join(ch for ch, _ in row).rstrip() for row in grid]
+
+def model(data, rows=5, cols=10):
+    screen = ScreenModel(rows, cols)
+    screen.feed(data)
+    return screen
+
+def replay(screen):
+    """A fresh model fed screen's snapshot"""
+    return model(screen.snapshot().encode(), screen.rows, screen.cols)
+
+def assert_same(screen, copy):
+    assert copy.main == screen.main
+    assert list(copy.history) == list(screen.history)
+    assert (copy.grid is copy.alt) == (screen.grid is screen.alt)
+    if screen.grid is screen.alt:
+        assert copy.alt == screen.alt
+    assert (copy.y, copy.x, copy.attr) == (screen.y, screen.x, screen.attr)
+    assert (copy.top, copy.bottom) == (screen.top, screen.bottom)
+    assert copy.modes == screen.modes
+    assert (copy.cursor_visible, copy.autowrap) == (screen.cursor_visible, screen.autowrap)
+
+def test_text_and_wrapping():
+    screen = model(b'hello\r\nworld, wrapped')
+    assert lines(screen.main) == ['hello', 'world, wra', 'pped', '', '']
+    assert (screen.y, screen.x) == (2, 4)
+
+def test_cursor_movement_and_erase():
+    screen = model(b'aaaaaaaaaa\r\nbbbbbbbbbb\r\ncccccccccc\x1b[2;3H\x1b[K\x1b[1;5H\x1b[1KX')
+    assert lines(screen.main) == ['    Xaaaaa', 'bb', 'cccccccccc', '', '']
+    screen.feed(b'\x1b[J')
+    assert lines(screen.main) == ['    X', '', '', '', '']
+
+def test_scrolling_into_history():
+    screen = model(b''.join(b'line%d\r\n' % i for i in range(8)))
+    assert list(lines(screen.history)) == ['line0', 'line1', 'line2', 'line3']
+    assert lines(screen.main) == ['line4', 'line5', 'line6', 'line7', '']
+
+def test_scroll_region():
+    screen = model(b'1\r\n2\r\n3\r\n4\r\n5\x1b[2;4r\x1b[4;1H\n')
+    assert lines(screen.main) == ['1', '3', '4', '', '5']
+    # Lines scrolled out of a region don't go to the history
+    assert not screen.history
+
+def test_split_utf8_and_escapes():
+    screen = ScreenModel(3, 10)
+    for byte in 'é\x1b[1;31mr\x1b[0m€'.encode():
+        screen.feed(bytes([byte]))
+    assert lines(screen.main) == ['ér€', '', '']
+    assert screen.main[0][1][1] == (('1',), '31', None)
+    assert screen.main[0][2][1] == ScreenModel.DEFAULT_ATTR
+
+def test_snapshot_round_trip():
+    screen = model(b''.join(b'line%d\r\n' % i for i in range(7)) +
+                   b'\x1b[1;4;32;44mgreen\x1b[0m plain\x1b[2;4r\x1b[3;2H\x1b[7m\x1b[?2004h\x1b[?25l')
+    assert_same(screen, replay(screen))
+
+def test_snapshot_round_trip_alternate_screen():
+    screen = model(b'shell$ vim\r\n\x1b[?1049h\x1b[H\x1b[2J~\r\n~ file\x1b[1;3H')
+    copy = replay(screen)
+    assert_same(screen, copy)
+    
+    # Leaving the alternate screen restores the main screen and its cursor
+    for s in (screen, copy):
+        s.feed(b'\x1b[?1049l')
+    assert lines(copy.main) == lines(screen.main) == ['shell$ vim', '', '', '', '']
+    assert (copy.y, copy.x) == (screen.y, screen.x) == (1, 0)
+
+def test_snapshot_without_autowrap():
+    screen = model(b'\x1b[?7labcdefghijklmn')
+    assert lines(screen.main)[0] == 'abcdefghin'
+    assert_same(screen, replay(screen))
+
+def test_resize_keeps_cursor_line():
+    screen = model(b'1\r\n2\r\n3\r\n4\r\n5')
+    screen.resize(3, 4)
+    assert lines(screen.main) == ['3', '4', '5']
+    assert lines(screen.history) == ['1', '2']
+    assert (screen.y, screen.x) == (2, 1)
+    
+    screen = model(b'top\r\nnext')
+    screen.resize(3, 10)
+    # Blank lines below the cursor go first
+    assert lines(screen.main) == ['top', 'next', '']
+    assert not screen.history
@@ -0,0 +1,96 @@
+import os
+import json
+import concurrent.futures
+
+import pytest
+
+import proper_terminal
+from proper_terminal import (IgnoreRules, TrigramIndex, WorkspaceSearch, file_trigrams,
+                             fold_trigrams, search_files)
+
+def write(root, files):
+    for relpath, data in files.items():
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+@pytest.fixture
+def pool():
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        yield pool
+
+def test_search_files(tmp_path):
+    write(tmp_path, {'a.txt': b'one\nHello world\n', 'b.bin': b'hello\x00\x01', 'c.txt': b'nothing'})
+    searched, matches = search_files(str(tmp_path), ['a.txt', 'b.bin', 'c.txt'], 'hello', True, True)
+    # Binary files are skipped, not counted as searched
+    assert searched == 2
+    assert matches == [('a.txt', 2, 1, 'Hello world')]
+    assert search_files(str(tmp_path), ['a.txt'], 'hello', True, False)[1] == []
+    assert search_files(str(tmp_path), ['a.txt'], r'w\w+d', False, False)[1] == [('a.txt', 2, 7, 'Hello world')]
+
+def test_fold_matches_smaller_filter(tmp_path):
+    data = bytes(range(32, 127)) * 4
+    write(tmp_path, {'a.txt': data})
+    (_, _, _, bits, mask), = file_trigrams(str(tmp_path), [('a.txt', 0, len(data))])
+    assert bits > 64
+    folded_bits, folded = fold_trigrams(bits, mask, 64)
+    expected = 0
+    lowered = data.lower()
+    for i in range(len(lowered) - 2):
+        expected |= 1 << (proper_terminal.trigram_hash(lowered[i:i + 3]) % 64)
+    assert (folded_bits, folded) == (64, expected)
+
+def test_index_candidates(tmp_path, pool):
+    root = tmp_path / 'ws'
+    write(root, {'a.txt': b'the needle is here', 'b.txt': b'only hay', 'c.bin': b'needle\x00'})
+    index = TrigramIndex(str(root), IgnoreRules(str(root)), cache_dir=str(tmp_path / 'cache'))
+    assert not index.ready.is_set()
+    assert index.refresh(pool) == 3
+    assert index.candidates(b'Needle') == (['a.txt'], 0)
+    
+    # Changed and new files are searched until they're re-indexed
+    write(root, {'b.txt': b'more hay now', 'd.txt': b'new'})
+    assert index.candidates(b'needle') == (['a.txt', 'b.txt', 'd.txt'], 2)
+    assert index.refresh(pool) == 2
+    assert index.candidates(b'needle') == (['a.txt'], 0)
+    
+    # A saved index is ready to query as soon as it's loaded
+    loaded = TrigramIndex(str(root), IgnoreRules(str(root)), cache_dir=str(tmp_path / 'cache'))
+    assert loaded.ready.is_set()
+    assert loaded.candidates(b'needle') == (['a.txt'], 0)
+
+def test_index_size_is_capped(tmp_path, pool, monkeypatch):
+    root = tmp_path / 'ws'
+    files = {f'{i}.txt': os.urandom(4096).hex().encode() + b' needle' * (i == 3) for i in range(8)}
+    write(root, files)
+    monkeypatch.setattr(proper_terminal, 'TRIGRAM_INDEX_MAX_BYTES', 8 * 128)
+    index = TrigramIndex(str(root), IgnoreRules(str(root)), cache_dir=str(tmp_path / 'cache'))
+    index.refresh(pool)
+    assert sum(bits for _, _, bits, _ in index.files.values()) // 8 <= 8 * 128
+    # Smaller filters let more files through, but never drop a match
+    assert '3.txt' in index.candidates(b'needle')[0]
+
+def test_index_builds_in_background(tmp_path, pool):
+    root = tmp_path / 'ws'
+    write(root, {'a.txt': b'needle', 'b.txt': b'hay'})
+    search = WorkspaceSearch(str(root), IgnoreRules(str(root)))
+    search.pool = pool
+    search.index = TrigramIndex(str(root), search.ignore, cache_dir=str(tmp_path / 'cache'))
+    
+    # Until the index is ready searches walk the whole tree
+    paths, indexed = search.files('needle', True, True)
+    assert (sorted(paths), indexed) == (['a.txt', 'b.txt'], False)
+    assert search.index.ready.wait(10)
+    assert search.files('needle', True, True) == (['a.txt'], True)
+
+def test_search_route_clamps_max(server, http):
+    write(server.workspace, {'a.txt': b'x\nx\nx\n'})
+    status, headers, body = http('/api/search?q=x&max=-5')
+    assert status == 200
+    results = [json.loads(line) for line in body.splitlines()]
+    assert [r['type'] for r in results] == ['match', 'done']
+    assert results[-1]['truncated']
+    
+    assert http('/api/search?q=x&max=lots')[0] == 400
+    assert http('/api/search?q=')[0] == 400
@@ -0,0 +1,40 @@
+import os
+import json
+import time
+import asyncio
+
+import websockets
+
+from proper_terminal import OP_INPUT, OP_RESIZE
+
+async def run_in_session(server, session_id, command, marker):
+    """Run command in a session; returns the output up to marker"""
+    url = f'ws://localhost:{server.ws_port}/ws/{session_id}'
+    async with websockets.connect(url, max_size=None) as websocket:
+        await websocket.send(OP_RESIZE + json.dumps({'rows': 24, 'cols': 80}))
+        # $(...) keeps the marker itself out of the echoed command line
+        await websocket.send(OP_INPUT + f'{command}; echo {marker}_$(echo DONE)\r')
+        output = b''
+        while f'{marker}_DONE'.encode() not in output:
+            message = await asyncio.wait_for(websocket.recv(), 10)
+            if isinstance(message, bytes):
+                output += message
+        return output.decode()
+
+def test_shells_start_in_the_workspace(live, tmp_path):
+    workspace = tmp_path / 'workspace'
+    workspace.mkdir()
+    # Started from another directory, as bench.py does
+    server = live(workspace=str(workspace), shell_pool=1)
+    os.chdir('/')
+    
+    deadline = time.monotonic() + 10
+    while not server.run_on_loop(lambda: len(server.sessions.pool.shells)):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    pooled = server.run_on_loop(server.sessions.create)
+    fresh = server.run_on_loop(server.sessions.create)
+    
+    for session in (pooled, fresh):
+        output = asyncio.run(run_in_session(server, session.id, 'pwd', 'CWD'))
+        assert f'{workspace}\r\nCWD_DONE' in output
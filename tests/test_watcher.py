@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+import subprocess
+
+import pytest
+
+import proper_terminal
+from proper_terminal import InotifyWatcher, IgnoreRules
+
+def make_watcher(root):
+    return InotifyWatcher(str(root), IgnoreRules(str(root)))
+
+def test_record_merges_delete_and_create_into_modified(tmp_path):
+    watcher = make_watcher(tmp_path)
+    watcher.record('a.txt', {'type': 'deleted', 'path': 'a.txt', 'is_dir': False})
+    watcher.record('a.txt', {'type': 'created', 'path': 'a.txt', 'is_dir': False})
+    watcher.record('a.txt', {'type': 'modified', 'path': 'a.txt', 'is_dir': False})
+    assert list(watcher.pending.values()) == [{'type': 'modified', 'path': 'a.txt', 'is_dir': False}]
+
+def test_record_drops_files_created_and_deleted_in_one_batch(tmp_path):
+    watcher = make_watcher(tmp_path)
+    watcher.record('tmp', {'type': 'created', 'path': 'tmp', 'is_dir': False})
+    watcher.record('tmp', {'type': 'modified', 'path': 'tmp', 'is_dir': False})
+    watcher.record('tmp', {'type': 'deleted', 'path': 'tmp', 'is_dir': False})
+    assert watcher.pending == {}
+
+def test_record_keeps_directory_recreation_as_created(tmp_path):
+    watcher = make_watcher(tmp_path)
+    watcher.record('d', {'type': 'deleted', 'path': 'd', 'is_dir': True})
+    watcher.record('d', {'type': 'created', 'path': 'd', 'is_dir': True})
+    assert watcher.pending['d']['type'] == 'created'
+
+needs_inotify = pytest.mark.skipif(not InotifyWatcher.available(), reason="inotify not available")
+
+def watch_batches(root, change):
+    """Events the watcher reports for change(), which runs once watching"""
+    async def run():
+        watcher = make_watcher(root)
+        batches = []
+        watcher.listeners.append(batches.append)
+        await watcher.start(asyncio.get_running_loop())
+        await asyncio.to_thread(change)
+        await asyncio.sleep(proper_terminal.WATCH_COALESCE_DELAY * 5)
+        os.close(watcher.fd)
+        return [event for batch in batches for event in batch]
+    return asyncio.run(run())
+
+def git(root, *args):
+    subprocess.run(['git', '-C', str(root), '-c', 'user.name=t', '-c', 'user.email=t@t', *args],
+                   check=True, capture_output=True)
+
+@needs_inotify
+def test_git_checkout_reports_modified(tmp_path):
+    (tmp_path / 'a.txt').write_text('one\n')
+    git(tmp_path, 'init', '-q')
+    git(tmp_path, 'add', 'a.txt')
+    git(tmp_path, 'commit', '-q', '-m', 'init')
+    (tmp_path / 'a.txt').write_text('two\n')
+    
+    events = watch_batches(tmp_path, lambda: git(tmp_path, 'checkout', '--', 'a.txt'))
+    assert {'type': 'modified', 'path': 'a.txt', 'is_dir': False} in events
+    assert not [event for event in events if event['type'] in ('created', 'deleted')]
+
+@needs_inotify
+def test_save_through_rename_reports_modified(tmp_path):
+    (tmp_path / 'a.txt').write_text('one\n')
+    def save():
+        # What sed -i and most editors do
+        with open(tmp_path / 'sedXYZ', 'w') as f:
+            f.write('two\n')
+        os.rename(tmp_path / 'sedXYZ', tmp_path / 'a.txt')
+    
+    events = watch_batches(tmp_path, save)
+    assert events == [{'type': 'modified', 'path': 'a.txt', 'is_dir': False}]
+
+@needs_inotify
+def test_atomic_write_reports_modified(tmp_path):
+    # The editor's own saves rename a hidden temporary over the file;
+    # the temporary is never reported, so the rename has no source
+    (tmp_path / 'a.txt').write_text('one\n')
+    events = watch_batches(tmp_path, lambda: proper_terminal.atomic_write(str(tmp_path / 'a.txt'), b'two\n'))
+    assert events == [{'type': 'modified', 'path': 'a.txt', 'is_dir': False}]
+
+@needs_inotify
+def test_rename_to_new_name_is_a_rename(tmp_path):
+    (tmp_path / 'a.txt').write_text('one\n')
+    events = watch_batches(tmp_path, lambda: os.rename(tmp_path / 'a.txt', tmp_path / 'b.txt'))
+    assert events == [{'type': 'renamed', 'path': 'b.txt', 'from': 'a.txt', 'is_dir': False}]
+
+@needs_inotify
+def test_new_directories_are_watched(tmp_path):
+    def change():
+        os.makedirs(tmp_path / 'a' / 'b')
+        (tmp_path / 'a' / 'b' / 'f.txt').write_text('one\n')
+        time.sleep(proper_terminal.WATCH_COALESCE_DELAY * 3)
+        (tmp_path / 'a' / 'b' / 'f.txt').write_text('two\n')
+    
+    events = watch_batches(tmp_path, change)
+    assert {'type': 'created', 'path': 'a', 'is_dir': True} in events
+    assert {'type': 'modified', 'path': 'a/b/f.txt', 'is_dir': False} in events
+
+@needs_inotify
+def test_gitignore_changes_apply(tmp_path):
+    def change():
+        (tmp_path / '.gitignore').write_text('*.log\n')
+        time.sleep(proper_terminal.WATCH_COALESCE_DELAY * 3)
+        (tmp_path / 'x.log').write_text('ignored\n')
+        (tmp_path / 'x.txt').write_text('shown\n')
+    
+    paths = {event['path'] for event in watch_batches(tmp_path, change)}
+    assert 'x.txt' in paths
+    assert 'x.log' not in paths
+
+@needs_inotify
+def test_scan_only_reports_and_add_tree_keeps_newer_paths(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    watcher = make_watcher(tmp_path)
+    watcher.fd = watcher.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    try:
+        # The scan runs off the loop, so it must leave the watch table alone
+        found = watcher.scan_tree('a')
+        assert watcher.watches == {}
+        assert sorted(relpath for _, relpath, _, _ in found) == ['a', 'a/b']
+        
+        # A rename handled on the loop while the scan ran wins over the scan
+        wd = next(wd for wd, relpath, _, _ in found if relpath == 'a/b')
+        watcher.watches[wd] = 'a/renamed'
+        watcher.add_tree(found)
+        assert sorted(watcher.watches.values()) == ['a', 'a/renamed']
+    finally:
+        os.close(watcher.fd)
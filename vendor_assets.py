@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Fetch the pinned xterm.js and Monaco builds into static/ for offline use.
+
+Run this on a machine with network access; copy the resulting static/
+directory along with proper_terminal.py to air-gapped hosts. When
+static/manifest.json is present the IDE serves these files itself,
+otherwise the pages fall back to the jsDelivr CDN.
+"""
+
+import os
+import sys
+import io
+import json
+import gzip
+import base64
+import shutil
+import hashlib
+import tarfile
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+REGISTRY = 'https://registry.npmjs.org'
+
+# (package, version, files or directory prefixes to keep from the tarball)
+PACKAGES = [
+    ('xterm', '5.3.0', ['lib/xterm.js', 'css/xterm.css']),
+    ('@xterm/addon-fit', '0.10.0', ['lib/addon-fit.js']),
+    ('monaco-editor', '0.45.0', ['min/vs/']),
+]
+
+# Files worth storing precompressed variants of
+COMPRESSIBLE = ('.js', '.css', '.json', '.html', '.svg', '.ttf')
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+def verify(data, integrity):
+    """Check a tarball against the registry's sha512 integrity string"""
+    algorithm, _, expected = integrity.partition('-')
+    actual = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+    if actual != expected:
+        raise ValueError(f"integrity mismatch: expected {integrity}")
+
+def extract(name, version, keep):
+    """Download name@version and unpack the kept files; returns their paths"""
+    meta = json.loads(fetch(f'{REGISTRY}/{name}/{version}'))
+    tarball = fetch(meta['dist']['tarball'])
+    verify(tarball, meta['dist']['integrity'])
+
+    target = os.path.join(STATIC_DIR, f'{name}@{version}')
+    shutil.rmtree(target, ignore_errors=True)
+    written = []
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode='r:gz') as tar:
+        for member in tar.getmembers():
+            # npm tarballs put everything under package/
+            relpath = member.name.split('/', 1)[1] if '/' in member.name else ''
+            if not member.isfile() or not any(
+                    relpath == k or (k.endswith('/') and relpath.startswith(k)) for k in keep):
+                continue
+            path = os.path.normpath(os.path.join(target, relpath))
+            if not path.startswith(target + os.sep):
+                raise ValueError(f"unsafe path in tarball: {member.name}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(tar.extractfile(member).read())
+            written.append(path)
+    print(f"{name}@{version}: {len(written)} files")
+    return written
+
+def precompress(path):
+    """Write .gz (and .br, if brotli is installed) next to path when smaller"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+def main():
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    files = []
+    for name, version, keep in PACKAGES:
+        files += extract(name, version, keep)
+
+    if brotli is None:
+        print("brotli not installed; writing gzip variants only")
+    for path in files:
+        if path.endswith(COMPRESSIBLE):
+            precompress(path)
+
+    # The bundle hash goes into every asset URL, so browsers can cache
+    # them forever and a re-vendored bundle gets fresh URLs
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        with open(path, 'rb') as f:
+            digest.update(os.path.relpath(path, STATIC_DIR).encode() + b'\0')
+            digest.update(hashlib.sha256(f.read()).digest())
+    manifest = {
+        'hash': digest.hexdigest()[:16],
+        'packages': {name: version for name, version, _ in PACKAGES},
+    }
+    with open(os.path.join(STATIC_DIR, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {STATIC_DIR} (bundle {manifest['hash']})")
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        print(f"Vendoring failed: {e}")
+        sys.exit(1)